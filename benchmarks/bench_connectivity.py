@@ -0,0 +1,97 @@
+import argparse
+import sys
+import os
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import logging
+from src.logging_config import setup_logging
+import numpy as np
+
+from src.connectivity import ring_local_distant, fixed_indegree, fixed_probability, connect_pairs
+
+
+def legacy_ring(n, local_radius=10, p_local=0.3, p_distant=0.05):
+    # The original per-neuron loop from run_simulation, kept as the reference point.
+    pairs = []
+    for i in range(n):
+        local_targets = list(range(max(0, i-local_radius), min(n, i+local_radius)))
+        if i in local_targets:
+            local_targets.remove(i)
+        n_local = int(len(local_targets) * p_local)
+        if n_local > 0:
+            for j in np.random.choice(local_targets, size=n_local, replace=False):
+                pairs.append((i, j))
+        distant_targets = [j for j in range(n) if abs(i-j) > local_radius]
+        n_distant = int(len(distant_targets) * p_distant)
+        if n_distant > 0:
+            for j in np.random.choice(distant_targets, size=n_distant, replace=False):
+                pairs.append((i, j))
+    return pairs
+
+
+def time_call(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def time_brian2_connect(n, i, j):
+    from brian2 import NeuronGroup, Synapses, start_scope, prefs
+    prefs.codegen.target = 'numpy'
+    start_scope()
+    group = NeuronGroup(n, 'v : 1')
+    syn = Synapses(group, group, 'w_syn : 1')
+    elapsed, _ = time_call(connect_pairs, syn, i, j)
+    return elapsed
+
+
+def run_benchmark(sizes, distant_outdegree, indegree, legacy_max_n, brian2_max_n, seed):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for n in sizes:
+        # Keep the expected distant out-degree fixed so memory stays linear in N.
+        p_distant = min(0.05, distant_outdegree / n)
+        row = {'n': n, 'p_distant': p_distant}
+
+        row['ring_s'], (i, j) = time_call(ring_local_distant, n, p_distant=p_distant, rng=rng)
+        row['ring_synapses'] = len(i)
+        if n <= brian2_max_n:
+            row['brian2_connect_s'] = time_brian2_connect(n, i, j)
+        del i, j
+
+        row['indegree_s'], (i, _) = time_call(fixed_indegree, n, n, indegree, rng=rng)
+        row['indegree_synapses'] = len(i)
+        del i
+
+        row['probability_s'], (i, _) = time_call(fixed_probability, n, n, indegree / n, rng=rng)
+        row['probability_synapses'] = len(i)
+        del i
+
+        if n <= legacy_max_n:
+            row['legacy_ring_s'], _ = time_call(legacy_ring, n, p_distant=p_distant)
+
+        logging.info(
+            f"N={n:>7d}  ring {row['ring_s']:8.3f}s ({row['ring_synapses']} syn)"
+            f"  indegree {row['indegree_s']:8.3f}s  probability {row['probability_s']:8.3f}s"
+            + (f"  brian2 connect {row['brian2_connect_s']:8.3f}s" if 'brian2_connect_s' in row else '')
+            + (f"  legacy {row['legacy_ring_s']:8.3f}s" if 'legacy_ring_s' in row else '')
+        )
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark connectivity build time versus network size.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[120, 1000, 3000, 10000, 30000, 100000],
+                        help='Network sizes to benchmark.')
+    parser.add_argument('--distant-outdegree', type=float, default=50.0,
+                        help='Expected number of distant targets per neuron (caps p_distant at 0.05).')
+    parser.add_argument('--indegree', type=int, default=100, help='In-degree for the fixed in-degree and probability rules.')
+    parser.add_argument('--legacy-max-n', type=int, default=3000, help='Largest N to time the legacy Python loop at.')
+    parser.add_argument('--brian2-max-n', type=int, default=0, help='Largest N to also time the bulk Synapses.connect call at.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    setup_logging()
+    run_benchmark(args.sizes, args.distant_outdegree, args.indegree,
+                  args.legacy_max_n, args.brian2_max_n, args.seed)
@@ -0,0 +1,355 @@
+import argparse
+import sys
+import os
+import json
+import time
+import uuid
+import socket
+import platform
+import resource
+import datetime
+import tempfile
+import subprocess
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+import logging
+from src.logging_config import setup_logging
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_HISTORY = os.path.join(BENCHMARK_DIR, 'history.jsonl')
+
+# Every simulation entry point at three sizes. Durations are in seconds; all
+# inputs are synthetic (run_simulation_point takes a rate, not an Allen session).
+CASES = {
+    'run_simulation': {
+        'target': 'run_simulation:run_simulation_point',
+        'scales': {
+            'small': {'duration': 0.5, 'kwargs': {'scale': 1}},
+            'medium': {'duration': 1.0, 'kwargs': {'scale': 10}},
+            'large': {'duration': 1.0, 'kwargs': {'scale': 100}},
+        },
+    },
+    'simple_lif': {
+        'target': 'simple_lif_simulation:run_simple_lif_simulation',
+        'scales': {
+            'small': {'duration': 0.5, 'kwargs': {'n_neurons': 100}},
+            'medium': {'duration': 1.0, 'kwargs': {'n_neurons': 500}},
+            'large': {'duration': 2.0, 'kwargs': {'n_neurons': 2000}},
+        },
+    },
+    'one_back': {
+        'target': 'one_back_task_simulation:run_one_back_task_simulation',
+        'scales': {
+            'small': {'duration': 0.5, 'kwargs': {'n_neurons': 20}},
+            'medium': {'duration': 1.0, 'kwargs': {'n_neurons': 200}},
+            'large': {'duration': 2.0, 'kwargs': {'n_neurons': 2000}},
+        },
+    },
+    # Many small 1-back trials batched into one network (see src/ensemble.py).
+    'one_back_ensemble': {
+        'target': 'one_back_task_simulation:run_one_back_task_simulation',
+        'scales': {
+            'small': {'duration': 0.5, 'kwargs': {'n_neurons': 20, 'n_replicas': 10}},
+            'medium': {'duration': 0.5, 'kwargs': {'n_neurons': 20, 'n_replicas': 100}},
+            'large': {'duration': 0.5, 'kwargs': {'n_neurons': 20, 'n_replicas': 1000}},
+        },
+    },
+    'adex': {
+        'target': 'adex_simulation_demo:run_adex_simulation',
+        'scales': {
+            'small': {'duration': 0.2, 'kwargs': {'n_neurons': 1}},
+            'medium': {'duration': 0.5, 'kwargs': {'n_neurons': 100}},
+            'large': {'duration': 1.0, 'kwargs': {'n_neurons': 10000}},
+        },
+    },
+    'cognitive_analysis': {
+        'target': 'run_cognitive_analysis:run_analysis_simulation',
+        'scales': {
+            'small': {'duration': 0.5, 'kwargs': {'n_neurons': 100}},
+            'medium': {'duration': 1.0, 'kwargs': {'n_neurons': 1000}},
+            'large': {'duration': 2.0, 'kwargs': {'n_neurons': 10000}},
+        },
+    },
+}
+
+# Lower is better for all of these; compare flags growth beyond the threshold.
+COMPARED_METRICS = ('wall_s', 'build_s', 'run_s', 'peak_rss_mb')
+
+# Importing an entry point (the simulation-only path, no plotting) must stay below
+# this many seconds and must not load matplotlib.pyplot, scipy.signal and the like.
+IMPORT_BUDGET_S = 2.0
+# The benchmarked entry points plus the scripts that only build or fan out runs.
+IMPORT_MODULES = sorted({CASES[case]['target'].split(':')[0] for case in CASES}
+                        | {'neuromodulation_demo', 'run_sweep', 'simulation_worker'})
+IMPORT_CHECK = '''
+import sys, json, time
+sys.path[:0] = [{root!r}, {scripts!r}]
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+from src.startup import heavy_modules
+print(json.dumps({{'import_s': elapsed, 'heavy_modules': heavy_modules()}}))
+'''
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure_case(case, scale, backend, cache_dir):
+    # Runs inside the child process, so imports, RSS and Brian2 state start clean.
+    start_time = time.perf_counter()
+    from src.startup import skip_pylab
+    skip_pylab()
+    import brian2
+    from brian2 import second, NeuronGroup, PoissonGroup, SpikeGeneratorGroup, SpikeMonitor, Synapses
+    from src.backend import configure_backend, add_run_hook, last_run_timings
+    from src.sweep import resolve_target
+
+    configure_backend(backend, cache_dir)
+    spec = CASES[case]['scales'][scale]
+    counters = {}
+    networks = []
+
+    def attach_counters(net):
+        # Count-only monitors on every spiking group, so spikes and synaptic
+        # events are measured the same way for every entry point.
+        networks.append(net)
+        for obj in list(net.objects):
+            if (isinstance(obj, (NeuronGroup, PoissonGroup, SpikeGeneratorGroup)) and 'spike' in obj.events
+                    and obj.name not in counters):
+                counters[obj.name] = SpikeMonitor(obj, record=False, name=f'benchmark_count_{obj.name}')
+                net.add(counters[obj.name])
+
+    add_run_hook(attach_counters)
+    target = resolve_target(CASES[case]['target'])
+    target(duration=spec['duration'] * second, **spec['kwargs'])
+    wall = time.perf_counter() - start_time
+    timings = last_run_timings()
+
+    n_neurons = n_synapses = synaptic_events = 0
+    for net in networks:
+        for obj in net.objects:
+            if obj.name in counters:
+                n_neurons += len(obj)
+            elif isinstance(obj, Synapses) and 'pre' in getattr(obj, '_synaptic_updaters', {}):
+                n_synapses += len(obj)
+                source = getattr(obj.source, 'name', None)
+                if source in counters:
+                    spike_counts = np.asarray(counters[source].count)
+                    synaptic_events += int(np.sum(spike_counts[np.asarray(obj.i)]))
+    spikes = sum(int(monitor.num_spikes) for monitor in counters.values())
+
+    run_s = timings['run']
+    return {
+        'brian2': brian2.__version__,
+        'simulated_s': spec['duration'],
+        'wall_s': wall,
+        'startup_to_first_step_s': timings['startup_to_first_step'],
+        'build_s': timings['build'],
+        'run_s': run_s,
+        # ru_maxrss is in kilobytes on Linux.
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'n_neurons': n_neurons,
+        'n_synapses': n_synapses,
+        'spikes': spikes,
+        'spikes_per_s': spikes / run_s if run_s else None,
+        'synaptic_events': synaptic_events,
+        'synaptic_events_per_s': synaptic_events / run_s if run_s else None,
+        # Wall-clock seconds per simulated second; below 1 is faster than real time.
+        'realtime_factor': run_s / spec['duration'],
+    }
+
+
+def run_child(args):
+    logging.basicConfig(level=logging.WARNING)
+    metrics = measure_case(args.case, args.scale, args.backend, args.cache_dir)
+    with open(args.output, 'w') as f:
+        json.dump(metrics, f)
+
+
+def run_case_subprocess(case, scale, backend, cache_dir, timeout, verbose):
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'metrics.json')
+        command = [sys.executable, os.path.abspath(__file__), '_child', case, scale,
+                   '--backend', backend, '--output', output]
+        if cache_dir:
+            command += ['--cache-dir', cache_dir]
+        try:
+            process = subprocess.run(command, capture_output=not verbose, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return {'error': f'timed out after {timeout} s'}
+        if process.returncode != 0 or not os.path.exists(output):
+            stderr = (process.stderr or '').strip().splitlines()
+            return {'error': stderr[-1] if stderr else f'exit code {process.returncode}'}
+        with open(output) as f:
+            return json.load(f)
+
+
+def run_benchmarks(args):
+    setup_logging()
+    run_id = uuid.uuid4().hex[:12]
+    base_record = {
+        'run_id': run_id,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'host': socket.gethostname(),
+        'python': platform.python_version(),
+        'backend': args.backend,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    logging.info(f"Benchmark run {run_id} ({args.backend}), appending to {args.history}.")
+    for case in args.cases:
+        for scale in args.scales:
+            for repeat in range(args.repeat):
+                metrics = run_case_subprocess(case, scale, args.backend, args.cache_dir, args.timeout, args.verbose)
+                record = {**base_record, 'case': case, 'scale': scale, 'repeat': repeat,
+                          'params': CASES[case]['scales'][scale], 'metrics': metrics}
+                with open(args.history, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+                if 'error' in metrics:
+                    logging.warning(f"{case}/{scale}: failed ({metrics['error']}).")
+                    continue
+                logging.info(f"{case:>18}/{scale:<6} wall {metrics['wall_s']:7.2f} s  build {metrics['build_s']:6.2f} s  "
+                             f"run {metrics['run_s']:7.2f} s  RSS {metrics['peak_rss_mb']:7.0f} MB  "
+                             f"{metrics['spikes_per_s'] or 0:10.0f} spikes/s  "
+                             f"{metrics['synaptic_events_per_s'] or 0:12.0f} events/s  RTF {metrics['realtime_factor']:.2f}")
+    return run_id
+
+
+def measure_import(module, repeat=3):
+    # Each import runs in a fresh interpreter; the fastest of `repeat` is kept.
+    code = IMPORT_CHECK.format(root=os.path.join(BENCHMARK_DIR, '..'), scripts=os.path.join(BENCHMARK_DIR, '..', 'scripts'),
+                               module=module)
+    best = None
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        if best is None or result['import_s'] < best['import_s']:
+            best = result
+    return best
+
+
+def run_import_check(args):
+    setup_logging()
+    failures = []
+    for module in IMPORT_MODULES:
+        result = measure_import(module, args.repeat)
+        problems = []
+        if result['import_s'] > args.budget:
+            problems.append(f"over the {args.budget:.2f} s budget")
+        if result['heavy_modules']:
+            problems.append(f"loads {', '.join(result['heavy_modules'])}")
+        logging.info(f"{module:>26} import {result['import_s']:6.2f} s{'  FAIL: ' + '; '.join(problems) if problems else ''}")
+        if problems:
+            failures.append(module)
+    if failures:
+        logging.warning(f"{len(failures)} entry point(s) failed the import check.")
+        sys.exit(1)
+    logging.info("All entry points import within budget.")
+
+
+def load_history(path):
+    runs = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                runs.setdefault(record['run_id'], []).append(record)
+    return runs
+
+
+def _best_metrics(records):
+    # Minimum over repeats is the least noisy estimate of each cost.
+    best = {}
+    for record in records:
+        if 'error' in record['metrics']:
+            continue
+        key = (record['case'], record['scale'], record['backend'])
+        for metric in COMPARED_METRICS:
+            value = record['metrics'].get(metric)
+            if value is not None:
+                best.setdefault(key, {})[metric] = min(value, best.get(key, {}).get(metric, value))
+    return best
+
+
+def compare_runs(history, baseline=None, candidate=None, threshold=0.1):
+    runs = load_history(history)
+    run_ids = list(runs)
+    if len(run_ids) < 2 and (baseline is None or candidate is None):
+        raise ValueError("Need at least two benchmark runs in the history to compare.")
+    candidate = candidate or run_ids[-1]
+    baseline = baseline or run_ids[run_ids.index(candidate) - 1]
+    old, new = _best_metrics(runs[baseline]), _best_metrics(runs[candidate])
+
+    rows, regressions = [], []
+    for key in sorted(set(old) & set(new)):
+        for metric in COMPARED_METRICS:
+            if metric not in old[key] or metric not in new[key] or old[key][metric] <= 0:
+                continue
+            ratio = new[key][metric] / old[key][metric]
+            row = (*key, metric, old[key][metric], new[key][metric], ratio)
+            rows.append(row)
+            if ratio > 1 + threshold:
+                regressions.append(row)
+    return baseline, candidate, rows, regressions
+
+
+def run_compare(args):
+    setup_logging()
+    baseline, candidate, rows, regressions = compare_runs(args.history, args.baseline, args.candidate, args.threshold)
+    logging.info(f"Comparing run {candidate} against baseline {baseline} (threshold {args.threshold:.0%}).")
+    for case, scale, backend, metric, old, new, ratio in rows:
+        flag = '  REGRESSION' if ratio > 1 + args.threshold else ''
+        logging.info(f"{case:>18}/{scale:<6} {backend:<14} {metric:<12} {old:10.3f} -> {new:10.3f} ({ratio - 1:+.1%}){flag}")
+    if regressions:
+        logging.warning(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}.")
+        sys.exit(1)
+    logging.info("No regressions.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every simulation entry point at several scales.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run benchmarks and append them to the history file.')
+    run_parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=list(CASES))
+    run_parser.add_argument('--scales', nargs='+', choices=['small', 'medium', 'large'], default=['small', 'medium'])
+    run_parser.add_argument('--repeat', type=int, default=1, help='Repetitions of each case.')
+    run_parser.add_argument('--backend', choices=['numpy', 'cython', 'cpp_standalone'], default='numpy')
+    run_parser.add_argument('--cache-dir', default=None, help='Build cache for compiled backends.')
+    run_parser.add_argument('--history', default=DEFAULT_HISTORY, help='JSON-lines file the results are appended to.')
+    run_parser.add_argument('--timeout', type=float, default=3600, help='Per-case timeout in seconds.')
+    run_parser.add_argument('--verbose', action='store_true', help='Show the output of each benchmark process.')
+
+    compare_parser = subparsers.add_parser('compare', help='Flag regressions between two runs in the history.')
+    compare_parser.add_argument('--history', default=DEFAULT_HISTORY)
+    compare_parser.add_argument('--baseline', default=None, help='Baseline run id (default: the run before the candidate).')
+    compare_parser.add_argument('--candidate', default=None, help='Candidate run id (default: the latest run).')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='Allowed relative slowdown, e.g. 0.1 for 10%%.')
+
+    imports_parser = subparsers.add_parser('imports', help='Check that every entry point imports within the time budget.')
+    imports_parser.add_argument('--budget', type=float, default=IMPORT_BUDGET_S, help='Allowed import time in seconds.')
+    imports_parser.add_argument('--repeat', type=int, default=3, help='Fresh-interpreter imports per module (the fastest counts).')
+
+    child_parser = subparsers.add_parser('_child')
+    child_parser.add_argument('case')
+    child_parser.add_argument('scale')
+    child_parser.add_argument('--backend', default='numpy')
+    child_parser.add_argument('--cache-dir', default=None)
+    child_parser.add_argument('--output', required=True)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run_benchmarks(args)
+    elif args.command == 'compare':
+        run_compare(args)
+    elif args.command == 'imports':
+        run_import_check(args)
+    else:
+        run_child(args)
@@ -1,29 +1,42 @@
-import matplotlib.pyplot as plt
+import argparse
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.startup import skip_pylab
+skip_pylab()
 import logging
 from src.logging_config import setup_logging
-import json
+from src.result_store import add_store_arguments, run_arguments, result_key, cached_result
 
 from brian2 import *
-from brian2 import prefs
 
-prefs.codegen.target = 'numpy'
+from src.backend import configure_backend, add_backend_arguments, prepare_run, run_network
+from src.plotting import plot_raster, add_plot_arguments
 
 from src.neuron_models import ADEX_EQS, ADEX_PARAMS
+from src.monitors import add_clock_arguments, clock_periods
+from src.recording import (record_state, read_recording, merge_policies, add_recording_arguments,
+                           recording_overrides)
 
-def run_adex_simulation(duration=1*second):
+# Recording policy (see src/recording.py): traces of the first neuron.
+RECORDING = {
+    'state': {'policy': 'subset', 'n': 1},
+}
+
+def run_adex_simulation(duration=200*ms, n_neurons=1, record_dt=None, recording=None):
+    # Traces are recorded every step by default so the spike upstrokes stay visible.
     start_scope()
 
     model_ns = {k: v for k, v in ADEX_PARAMS.items()}
+    prepare_run('adex_simulation_demo', ADEX_EQS, model_ns, n_neurons, record_dt, recording)
 
-    adex_group = NeuronGroup(1, ADEX_EQS,
+    adex_group = NeuronGroup(n_neurons, ADEX_EQS,
                              threshold='v > v_thresh',
                              reset='v = v_reset; w += b',
                              refractory='refractory_period',
                              method='exponential_euler',
-                             namespace=model_ns)
+                             namespace=model_ns,
+                             name='adex')
     
     v_rest = ADEX_PARAMS['E_L']
     v_thresh = ADEX_PARAMS['v_thresh']
@@ -33,33 +46,36 @@ def run_adex_simulation(duration=1*second):
     input_current = 0.5 * nA
     adex_group.I = input_current
     
-    state_mon = StateMonitor(adex_group, ['v', 'w'], record=True)
-    spike_mon = SpikeMonitor(adex_group)
+    state_mon = record_state(adex_group, ['v', 'w'], merge_policies(RECORDING, recording)['state'], dt=record_dt,
+                             name='state_mon')
+    spike_mon = SpikeMonitor(adex_group, name='spike_mon')
 
-    net = Network(collect())
-    net.run(200*ms, report='text')
+    net = Network(collect(), *state_mon['objects'])
+    run_network(net, duration, report='text')
     
     return spike_mon, state_mon
 
-def plot_adex_results(spike_mon, state_mon):
+def plot_adex_results(spike_mon, state, duration):
+    # state: read_recording() of the state monitor, in SI units; duration is the run's.
+    import matplotlib.pyplot as plt
     fig, axs = plt.subplots(3, 1, figsize=(12, 8), constrained_layout=True,
                             gridspec_kw={'height_ratios': [3, 1, 1]})
 
-    axs[0].plot(state_mon.t/ms, state_mon.v[0]/mV, label='Voltage (v)')
+    axs[0].plot(state['t'] * 1e3, state['v'][0] * 1e3, label='Voltage (v)')
     axs[0].set_ylabel('Voltage (mV)')
     axs[0].set_title('Membrane Potential and Adaptation Current')
     
     ax2 = axs[0].twinx()
-    ax2.plot(state_mon.t/ms, state_mon.w[0]/nA, 'r--', label='Adaptation (w)')
+    ax2.plot(state['t'] * 1e3, state['w'][0] * 1e9, 'r--', label='Adaptation (w)')
     ax2.set_ylabel('Adaptation Current (nA)', color='r')
     ax2.tick_params(axis='y', labelcolor='r')
     fig.legend(loc='upper right', bbox_to_anchor=(0.9, 0.9))
 
-    axs[1].plot(state_mon.t/ms, np.ones_like(state_mon.t) * 0.5, 'g-')
+    axs[1].plot(state['t'] * 1e3, np.ones_like(state['t']) * 0.5, 'g-')
     axs[1].set_ylabel('Input Current (nA)')
     axs[1].set_ylim(0, 1)
 
-    axs[2].plot(spike_mon.t/ms, spike_mon.i, '.k')
+    plot_raster(axs[2], spike_mon.t_, spike_mon.i, len(spike_mon.source), 0.0, float(duration / second))
     axs[2].set_xlabel('Time (ms)')
     axs[2].set_ylabel('Neuron')
     axs[2].set_yticks([])
@@ -69,22 +85,35 @@ def plot_adex_results(spike_mon, state_mon):
     plt.show()
 
 if __name__ == "__main__":
-    setup_logging()
-    spike_mon, state_mon = run_adex_simulation()
-
-    plot_adex_results(spike_mon, state_mon)
+    parser = argparse.ArgumentParser(description="Run the AdEx neuron demo.")
+    add_clock_arguments(parser, record_dt=None, inputs=False)
+    add_recording_arguments(parser)
+    add_plot_arguments(parser)
+    add_backend_arguments(parser)
+    add_store_arguments(parser)
+    args = parser.parse_args()
 
-    results = {
-        "spike_times": list(spike_mon.t/ms),
-        "neuron_indices": list(spike_mon.i),
-        "voltage": list(state_mon.v[0]/mV),
-        "adaptation_current": list(state_mon.w[0]/nA),
-        "time": list(state_mon.t/ms)
-    }
-
-    results_dir = os.path.join(os.path.dirname(__file__), '..', 'results')
-    if not os.path.exists(results_dir):
-        os.makedirs(results_dir)
-
-    with open(os.path.join(results_dir, "adex_simulation_demo.json"), "w") as f:
-        json.dump(results, f, indent=4)
+    setup_logging()
+    configure_backend(args.backend, args.cache_dir)
+    overrides = recording_overrides(args)
+    key = result_key('adex_simulation_demo', {**run_arguments(args), 'recording': overrides})
+
+    def simulate():
+        duration = 200 * ms
+        spike_mon, state_mon = run_adex_simulation(duration, record_dt=clock_periods(args)['record_dt'],
+                                                   recording=overrides)
+        state = read_recording(state_mon)
+        if not args.no_plot:
+            plot_adex_results(spike_mon, state, duration)
+        return {
+            "spike_times": np.asarray(spike_mon.t/ms),
+            "neuron_indices": np.asarray(spike_mon.i),
+            "voltage": state['v'][0] * 1e3,
+            "adaptation_current": state['w'][0] * 1e9,
+            "time": state['t'] * 1e3
+        }
+
+    # The demo has no random input, so a stored run of the same arguments and code is reused.
+    results, found = cached_result(args.store_dir, 'adex_simulation_demo', key, simulate, reuse=not args.rerun)
+    if found:
+        logging.info(f"Reused the stored run {key}; pass --rerun to simulate (and plot) again.")
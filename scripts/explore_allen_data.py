@@ -4,8 +4,8 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 import logging
 from src.logging_config import setup_logging
+from src.result_store import DEFAULT_STORE_DIR, result_key, store_result
 from src.allen_data import get_session_data
-import json
 import pandas as pd
 
 def explore_allen_data():
@@ -121,15 +121,11 @@ if __name__ == "__main__":
         num_units = len(session.units)
 
         results = {
-            "session_id": session.ecephys_session_id,
+            "session_id": int(session.ecephys_session_id),
             "mean_firing_rate": mean_firing_rate,
             "std_firing_rate": std_firing_rate,
             "num_units": num_units
         }
 
-        results_dir = os.path.join(os.path.dirname(__file__), '..', 'results')
-        if not os.path.exists(results_dir):
-            os.makedirs(results_dir)
-
-        with open(os.path.join(results_dir, "explore_allen_data.json"), "w") as f:
-            json.dump(results, f, indent=4)
\ No newline at end of file
+        key = result_key('explore_allen_data', {'session_id': results['session_id']})
+        store_result(DEFAULT_STORE_DIR, 'explore_allen_data', key, results)
\ No newline at end of file
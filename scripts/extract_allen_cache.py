@@ -0,0 +1,37 @@
+import argparse
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import logging
+from src.logging_config import setup_logging
+from src.allen_cache import DEFAULT_PROBE_CACHE_DIR, extract_probe, load_probe_cache
+
+def main(args):
+    setup_logging()
+
+    if args.synthetic:
+        from src.synthetic_data import make_synthetic_session
+        session = make_synthetic_session(session_id=args.session_id or 1)
+    else:
+        from src.allen_data import get_session_data
+        session = get_session_data(args.ecephys_cache_dir, args.session_id)
+
+    probe_ids = list(session.probes.index) if args.all_probes else [args.probe_id]
+    for probe_id in probe_ids:
+        path = extract_probe(session, probe_id, args.cache_dir)
+        probe_data = load_probe_cache(path)
+        logging.info(f"Probe {probe_data['probe_id']}: {len(probe_data['spike_times'])} units, "
+                     f"mean rate {probe_data['mean_firing_rate']:.2f} Hz, fingerprint {probe_data['fingerprint']}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract Allen probe data into the preprocessed on-disk cache.")
+    parser.add_argument('--session-id', type=int, default=None, help='Session to extract (default: first available).')
+    parser.add_argument('--probe-id', type=int, default=None, help='Probe to extract (default: first probe).')
+    parser.add_argument('--all-probes', action='store_true', help='Extract every probe of the session.')
+    parser.add_argument('--cache-dir', default=DEFAULT_PROBE_CACHE_DIR, help='Where to write the preprocessed cache.')
+    parser.add_argument('--ecephys-cache-dir', default='ecephys_cache', help='AllenSDK download cache.')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='Extract a synthetic session instead of downloading one (for offline nodes).')
+    args = parser.parse_args()
+    main(args)
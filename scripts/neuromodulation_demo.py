@@ -1,22 +1,46 @@
-import matplotlib.pyplot as plt
+import argparse
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.startup import skip_pylab
+skip_pylab()
 import logging
 from src.logging_config import setup_logging
-from tqdm import tqdm
-import json
+from src.result_store import add_store_arguments, run_arguments, result_key, cached_result
 
 from brian2 import *
-from brian2 import prefs
 
-prefs.codegen.target = 'numpy'
-
-from src.neuron_models import LIF_EQS, LIF_PARAMS
-from src.synapses import STDP_EQS, STDP_PARAMS
-from src.neuromodulation import apply_dopamine_effect, apply_acetylcholine_effect
-
-def run_neuromodulation_demo(dopamine=0.0, acetylcholine=0.0):
+from src.backend import configure_backend, add_backend_arguments, prepare_run, run_network, current_backend
+
+from src.neuron_models import NEUROMODULATED_LIF_EQS, LIF_PARAMS
+from src.synapses import STDP_EQS, DOPAMINE_STDP_PARAMS
+from src.neuromodulation import (ACH_V_REST_SHIFT, DOPAMINE_DECAY, modulator_variables, modulator_group,
+                                 broadcast_modulators, reward_events)
+from src.monitors import add_clock_arguments, clock_periods
+from src.plotting import add_plot_arguments
+from src.recording import (record_state, read_recording, merge_policies, add_recording_arguments,
+                           recording_overrides)
+
+# Recording policy (see src/recording.py) for both the membrane potentials and the
+# synaptic weights, so their traces share one time axis. Only the last 200 ms (the
+# default run) are kept, so longer runs do not grow the traces. The ring buffer
+# cannot run in a standalone build, which samples every millisecond instead.
+RECORDING = {
+    'traces': {'policy': 'window', 'duration': 200*ms},
+}
+STANDALONE_RECORDING = {
+    'traces': {'policy': 'snapshots', 'every': 1*ms},
+}
+
+# Parameters that apply_neuromodulation_variant can change on a built (or restored)
+# demo; the levels only when they are fixed numbers rather than schedules.
+BRANCHABLE_PARAMETERS = ('dopamine', 'acetylcholine', 'initial_weight', 'input_weight')
+
+def build_neuromodulation_demo(dopamine=0.0, acetylcholine=0.0, duration=200*ms, initial_weight=0.5,
+                               input_weight=25*mV, reward_times=None, record_dt=None, recording=None):
+    # Levels are numbers, or lists of numbers to simulate one pre/post pair per
+    # condition side by side in a single run. A TimedArray schedule (e.g. a ramp) or
+    # reward_times (phasic dopamine) drive global modulators during the run instead.
     start_scope()
     
     model_ns = {
@@ -25,62 +49,135 @@ def run_neuromodulation_demo(dopamine=0.0, acetylcholine=0.0):
         'v_thresh': LIF_PARAMS['v_thresh'],
         'refractory_period': LIF_PARAMS['refractory_period'],
         'tau': LIF_PARAMS.get('tau', LIF_PARAMS.get('tau_m', 10*ms)),
-        'tau_pre': STDP_PARAMS['tau_pre'],
-        'tau_post': STDP_PARAMS['tau_post'],
-        'A_pre': STDP_PARAMS['A_pre'],
-        'A_post': STDP_PARAMS['A_post']
+        'tau_pre': DOPAMINE_STDP_PARAMS['tau_pre'],
+        'tau_post': DOPAMINE_STDP_PARAMS['tau_post'],
+        'A_pre': DOPAMINE_STDP_PARAMS['A_pre'],
+        'A_post': DOPAMINE_STDP_PARAMS['A_post'],
+        'ach_v_shift': ACH_V_REST_SHIFT,
     }
-
-    G = NeuronGroup(2, LIF_EQS,
+    prepare_run('neuromodulation_demo', NEUROMODULATED_LIF_EQS, STDP_EQS, DOPAMINE_STDP_PARAMS, model_ns,
+                dopamine, acetylcholine, duration, initial_weight, input_weight, reward_times, record_dt,
+                recording)
+
+    scheduled = (isinstance(dopamine, TimedArray) or isinstance(acetylcholine, TimedArray)
+                 or reward_times is not None)
+    if scheduled:
+        n_conditions = 1
+    else:
+        dopamine, acetylcholine = np.broadcast_arrays(np.atleast_1d(np.asarray(dopamine, dtype=float)),
+                                                      np.atleast_1d(np.asarray(acetylcholine, dtype=float)))
+        n_conditions = len(dopamine)
+
+    G = NeuronGroup(2 * n_conditions, NEUROMODULATED_LIF_EQS + modulator_variables(),
                     threshold='v > v_thresh',
                     reset='v = v_reset',
                     refractory='refractory_period',
                     method='exact',
-                    namespace=model_ns)
+                    namespace=model_ns,
+                    name='neurons')
     
     v_rest = LIF_PARAMS['v_rest']
     v_thresh = LIF_PARAMS['v_thresh']
-    G.v = v_rest + np.random.rand(2) * (v_thresh - v_rest)
+    G.v = v_rest + np.random.rand(2 * n_conditions) * (v_thresh - v_rest)
+
+    objects = [G]
+    if scheduled:
+        decay = {'dopamine': DOPAMINE_DECAY} if reward_times is not None else None
+        modulators = modulator_group({'dopamine': dopamine, 'acetylcholine': acetylcholine}, decay=decay)
+        objects += [modulators, broadcast_modulators(modulators, G)]
+        if reward_times is not None:
+            objects += reward_events(modulators, reward_times)
+    else:
+        # Neuron 2k is the presynaptic and 2k + 1 the postsynaptic cell of condition k.
+        G.dopamine = np.repeat(dopamine, 2)
+        G.acetylcholine = np.repeat(acetylcholine, 2)
 
     S = Synapses(G, G, STDP_EQS,
-                 on_pre=STDP_PARAMS['on_pre'],
-                 on_post=STDP_PARAMS['on_post'],
+                 on_pre=DOPAMINE_STDP_PARAMS['on_pre'],
+                 on_post=DOPAMINE_STDP_PARAMS['on_post'],
                  method='exact',
-                 namespace=model_ns)
-    S.connect(i=0, j=1)
-    S.w = 0.5
-    
-    base_A_pre = STDP_PARAMS['A_pre']
-    base_A_post = STDP_PARAMS['A_post']
-    apply_dopamine_effect(S, dopamine_level=dopamine, base_A_pre=base_A_pre, base_A_post=base_A_post)
-    
-    base_v_rest = LIF_PARAMS['v_rest']
-    apply_acetylcholine_effect(G, acetylcholine_level=acetylcholine, base_v_rest=base_v_rest)
-
-    input_spikes = SpikeGeneratorGroup(1, [0], [50]*ms)
-    input_syn = Synapses(input_spikes, G, on_pre='v_post += 25*mV')
-    input_syn.connect(i=0, j=0)
-
-    state_mon = StateMonitor(G, 'v', record=True)
-    syn_mon = StateMonitor(S, 'w', record=True)
-
-    run(200*ms)
+                 namespace=model_ns,
+                 name='stdp_synapses')
+    S.connect(i=np.arange(0, 2 * n_conditions, 2), j=np.arange(1, 2 * n_conditions, 2))
+    S.w = initial_weight
+
+    input_spikes = SpikeGeneratorGroup(1, [0], [50]*ms, name='input_spikes')
+    input_syn = Synapses(input_spikes, G, on_pre='v_post += input_weight',
+                         namespace={'input_weight': input_weight}, name='input_synapses')
+    input_syn.connect(i=0, j=np.arange(0, 2 * n_conditions, 2))
+
+    defaults = STANDALONE_RECORDING if current_backend() == 'cpp_standalone' else RECORDING
+    policy = merge_policies(defaults, recording)['traces']
+    state_mon = record_state(G, 'v', policy, dt=record_dt, name='state_mon')
+    syn_mon = record_state(S, 'w', policy, dt=record_dt, name='syn_mon')
+
+    net = Network(objects + [S, input_spikes, input_syn] + state_mon['objects'] + syn_mon['objects'])
+    return {
+        'network': net,
+        'neurons': G,
+        'synapses': S,
+        'input_synapses': input_syn,
+        'n_conditions': n_conditions,
+        'scheduled': scheduled,
+        # Every identifier comes from an explicit namespace, so the level arguments
+        # above cannot shadow the model's modulator variables.
+        'run_kwargs': {'namespace': {}},
+        'outputs': (state_mon, syn_mon),
+    }
 
-    return state_mon, syn_mon
+def apply_neuromodulation_variant(demo, variant):
+    unknown = set(variant) - set(BRANCHABLE_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Cannot change {', '.join(sorted(unknown))} on a built demo; "
+                         f"branchable parameters are {', '.join(BRANCHABLE_PARAMETERS)}.")
+    G = demo['neurons']
+    for modulator in ('dopamine', 'acetylcholine'):
+        if modulator in variant:
+            if demo['scheduled']:
+                raise ValueError(f"{modulator} is driven by the modulator group in this demo; rebuild it instead.")
+            levels = np.broadcast_to(np.asarray(variant[modulator], dtype=float), (demo['n_conditions'],))
+            setattr(G, modulator, np.repeat(levels, 2))
+    if 'initial_weight' in variant:
+        demo['synapses'].w = variant['initial_weight']
+    if 'input_weight' in variant:
+        demo['input_synapses'].namespace['input_weight'] = variant['input_weight']
+
+def run_neuromodulation_demo(dopamine=0.0, acetylcholine=0.0, duration=200*ms, initial_weight=0.5, input_weight=25*mV,
+                             reward_times=None, record_dt=None, recording=None):
+    demo = build_neuromodulation_demo(dopamine, acetylcholine, duration, initial_weight, input_weight, reward_times,
+                                      record_dt, recording)
+    run_network(demo['network'], duration, **demo['run_kwargs'])
+    return demo['outputs']
+
+def summarize_neuromodulation_demo(monitors):
+    # One row per recorded condition, or plain traces for a single condition;
+    # *_conditions say which condition each row belongs to.
+    voltage, weight = (read_recording(recording) for recording in monitors)
+    post = voltage['indices'] % 2 == 1
+    weights = np.asarray(weight['w'], dtype=np.float32)
+    voltages = np.asarray(voltage['v'][post] / 0.001, dtype=np.float32)
+    if len(weights) == 1 and len(voltages) == 1:
+        weights, voltages = weights[0], voltages[0]
+    return {
+        "time": np.asarray(voltage['t'] / 0.001, dtype=np.float32),
+        "synaptic_weight": weights,
+        "postsynaptic_voltage": voltages,
+        "weight_conditions": weight['indices'],
+        "voltage_conditions": voltage['indices'][post] // 2,
+    }
 
-def plot_neuromodulation_results(dopamine_levels, ach_levels, results):
+def plot_neuromodulation_results(dopamine_levels, ach_levels, output_results):
+    import matplotlib.pyplot as plt
     fig, axes = plt.subplots(2, 1, figsize=(10, 8), sharex=True)
     
-    for i, dap_level in enumerate(dopamine_levels):
-        w_mon = results['dopamine'][i][1]
-        axes[0].plot(w_mon.t/ms, w_mon.w[0], label=f'Dopamine = {dap_level}')
+    for dap_level, trace in output_results['dopamine'].items():
+        axes[0].plot(trace['time'], trace['synaptic_weight'], label=f'Dopamine = {dap_level}')
     axes[0].set_ylabel('Synaptic Weight (w)')
     axes[0].set_title('Effect of Dopamine on STDP')
     axes[0].legend()
     
-    for i, ach_level in enumerate(ach_levels):
-        v_mon = results['acetylcholine'][i][0]
-        axes[1].plot(v_mon.t/ms, v_mon.v[1]/mV, label=f'ACh = {ach_level}')
+    for ach_level, trace in output_results['acetylcholine'].items():
+        axes[1].plot(trace['time'], trace['postsynaptic_voltage'], label=f'ACh = {ach_level}')
     axes[1].set_xlabel('Time (ms)')
     axes[1].set_ylabel('Postsynaptic Voltage (mV)')
     axes[1].set_title('Effect of Acetylcholine on Excitability')
@@ -92,34 +189,54 @@ def plot_neuromodulation_results(dopamine_levels, ach_levels, results):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the dopamine and acetylcholine neuromodulation demo.")
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the initial membrane potentials.')
+    add_clock_arguments(parser, record_dt=None, inputs=False)
+    add_recording_arguments(parser)
+    add_plot_arguments(parser)
+    add_backend_arguments(parser)
+    add_store_arguments(parser)
+    args = parser.parse_args()
+
     setup_logging()
+    configure_backend(args.backend, args.cache_dir)
+    seed(args.seed)
     
     dopamine_levels = [0.0, 0.5, 1.0]
     ach_levels = [0.0, 0.5, 1.0]
-    results = {'dopamine': [], 'acetylcholine': []}
-    output_results = {'dopamine': {}, 'acetylcholine': {}}
-
-    for dap in tqdm(dopamine_levels, desc="Dopamine Simulations"):
-        v_mon, w_mon = run_neuromodulation_demo(dopamine=dap)
-        results['dopamine'].append((v_mon, w_mon))
-        output_results['dopamine'][dap] = {
-            "time": list(w_mon.t/ms),
-            "synaptic_weight": list(w_mon.w[0])
-        }
-
-    for ach in tqdm(ach_levels, desc="Acetylcholine Simulations"):
-        v_mon, w_mon = run_neuromodulation_demo(acetylcholine=ach)
-        results['acetylcholine'].append((v_mon, w_mon))
-        output_results['acetylcholine'][ach] = {
-            "time": list(v_mon.t/ms),
-            "postsynaptic_voltage": list(v_mon.v[1]/mV)
-        }
-
-    plot_neuromodulation_results(dopamine_levels, ach_levels, results)
-
-    results_dir = os.path.join(os.path.dirname(__file__), '..', 'results')
-    if not os.path.exists(results_dir):
-        os.makedirs(results_dir)
-
-    with open(os.path.join(results_dir, "neuromodulation_demo.json"), "w") as f:
-        json.dump(output_results, f, indent=4)
+    overrides = recording_overrides(args)
+    key = result_key('neuromodulation_demo', {**run_arguments(args), 'recording': overrides}, seed=args.seed)
+
+    def simulate():
+        output_results = {'dopamine': {}, 'acetylcholine': {}}
+        # All six conditions are simulated side by side in one network and one run.
+        conditions = [(dap, 0.0) for dap in dopamine_levels] + [(0.0, ach) for ach in ach_levels]
+        monitors = run_neuromodulation_demo(dopamine=[dap for dap, _ in conditions],
+                                            acetylcholine=[ach for _, ach in conditions],
+                                            record_dt=clock_periods(args)['record_dt'],
+                                            recording=overrides)
+        summary = summarize_neuromodulation_demo(monitors)
+        # Conditions left out by a subset policy are skipped.
+        weight_rows = {int(c): row for row, c in enumerate(summary['weight_conditions'])}
+        voltage_rows = {int(c): row for row, c in enumerate(summary['voltage_conditions'])}
+        for k, dap_level in enumerate(dopamine_levels):
+            if k in weight_rows:
+                output_results['dopamine'][dap_level] = {
+                    "time": summary['time'],
+                    "synaptic_weight": summary['synaptic_weight'][weight_rows[k]]
+                }
+        for k, ach_level in enumerate(ach_levels):
+            if len(dopamine_levels) + k in voltage_rows:
+                output_results['acetylcholine'][ach_level] = {
+                    "time": summary['time'],
+                    "postsynaptic_voltage": summary['postsynaptic_voltage'][voltage_rows[len(dopamine_levels) + k]]
+                }
+        return output_results
+
+    output_results, found = cached_result(args.store_dir, 'neuromodulation_demo', key, simulate,
+                                          reuse=not args.rerun, seed=args.seed)
+    if found:
+        logging.info(f"Reused the stored run {key}; pass --rerun to simulate again.")
+
+    if not args.no_plot:
+        plot_neuromodulation_results(dopamine_levels, ach_levels, output_results)
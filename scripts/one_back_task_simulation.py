@@ -1,24 +1,44 @@
-import matplotlib.pyplot as plt
+import argparse
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.startup import skip_pylab
+skip_pylab()
 import logging
 from src.logging_config import setup_logging
-import json
+from src.result_store import add_store_arguments, run_arguments, result_key, cached_result
 
 from brian2 import *
-from brian2 import prefs
 
-prefs.codegen.target = 'numpy'
+from src.backend import configure_backend, add_backend_arguments, prepare_run, run_network
+from src.plotting import plot_raster, add_plot_arguments
 
 from src.neuron_models import LIF_EQS, LIF_PARAMS
-from src.stimuli import generate_stimulus_sequence
+from src.stimuli import generate_stimulus_sequences
+from src.connectivity import fixed_probability
+from src.monitors import DEFAULT_RECORD_DT, clock_kwargs, expect_input_clock, add_clock_arguments, clock_periods
+from src.recording import (record_state, recorded_mean, merge_policies, add_recording_arguments,
+                           recording_overrides)
+from src.ensemble import (replica_rngs, replica_index, replica_subsets, per_replica, block_diagonal,
+                          split_spike_monitor)
 
-def run_one_back_task_simulation(duration=1*second):
-    start_scope()
+# Recording policy per monitor (see src/recording.py). The LFP is the mean voltage
+# of each replica, reduced in-run so memory does not grow with the ensemble; other
+# policies are averaged per replica over the neurons they record.
+RECORDING = {
+    'lfp': {'policy': 'population', 'reduce': 'mean'},
+}
+
+# Parameters that apply_one_back_variant can change on a built (or restored) task.
+BRANCHABLE_PARAMETERS = ('input_weight',)
 
-    n_neurons = 20
-    duration = 500*ms
+def build_one_back_task(duration=500*ms, n_neurons=20, n_replicas=1, base_seed=None, input_rate=200*Hz,
+                        input_weight=1.5*mV, record_dt=DEFAULT_RECORD_DT, input_dt=None, recording=None):
+    # n_replicas independent copies of the task run as one network: replica k owns
+    # neurons [k * n_neurons, (k + 1) * n_neurons), with its own stimulus sequence,
+    # initial state and wiring drawn from its own seed. input_rate and input_weight
+    # are scalars or one value per replica. The stimulus spans `duration`.
+    start_scope()
 
     model_ns = {
         'v_rest': LIF_PARAMS['v_rest'],
@@ -27,47 +47,121 @@ def run_one_back_task_simulation(duration=1*second):
         'refractory_period': LIF_PARAMS['refractory_period'],
         'tau': LIF_PARAMS.get('tau', LIF_PARAMS.get('tau_m', 10*ms))
     }
+    prepare_run('one_back_task_simulation', LIF_EQS, model_ns, n_neurons, duration, n_replicas, record_dt, input_dt,
+                recording)
+    n_total = n_replicas * n_neurons
+    if base_seed is not None:
+        # Poisson input noise comes from Brian2's single stream; replicas draw
+        # disjoint values from it, so they stay independent.
+        seed(base_seed)
+    rngs = replica_rngs(base_seed, n_replicas)
 
-    layer4 = NeuronGroup(n_neurons, LIF_EQS,
+    layer4 = NeuronGroup(n_total, LIF_EQS,
                          threshold="v > v_thresh",
                          reset="v = v_reset",
                          refractory='refractory_period',
                          method='exact',
-                         namespace=model_ns)
+                         namespace=model_ns,
+                         name='layer4')
     
     v_rest = LIF_PARAMS['v_rest']
     v_thresh = LIF_PARAMS['v_thresh']
-    layer4.v = v_rest + np.random.rand(n_neurons) * (v_thresh - v_rest)
+    layer4.v = v_rest + np.concatenate([rng.random(n_neurons) for rng in rngs]) * (v_thresh - v_rest)
 
-    stimulus = generate_stimulus_sequence(duration)
-    input_group = PoissonGroup(n_neurons, rates='200*Hz*stimulus(t)')
-    syn = Synapses(input_group, layer4, on_pre='v_post += 1.5*mV')
-    syn.connect(p=0.2)
-    
-    spike_mon = SpikeMonitor(layer4)
-    state_mon = StateMonitor(layer4, 'v', record=True)
+    input_rates = input_rate if np.ndim(input_rate) == 0 else Quantity(input_rate)
+    stimulus = generate_stimulus_sequences(duration, rngs, scale=input_rates)
+    input_clock = clock_kwargs(input_dt)
+    input_group = PoissonGroup(n_total, rates='stimulus(t, i // n_per_replica)',
+                               namespace={'stimulus': stimulus, 'n_per_replica': n_neurons}, name='input', **input_clock)
+    syn = Synapses(input_group, layer4, 'w_in : volt', on_pre='v_post += w_in', name='input_syn', **input_clock)
+    expect_input_clock(syn)
+    pairs = [fixed_probability(n_neurons, n_neurons, 0.2, rng=rng) for rng in rngs]
+    pre, post = block_diagonal(pairs, n_neurons, n_neurons)
+    syn.connect(i=pre, j=post)
+    synapses_per_replica = [len(p) for p, _ in pairs]
+    syn.w_in = per_replica(input_weight, n_replicas, synapses_per_replica) * volt
     
-    net = Network(layer4, input_group, syn, spike_mon, state_mon)
-    net.run(duration, report='text')
+    spike_mon = SpikeMonitor(layer4, name='spike_mon')
+    lfp_policy = merge_policies(RECORDING, recording)['lfp']
+    if lfp_policy['policy'] == 'population' and 'subsets' not in lfp_policy:
+        lfp_policy = {**lfp_policy, 'subsets': replica_subsets(n_replicas, n_neurons)}
+    lfp_mon = record_state(layer4, 'v', lfp_policy, dt=record_dt, name='lfp_layer4')
     
-    return spike_mon, state_mon
+    net = Network(layer4, input_group, syn, spike_mon, *lfp_mon['objects'])
+    return {
+        'network': net,
+        'input_syn': syn,
+        'synapses_per_replica': synapses_per_replica,
+        'n_replicas': n_replicas,
+        'outputs': (spike_mon, lfp_mon),
+        'summary_kwargs': {'n_replicas': n_replicas},
+    }
+
+def apply_one_back_variant(task, variant):
+    unknown = set(variant) - set(BRANCHABLE_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Cannot change {', '.join(sorted(unknown))} on a built task; "
+                         f"branchable parameters are {', '.join(BRANCHABLE_PARAMETERS)}.")
+    if 'input_weight' in variant:
+        task['input_syn'].w_in = per_replica(variant['input_weight'], task['n_replicas'],
+                                             task['synapses_per_replica']) * volt
+
+def run_one_back_task_simulation(duration=500*ms, n_neurons=20, n_replicas=1, base_seed=None,
+                                 input_rate=200*Hz, input_weight=1.5*mV, record_dt=DEFAULT_RECORD_DT, input_dt=None,
+                                 recording=None):
+    task = build_one_back_task(duration, n_neurons, n_replicas, base_seed, input_rate, input_weight, record_dt,
+                               input_dt, recording)
+    run_network(task['network'], duration, report='text')
+    return task['outputs']
 
-def plot_one_back_task_results(spike_mon, state_mon):
+def split_one_back_results(spike_mon, lfp_mon, n_replicas):
+    # Per-replica spike trains (local neuron ids) and mean-voltage traces in mV.
+    lfp_time, lfp = recorded_mean(lfp_mon, labels=replica_index(n_replicas, len(spike_mon.source) // n_replicas))
+    lfp = np.atleast_2d(lfp) / float(mV)
+    trains = split_spike_monitor(spike_mon, n_replicas)
+    return [{'spike_trains': trains[k], 'lfp': lfp[k], 'time': lfp_time / float(ms)} for k in range(n_replicas)]
+
+def summarize_one_back_task(monitors, n_replicas=1):
+    # Spike times (ms) and local neuron ids of every replica, concatenated in replica
+    # order with replica k owning [replica_offsets[k]:replica_offsets[k + 1]], the
+    # mean voltage per replica and spike counts per replica, as plain arrays.
+    spike_mon, lfp_mon = monitors
+    replicas = split_one_back_results(spike_mon, lfp_mon, n_replicas)
+    trains = [r['spike_trains'] for r in replicas]
+    counts = np.array([len(train.times) for train in trains], dtype=np.int64)
+    offsets = np.zeros(n_replicas + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    lfp = np.array([r['lfp'] for r in replicas])
+    return {
+        "spike_times": np.concatenate([train.times * 1000 for train in trains]),
+        "neuron_indices": np.concatenate([train.unit_index() for train in trains]),
+        "replica_offsets": offsets,
+        "lfp": lfp[0] if n_replicas == 1 else lfp,
+        "time": replicas[0]['time'],
+        "spike_counts": counts,
+    }
+
+def plot_one_back_task_results(replicas):
+    import matplotlib.pyplot as plt
     figures_dir = os.path.join(os.path.dirname(__file__), '..', 'figures')
     if not os.path.exists(figures_dir):
         os.makedirs(figures_dir)
 
+    trains = replicas[0]['spike_trains']
     plt.figure(figsize=(10, 4))
-    plt.plot(spike_mon.t/ms, spike_mon.i, '.k')
+    plot_raster(plt.gca(), trains.times, trains.unit_index(), trains.n_units, trains.t_start, trains.t_stop)
     plt.xlabel('Time (ms)')
     plt.ylabel('Neuron index')
     plt.title('Spike Raster for 1-Back Task')
     plt.savefig(os.path.join(figures_dir, "one_back_task_raster.png"))
     plt.show()
     
-    lfp = np.mean(state_mon.v / mV, axis=0)
     plt.figure(figsize=(12, 4))
-    plt.plot(state_mon.t/ms, lfp)
+    plt.plot(replicas[0]['time'], replicas[0]['lfp'], label='Replica 0')
+    if len(replicas) > 1:
+        plt.plot(replicas[0]['time'], np.mean([r['lfp'] for r in replicas], axis=0),
+                 label=f'Mean of {len(replicas)} replicas')
+        plt.legend()
     plt.xlabel('Time (ms)')
     plt.ylabel('Mean Voltage (mV)')
     plt.title('Simulated LFP - Layer 4')
@@ -75,22 +169,31 @@ def plot_one_back_task_results(spike_mon, state_mon):
     plt.show()
 
 if __name__ == "__main__":
-    setup_logging()
-    spike_mon, state_mon = run_one_back_task_simulation()
+    parser = argparse.ArgumentParser(description="Run the 1-back working memory task simulation.")
+    parser.add_argument('--replicas', type=int, default=1,
+                        help='Independent trials, simulated together as one block-diagonal network.')
+    parser.add_argument('--seed', type=int, default=None, help='Base seed; each replica gets its own derived seed.')
+    add_clock_arguments(parser)
+    add_recording_arguments(parser)
+    add_plot_arguments(parser)
+    add_backend_arguments(parser)
+    add_store_arguments(parser)
+    args = parser.parse_args()
 
-    plot_one_back_task_results(spike_mon, state_mon)
-
-    lfp = np.mean(state_mon.v / mV, axis=0)
-    results = {
-        "spike_times": [float(t) for t in spike_mon.t/ms],
-        "neuron_indices": [int(i) for i in spike_mon.i],
-        "lfp": [float(v) for v in lfp],
-        "time": [float(t) for t in state_mon.t/ms]
-    }
+    setup_logging()
+    configure_backend(args.backend, args.cache_dir)
+    overrides = recording_overrides(args)
+    key = result_key('one_back_task_simulation', {**run_arguments(args), 'recording': overrides}, seed=args.seed)
 
-    results_dir = os.path.join(os.path.dirname(__file__), '..', 'results')
-    if not os.path.exists(results_dir):
-        os.makedirs(results_dir)
+    def simulate():
+        spike_mon, lfp_mon = run_one_back_task_simulation(n_replicas=args.replicas, base_seed=args.seed,
+                                                          recording=overrides, **clock_periods(args))
+        if not args.no_plot:
+            plot_one_back_task_results(split_one_back_results(spike_mon, lfp_mon, args.replicas))
+        return summarize_one_back_task((spike_mon, lfp_mon), args.replicas)
 
-    with open(os.path.join(results_dir, "one_back_task_simulation.json"), "w") as f:
-        json.dump(results, f, indent=4)
+    # Unseeded runs differ every time, so they are never reused and only the latest is kept.
+    results, found = cached_result(args.store_dir, 'one_back_task_simulation', key, simulate,
+                                   reuse=not args.rerun, reproducible=args.seed is not None, seed=args.seed)
+    if found:
+        logging.info(f"Reused the stored run {key}; pass --rerun to simulate (and plot) again.")
@@ -1,29 +1,39 @@
-import matplotlib.pyplot as plt
+import argparse
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.startup import skip_pylab
+skip_pylab()
 
 from src.logging_config import setup_logging
+from src.result_store import add_store_arguments, run_arguments, result_key, cached_result
 setup_logging()
 
 import logging
-import json
 
 from brian2 import *
-from brian2 import prefs
 
-prefs.codegen.target = 'numpy'
+from src.backend import configure_backend, add_backend_arguments, prepare_run, run_network
+from src.plotting import plot_raster, add_plot_arguments
 
 from src.neuron_models import LIF_EQS, LIF_PARAMS
 from src.stimuli import generate_oscillatory_input
+from src.monitors import (DEFAULT_RECORD_DT, sampling_rate, clock_kwargs, expect_input_clock, add_clock_arguments,
+                          clock_periods)
+from src.recording import (record_state, recorded_mean, merge_policies, add_recording_arguments,
+                           recording_overrides)
+from src.spectral import FREQUENCY_BANDS, FilterBank, modulation_index
 from src.analysis import (analyze_lfp_bands, 
                           compute_coherence, infer_cognitive_state, bandpass_filter)
 
-def run_analysis_simulation(duration=2*second):
-    start_scope()
+# Recording policy per monitor (see src/recording.py).
+RECORDING = {
+    'lfp': {'policy': 'population', 'reduce': 'mean'},
+}
 
-    n_neurons = 100
-    duration = 2*second
+def run_analysis_simulation(duration=2*second, n_neurons=100, record_dt=DEFAULT_RECORD_DT, input_dt=None,
+                            recording=None):
+    start_scope()
 
     model_ns = {
         'v_rest': LIF_PARAMS['v_rest'],
@@ -32,13 +42,15 @@ def run_analysis_simulation(duration=2*second):
         'refractory_period': LIF_PARAMS['refractory_period'],
         'tau': LIF_PARAMS.get('tau', LIF_PARAMS.get('tau_m', 10*ms))
     }
+    prepare_run('run_cognitive_analysis', LIF_EQS, model_ns, n_neurons, duration, record_dt, input_dt, recording)
 
     layer4 = NeuronGroup(n_neurons, LIF_EQS,
                          threshold='v > v_thresh',
                          reset='v = v_reset',
                          refractory='refractory_period',
                          method='exact',
-                         namespace=model_ns)
+                         namespace=model_ns,
+                         name='layer4')
     
     v_rest = LIF_PARAMS['v_rest']
     v_thresh = LIF_PARAMS['v_thresh']
@@ -46,24 +58,28 @@ def run_analysis_simulation(duration=2*second):
 
     theta_drive = generate_oscillatory_input(6*Hz, duration)
     gamma_drive = generate_oscillatory_input(40*Hz, duration)
-    input_group = PoissonGroup(n_neurons, rates='60*Hz + 25*Hz*theta_drive(t) + 15*Hz*gamma_drive(t)')
+    input_clock = clock_kwargs(input_dt)
+    input_group = PoissonGroup(n_neurons, rates='60*Hz + 25*Hz*theta_drive(t) + 15*Hz*gamma_drive(t)',
+                               name='input', **input_clock)
     
-    input_syn = Synapses(input_group, layer4, on_pre='v_post += 1.8 * mV')
+    input_syn = Synapses(input_group, layer4, on_pre='v_post += 1.8 * mV', name='input_syn', **input_clock)
+    expect_input_clock(input_syn)
     input_syn.connect(p=0.2)
     
-    spike_mon = SpikeMonitor(layer4)
-    state_mon = StateMonitor(layer4, 'v', record=True)
+    spike_mon = SpikeMonitor(layer4, name='spike_mon')
+    lfp_mon = record_state(layer4, 'v', merge_policies(RECORDING, recording)['lfp'], dt=record_dt, name='lfp_layer4')
 
-    net = Network(collect())
-    net.run(duration, report='text')
+    net = Network(collect(), *lfp_mon['objects'])
+    run_network(net, duration, report='text')
     
-    return spike_mon, state_mon
+    return spike_mon, lfp_mon
 
-def perform_and_plot_cognitive_analysis(spike_mon, state_mon):
+def perform_and_plot_cognitive_analysis(spike_mon, lfp_mon, plot=True):
     logging.info("Performing cognitive analysis and plotting results...")
     
-    lfp = np.mean(state_mon.v / mV, axis=0)
-    fs = float(1.0 / (defaultclock.dt / second))
+    lfp_time, lfp = recorded_mean(lfp_mon)
+    lfp = lfp / float(mV)
+    fs = sampling_rate(lfp_mon)
     
     analysis_results = analyze_lfp_bands(lfp, fs)
     if analysis_results is None:
@@ -76,17 +92,32 @@ def perform_and_plot_cognitive_analysis(spike_mon, state_mon):
 
     total_spikes = len(spike_mon.t)
     num_neurons = len(spike_mon.source)
-    duration_seconds = float(state_mon.t[-1] / second)
+    duration_seconds = float(lfp_time[-1])
     mean_firing_rate = total_spikes / (num_neurons * duration_seconds) if (num_neurons * duration_seconds) > 0 else 0
     
     inferred_state = infer_cognitive_state(theta_power, gamma_power, mean_firing_rate)
 
+    pac_bands = {band: FREQUENCY_BANDS[band] for band in ('theta', 'gamma')}
+    envelopes = FilterBank(fs, bands=pac_bands).envelopes(lfp)
+    theta_gamma_mi = modulation_index(envelopes['theta'][1], envelopes['gamma'][0])
+
     logging.info("\nCognitive Analysis Results:")
     logging.info(f"  - Mean Firing Rate: {mean_firing_rate:.2f} Hz")
     for band, power in band_powers.items():
         logging.info(f"  - {band.capitalize()} Power: {power:.4g}")
+    logging.info(f"  - Theta-Gamma Modulation Index: {theta_gamma_mi:.4g}")
     logging.info(f"  - Inferred Cognitive State: {inferred_state}")
 
+    results = {
+        "mean_firing_rate": mean_firing_rate,
+        "band_powers": band_powers,
+        "theta_gamma_modulation_index": theta_gamma_mi,
+        "inferred_state": inferred_state
+    }
+    if not plot:
+        return results
+
+    import matplotlib.pyplot as plt
     try:
         fig, axs = plt.subplots(3, 1, figsize=(12, 12), constrained_layout=True)
         
@@ -101,7 +132,7 @@ def perform_and_plot_cognitive_analysis(spike_mon, state_mon):
         axs[1].set_ylabel('Power')
         axs[1].set_yscale('log')
         
-        axs[2].plot(spike_mon.t/ms, spike_mon.i, '.k', markersize=0.5)
+        plot_raster(axs[2], spike_mon.t_, spike_mon.i, len(spike_mon.source), 0.0, duration_seconds)
         axs[2].set_xlabel('Time (ms)')
         axs[2].set_ylabel('Neuron Index')
         axs[2].set_title(f'Spike Raster - Cognitive State: {inferred_state}')
@@ -119,20 +150,32 @@ def perform_and_plot_cognitive_analysis(spike_mon, state_mon):
         logging.error(f"Plotting failed: {e}")
         print("Analysis completed but plotting failed. Results printed above.")
 
-    return {
-        "mean_firing_rate": mean_firing_rate,
-        "band_powers": band_powers,
-        "inferred_state": inferred_state
-    }
+    return results
 
 if __name__ == "__main__":
-    spike_mon, state_mon = run_analysis_simulation()
-
-    analysis_results = perform_and_plot_cognitive_analysis(spike_mon, state_mon)
-
-    results_dir = os.path.join(os.path.dirname(__file__), '..', 'results')
-    if not os.path.exists(results_dir):
-        os.makedirs(results_dir)
-
-    with open(os.path.join(results_dir, "run_cognitive_analysis.json"), "w") as f:
-        json.dump(analysis_results, f, indent=4)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the cognitive signal analysis simulation.")
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed the initial potentials and inputs; seeded runs are reused from the result store.')
+    add_clock_arguments(parser)
+    add_recording_arguments(parser)
+    add_plot_arguments(parser)
+    add_backend_arguments(parser)
+    add_store_arguments(parser)
+    args = parser.parse_args()
+
+    configure_backend(args.backend, args.cache_dir)
+    if args.seed is not None:
+        seed(args.seed)
+    overrides = recording_overrides(args)
+    key = result_key('run_cognitive_analysis', {**run_arguments(args), 'recording': overrides}, seed=args.seed)
+
+    def simulate():
+        spike_mon, lfp_mon = run_analysis_simulation(recording=overrides, **clock_periods(args))
+        # Runs too short to analyse store an empty entry.
+        return perform_and_plot_cognitive_analysis(spike_mon, lfp_mon, plot=not args.no_plot) or {}
+
+    # Unseeded runs differ every time, so they are never reused and only the latest is kept.
+    results, found = cached_result(args.store_dir, 'run_cognitive_analysis', key, simulate,
+                                   reuse=not args.rerun, reproducible=args.seed is not None, seed=args.seed)
+    if found:
+        logging.info(f"Reused the stored run {key}; pass --rerun to simulate (and plot) again.")
@@ -1,185 +1,278 @@
 import argparse
 import numpy as np
-import matplotlib.pyplot as plt
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.startup import skip_pylab
+skip_pylab()
 import logging
 from src.logging_config import setup_logging
-import json
-from brian2.units import *
-import numpy
-
-class Brian2Encoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, (Quantity, numpy.ndarray)):
-            if isinstance(obj, Quantity) and obj.size == 1:
-                return float(obj)
-            return list(obj)
-        if isinstance(obj, (numpy.int32, numpy.int64)):
-            return int(obj)
-        if isinstance(obj, (numpy.float32, numpy.float64)):
-            return float(obj)
-        return super(Brian2Encoder, self).default(obj)
+from src.results_io import save_results
+from src import instrumentation
+from src.instrumentation import span
 
 from brian2 import *
-from brian2 import prefs
 
-prefs.codegen.target = 'numpy'
+from src.backend import configure_backend, add_backend_arguments, prepare_run, run_network
 
-from src.allen_data import get_session_data, get_probe_data
-from src.analysis import analyze_lfp_bands, analyze_isi_distribution, calculate_lfp
+from src.allen_cache import DEFAULT_PROBE_CACHE_DIR, get_cached_probe_data
+from src.lfp import iter_lfp_chunks
+from src.spike_trains import SpikeTrains
+from src.spectral import welch_from_chunks
+from src.analysis import analyze_lfp_bands, isi_sketch, calculate_lfp, comparison_summary
 from src.neuron_models import EXC_EQS, INH_EQS, NETWORK_PARAMS
-from src.plotting import plot_comparison
+from src.plotting import plot_comparison, add_plot_arguments, comparison_arrays
+from src.microcircuit import (MICROCIRCUIT_CONFIG, build_microcircuit, scale_microcircuit_config,
+                              apply_microcircuit_variant)
+from src.checkpoint import checkpoint_path, run_with_checkpoints, warm_up
+from src.topology import DEFAULT_TOPOLOGY_DIR
+from src.monitors import DEFAULT_RECORD_DT, add_clock_arguments, clock_periods, sampling_rate
+from src.recording import add_recording_arguments, recording_overrides, merge_policies
+from src.result_store import add_store_arguments, result_key, cached_result
 
-def run_simulation(real_data, duration=5*second):
+DEFAULT_CHECKPOINT_DIR = os.path.join(os.path.dirname(__file__), '..', 'results', 'checkpoints')
+
+def build_simulation(real_data, config=None):
     start_scope()
-    
-    n_exc = 120
-    n_inh = 30
-
-    model_ns = {
-        'v_rest': NETWORK_PARAMS['v_rest'],
-        'v_reset': NETWORK_PARAMS['v_reset'],
-        'v_thresh': NETWORK_PARAMS['v_thresh'],
-        'tau_m_exc': NETWORK_PARAMS['tau_m_exc'],
-        'tau_m_inh': NETWORK_PARAMS['tau_m_inh'],
-        'synaptic_weight': NETWORK_PARAMS['synaptic_weight'],
-        'refractory_period': NETWORK_PARAMS['refractory_period']
-    }
 
-    excitatory = NeuronGroup(n_exc, EXC_EQS,
-                            threshold='v > v_thresh',
-                            reset='v = v_reset; w += 3*mV',
-                            refractory='refractory_period',
-                            method='euler',
-                            namespace=model_ns)
-
-    inhibitory = NeuronGroup(n_inh, INH_EQS,
-                            threshold='v > v_thresh',
-                            reset='v = v_reset',
-                            refractory='refractory_period',
-                            method='euler',
-                            namespace=model_ns)
-
-    excitatory.v = NETWORK_PARAMS['v_rest'] + (randn(n_exc) * 8 * mV)
-    inhibitory.v = NETWORK_PARAMS['v_rest'] + (randn(n_inh) * 6 * mV)
-    excitatory.sigma = 4.5 * mV
-    inhibitory.sigma = 3.0 * mV
-    excitatory.w = 0 * mV
-    tau_w_values = 80 * ms + randn(n_exc) * 40 * ms
-    excitatory.tau_w = np.clip(tau_w_values, 20*ms, 200*ms)
-
-    ee_syn = Synapses(excitatory, excitatory, 'w_syn : volt', on_pre='I_syn_post += w_syn', namespace=model_ns)
-    for i in range(n_exc):
-        local_targets = list(range(max(0, i-10), min(n_exc, i+10)))
-        if i in local_targets:
-            local_targets.remove(i)
-        n_local = int(len(local_targets) * 0.3)
-        if n_local > 0:
-            chosen_local = np.random.choice(local_targets, size=min(n_local, len(local_targets)), replace=False)
-            for j in chosen_local:
-                ee_syn.connect(i=i, j=j)
-        
-        distant_targets = [j for j in range(n_exc) if abs(i-j) > 10]
-        n_distant = int(len(distant_targets) * 0.05)
-        if n_distant > 0 and len(distant_targets) > 0:
-            chosen_distant = np.random.choice(distant_targets, size=min(n_distant, len(distant_targets)), replace=False)
-            for j in chosen_distant:
-                ee_syn.connect(i=i, j=j)
-                
-    ee_syn.w_syn = NETWORK_PARAMS['synaptic_weight'] * (0.5 + 0.5 * rand(len(ee_syn)))
-
-    ei_syn = Synapses(excitatory, inhibitory, 'w_syn : volt', on_pre='I_syn_post += w_syn', namespace=model_ns)
-    ei_syn.connect(p=0.4)
-    ei_syn.w_syn = NETWORK_PARAMS['synaptic_weight'] * 1.5 * (0.8 + 0.4 * rand(len(ei_syn)))
-
-    ie_syn = Synapses(inhibitory, excitatory, 'w_syn : volt', on_pre='I_syn_post -= w_syn', delay=1*ms, namespace=model_ns)
-    ie_syn.connect(p=0.6)
-    ie_syn.w_syn = NETWORK_PARAMS['synaptic_weight'] * 3.0 * (0.7 + 0.6 * rand(len(ie_syn)))
-
-    ii_syn = Synapses(inhibitory, inhibitory, 'w_syn : volt', on_pre='I_syn_post -= w_syn', namespace=model_ns)
-    ii_syn.connect(p=0.2)
-    ii_syn.w_syn = NETWORK_PARAMS['synaptic_weight'] * 2.0
-
-    input_rate = real_data['mean_firing_rate'] * Hz
-    input_neurons = PoissonGroup(n_exc, rates=input_rate)
-    
-    input_syn = Synapses(input_neurons, excitatory, on_pre='I_syn_post += synaptic_weight * 1.2', namespace=model_ns)
-    
-    n_connections = int(0.8 * n_exc)
-    connect_indices = np.random.choice(n_exc, n_connections, replace=False)
-    input_syn.connect(i=connect_indices, j=connect_indices)
-
-    spike_mon_exc = SpikeMonitor(excitatory)
-    spike_mon_inh = SpikeMonitor(inhibitory)
-    state_mon_exc = StateMonitor(excitatory, ['v', 'I_syn', 'w'], record=range(min(30, n_exc)))
-    rate_mon_exc = PopulationRateMonitor(excitatory)
-    rate_mon_inh = PopulationRateMonitor(inhibitory)
-
-    net = Network(collect())
-    net.run(duration, report='text')
+    config = dict(MICROCIRCUIT_CONFIG if config is None else config)
+    config['input_rate'] = real_data['mean_firing_rate'] * Hz
+    key = prepare_run('run_simulation', EXC_EQS, INH_EQS, NETWORK_PARAMS, config)
+    with span('network_build'):
+        circuit = build_microcircuit(config)
+    return circuit, key
+
+def warmup_path(warmup, key):
+    return checkpoint_path(warmup['dir'], f"run_simulation-warmup{float(warmup['duration'] / second):g}s", key)
+
+def run_simulation(real_data, duration=5*second, config=None, checkpoint=None, warmup=None, variant=None):
+    # checkpoint: {'dir', 'every', 'resume'} saves the state every `every` of simulated time.
+    # warmup: {'dir', 'duration'} starts from a stored burn-in (simulated and stored on
+    # first use); variant then sets branchable parameters on the warmed-up circuit.
+    circuit, key = build_simulation(real_data, config)
+    config = circuit['config']
+    monitors = circuit['monitors']
+    n_neurons = config['n_exc'] + config['n_inh']
+
+    net = circuit['network']
+    t_start = 0 * second
+    if warmup is not None:
+        warm_up(net, warmup['duration'], warmup_path(warmup, key), key)
+        t_start = warmup['duration']
+    if variant:
+        apply_microcircuit_variant(circuit, variant)
+    # run_network records the code generation / build and net.run split itself.
+    if checkpoint is not None:
+        path = checkpoint_path(checkpoint['dir'], 'run_simulation', key)
+        timings = run_with_checkpoints(net, duration, path, checkpoint['every'] or duration,
+                                       resume=checkpoint['resume'], key=key, report='text')
+    else:
+        timings = run_network(net, duration, report='text')
+    instrumentation.set_value('n_neurons', n_neurons)
+    instrumentation.set_value('n_synapses', int(np.sum([len(syn) for syn in circuit['synapses'].values()])))
+    wall_time = timings['run']
+    logging.info(f"Simulated {n_neurons} neurons for {float(duration/second):.2f} s in {wall_time:.2f} s "
+                 f"({n_neurons * float(duration/second) / max(wall_time, 1e-9):.0f} neuron-seconds per second).")
 
     return {
-        "spike_mon_exc": spike_mon_exc,
-        "spike_mon_inh": spike_mon_inh,
-        "state_mon_exc": state_mon_exc,
-        "rate_mon_exc": rate_mon_exc,
-        "rate_mon_inh": rate_mon_inh,
+        "spike_mon_exc": monitors.get('spike_exc'),
+        "spike_mon_inh": monitors.get('spike_inh'),
+        "state_mon_exc": monitors.get('state_exc'),
+        "rate_mon_exc": monitors.get('rate_exc'),
+        "rate_mon_inh": monitors.get('rate_inh'),
+        "lfp_exc": monitors.get('lfp_exc'),
         "duration": duration,
-        "n_exc": n_exc,
+        "t_start": t_start,
+        "n_exc": config['n_exc'],
+        "n_inh": config['n_inh'],
+        "wall_time": wall_time,
+        "build_time": timings['build'],
+    }
+
+def run_simulation_point(input_rate=5*Hz, duration=1*second, synaptic_weight=None, scale=1.0, keep_indegree=True,
+                         warmup=None, record_dt=DEFAULT_RECORD_DT, input_dt=None):
+    config = scale_microcircuit_config(MICROCIRCUIT_CONFIG, scale, keep_indegree=keep_indegree)
+    config['record']['dt'] = record_dt
+    config['input_dt'] = input_dt
+    if warmup is not None:
+        # Every point shares the base circuit's burn-in; only the swept values differ afterwards.
+        variant = {'input_rate': input_rate}
+        if synaptic_weight is not None:
+            variant['synaptic_weight'] = synaptic_weight
+        return run_simulation({'mean_firing_rate': float(config['input_rate'] / Hz)}, duration=duration,
+                              config=config, warmup=warmup, variant=variant)
+    if synaptic_weight is not None:
+        config['synaptic_weight'] = synaptic_weight
+    return run_simulation({'mean_firing_rate': float(input_rate / Hz)}, duration=duration, config=config)
+
+def warm_up_simulation(warmup, scale=1.0, keep_indegree=True, record_dt=DEFAULT_RECORD_DT, input_dt=None):
+    # Stores the burn-in that run_simulation_point(warmup=...) branches from.
+    config = scale_microcircuit_config(MICROCIRCUIT_CONFIG, scale, keep_indegree=keep_indegree)
+    config['record']['dt'] = record_dt
+    config['input_dt'] = input_dt
+    circuit, key = build_simulation({'mean_firing_rate': float(config['input_rate'] / Hz)}, config)
+    path = warmup_path(warmup, key)
+    warm_up(circuit['network'], warmup['duration'], path, key)
+    return path
+
+def summarize_simulation(sim_results):
+    spike_mon_exc = sim_results['spike_mon_exc']
+    duration_s = float(sim_results['duration'] / second)
+    counts = np.bincount(np.asarray(spike_mon_exc.i), minlength=sim_results['n_exc'])
+    return {
+        "spike_times": np.asarray(spike_mon_exc.t / second, dtype=np.float32),
+        "spike_indices": np.asarray(spike_mon_exc.i, dtype=np.int32),
+        "rates": (counts / duration_s).astype(np.float32),
+        "mean_rate": float(counts.sum() / (sim_results['n_exc'] * duration_s)),
+        "wall_time": sim_results['wall_time'],
     }
 
 def main(args):
     setup_logging()
-    
-    session = get_session_data()
-    real_data = get_probe_data(session)
-
-    sim_results = run_simulation(real_data, duration=args.duration * second)
-    
-    real_isis = analyze_isi_distribution(real_data['spike_times'])
-    _, _, real_band_powers = analyze_lfp_bands(real_data['lfp'], real_data['lfp_fs'])
-    
-    sim_spike_times = {i: sim_results['spike_mon_exc'].t[sim_results['spike_mon_exc'].i == i] for i in range(sim_results['n_exc'])}
-    sim_isis = analyze_isi_distribution(sim_spike_times)
-    
-    sim_lfp = calculate_lfp(sim_results['state_mon_exc'])
-    _, _, sim_band_powers = analyze_lfp_bands(sim_lfp, 1000.0)
-
-    real_mean_rate = real_data['mean_firing_rate']
-    real_std_rate = real_data['std_firing_rate']
-    sim_mean_rate = len(sim_results['spike_mon_exc'].t) / (sim_results['n_exc'] * sim_results['duration'])
-    
-    plot_data = {
-        'real_mean_rate': real_mean_rate,
-        'real_std_rate': real_std_rate,
-        'sim_mean_rate': sim_mean_rate,
-        'real_isis': real_isis,
-        'sim_isis': sim_isis,
-        'real_band_powers': real_band_powers,
-        'sim_band_powers': sim_band_powers,
-    }
-    
-    plot_comparison({**plot_data, 'sim_results': sim_results})
+    recorder = instrumentation.start_recording('run_simulation', profile=args.profile,
+                                               duration=args.duration, scale=args.scale, backend=args.backend)
 
-    figures_dir = os.path.join(os.path.dirname(__file__), '..', 'figures')
-    if not os.path.exists(figures_dir):
-        os.makedirs(figures_dir)
-    
-    plt.savefig(os.path.join(figures_dir, "simulation_comparison.png"))
-    plt.show()
+    with span('data_fetch'):
+        real_data = get_cached_probe_data(args.probe_cache_dir, args.session_id, args.probe_id,
+                                          lfp_channel=args.lfp_channel)
+
+    config = scale_microcircuit_config(MICROCIRCUIT_CONFIG, args.scale, keep_indegree=args.keep_indegree)
+    config['weight_scaling'] = args.weight_scaling
+    config['seed'] = args.seed
+    config['topology_dir'] = args.topology_dir
+    config['topology_path'] = args.topology
+    clocks = clock_periods(args)
+    config['record']['dt'] = clocks['record_dt']
+    config['input_dt'] = clocks['input_dt']
+    # Recording policies by monitor name, e.g. --record state.policy=stats.
+    policies = merge_policies({'state': config['record']['state']}, recording_overrides(args))
+    config['record']['state'] = policies['state']
+    checkpoint = None
+    if args.checkpoint_every is not None or args.resume:
+        checkpoint = {'dir': args.checkpoint_dir, 'resume': args.resume,
+                      'every': None if args.checkpoint_every is None else args.checkpoint_every * second}
+    warmup = {'dir': args.checkpoint_dir, 'duration': args.warmup * second} if args.warmup else None
+    # Stored by everything that determines the outcome; the topology cache location does not.
+    key = result_key('run_simulation', {'config': {k: v for k, v in config.items() if k != 'topology_dir'},
+                                        'duration': args.duration, 'warmup': args.warmup,
+                                        'lfp_channel': real_data['lfp_channel'], 'backend': args.backend},
+                     seed=args.seed, data_fingerprint=real_data['fingerprint'])
+
+    def simulate_and_compare():
+        with span('simulation'):
+            sim_results = run_simulation(real_data, duration=args.duration * second, config=config,
+                                         checkpoint=checkpoint, warmup=warmup)
+        instrumentation.count('sim_spikes_exc', len(sim_results['spike_mon_exc'].t))
+
+        with span('isi_analysis'):
+            # Streamed into fixed-size sketches: the recording can hold tens of millions of ISIs.
+            real_isis = isi_sketch(real_data['spike_times'])
+            sim_spike_trains = SpikeTrains.from_spike_monitor(sim_results['spike_mon_exc'], t_start=sim_results['t_start'] / second,
+                                                              t_stop=(sim_results['t_start'] + sim_results['duration']) / second)
+            sim_isis = isi_sketch(sim_spike_trains)
+
+        with span('lfp_analysis'):
+            # Streamed from disk in bounded chunks rather than loading the whole channel.
+            lfp_chunks = iter_lfp_chunks(real_data['lfp_source'], channels=[real_data['lfp_channel']])
+            _, _, real_band_powers = welch_from_chunks(lfp_chunks, real_data['lfp_fs'])
+            sim_lfp = calculate_lfp(sim_results['lfp_exc'])
+            # The simulated LFP is sampled at the recording clock, not the simulation step;
+            # runs shorter than the default 2 s Welch window use a single window.
+            sim_lfp_fs = sampling_rate(sim_results['lfp_exc'])
+            _, _, sim_band_powers = analyze_lfp_bands(sim_lfp, sim_lfp_fs, win_seconds=min(2, args.duration))
+
+        real_mean_rate = real_data['mean_firing_rate']
+        real_std_rate = real_data['std_firing_rate']
+        sim_mean_rate = len(sim_results['spike_mon_exc'].t) / (sim_results['n_exc'] * sim_results['duration'])
+
+        plot_data = {
+            'real_mean_rate': real_mean_rate,
+            'real_std_rate': real_std_rate,
+            'sim_mean_rate': sim_mean_rate,
+            'real_isis': real_isis.to_dict(),
+            'sim_isis': sim_isis.to_dict(),
+            'real_band_powers': real_band_powers,
+            'sim_band_powers': sim_band_powers,
+        }
+        simulation = comparison_arrays(sim_results)
+        simulation['lfp'] = np.asarray(sim_lfp)
+        simulation['lfp_fs'] = sim_lfp_fs
+        return {
+            'plot_data': plot_data,
+            'simulation': simulation,
+            'summary': comparison_summary(sim_spike_trains, sim_isis, real_isis, real_data['firing_rates'],
+                                          real_mean_rate, real_std_rate, seed=args.seed),
+        }
+
+    # Unseeded runs differ every time, so they are never reused and only the latest is kept.
+    stored, found = cached_result(args.store_dir, 'run_simulation', key, simulate_and_compare,
+                                  reuse=not args.rerun, reproducible=args.seed is not None,
+                                  duration=args.duration, seed=args.seed)
+    if found:
+        logging.info(f"Reused the stored run {key}; pass --rerun to simulate again.")
+    plot_data = stored['plot_data']
+
+    if not args.no_plot:
+        import matplotlib.pyplot as plt
+        with span('plotting'):
+            plot_comparison({**plot_data, 'simulation': stored['simulation']})
+
+            figures_dir = os.path.join(os.path.dirname(__file__), '..', 'figures')
+            if not os.path.exists(figures_dir):
+                os.makedirs(figures_dir)
+
+            plt.savefig(os.path.join(figures_dir, "simulation_comparison.png"))
+        plt.show()
 
     results_dir = os.path.join(os.path.dirname(__file__), '..', 'results')
     if not os.path.exists(results_dir):
         os.makedirs(results_dir)
 
-    with open(os.path.join(results_dir, "run_simulation.json"), "w") as f:
-        json.dump(plot_data, f, indent=4, cls=Brian2Encoder)
+    with span('serialization'):
+        save_results(os.path.join(results_dir, "run_simulation"), plot_data)
+
+    instrumentation.stop_recording()
+    logging.info(recorder.summary())
+    # One line per run, appended next to the saved results.
+    recorder.write(os.path.join(results_dir, "run_simulation_metrics.jsonl"))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run neural simulation and compare with Allen data.")
     parser.add_argument('--duration', type=float, default=5.0, help='Duration of the simulation in seconds.')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Population size multiplier relative to the 120/30 reference circuit.')
+    parser.add_argument('--keep-indegree', action='store_true',
+                        help='Shrink connection probabilities when scaling so in-degrees stay fixed.')
+    parser.add_argument('--weight-scaling', choices=['sqrt_k'], default=None,
+                        help='Rescale synaptic weights with network in-degree.')
+    parser.add_argument('--session-id', type=int, default=None, help='Allen session to compare against.')
+    parser.add_argument('--probe-id', type=int, default=None, help='Allen probe to compare against.')
+    parser.add_argument('--probe-cache-dir', default=DEFAULT_PROBE_CACHE_DIR,
+                        help='Preprocessed probe cache; filled from the AllenSDK on first use.')
+    parser.add_argument('--lfp-channel', type=int, default=None,
+                        help='Probe LFP channel (column index) to compare against; defaults to the middle of the probe.')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed the model; the seeded wiring is generated once and reused from --topology-dir.')
+    parser.add_argument('--topology-dir', default=DEFAULT_TOPOLOGY_DIR,
+                        help='Cache of generated topologies, keyed by config and seed.')
+    parser.add_argument('--topology', default=None,
+                        help='Wire the circuit from this topology directory, writing it there first if missing.')
+    parser.add_argument('--checkpoint-every', type=float, default=None,
+                        help='Save the full network state every this many simulated seconds.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue from the checkpoint of an interrupted run of the same model.')
+    parser.add_argument('--warmup', type=float, default=0.0,
+                        help='Seconds of unrecorded burn-in, simulated once per model and reused from the checkpoint directory.')
+    parser.add_argument('--checkpoint-dir', default=DEFAULT_CHECKPOINT_DIR,
+                        help='Where checkpoints and stored warm-ups are kept.')
+    parser.add_argument('--profile', action='store_true',
+                        help="Enable Brian2 profiling and record per-population/projection timings in the metrics file.")
+    add_clock_arguments(parser)
+    add_recording_arguments(parser)
+    add_plot_arguments(parser)
+    add_backend_arguments(parser)
+    add_store_arguments(parser)
     args = parser.parse_args()
+    configure_backend(args.backend, args.cache_dir)
     main(args)
\ No newline at end of file
@@ -0,0 +1,105 @@
+import argparse
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.startup import skip_pylab
+skip_pylab()
+import logging
+from src.logging_config import setup_logging
+from src.result_store import add_store_arguments, run_arguments, result_key, cached_result
+import time
+import inspect
+from tqdm import tqdm
+from brian2 import second
+
+from src.backend import add_backend_arguments, configure_backend
+from src.sweep import run_sweep, expand_grid, resolve_target
+from src.quantities import parse_quantity
+
+TARGETS = {
+    'neuromodulation': ('neuromodulation_demo:run_neuromodulation_demo',
+                        'neuromodulation_demo:summarize_neuromodulation_demo'),
+    'simulation': ('run_simulation:run_simulation_point',
+                   'run_simulation:summarize_simulation'),
+}
+
+# Targets that can branch every point from one shared, stored burn-in.
+WARMUP_TARGETS = {
+    'simulation': 'run_simulation:warm_up_simulation',
+}
+DEFAULT_CHECKPOINT_DIR = os.path.join(os.path.dirname(__file__), '..', 'results', 'checkpoints')
+
+def parse_grid_argument(text):
+    # "dopamine=0,0.5,1" or "duration=200*ms,500*ms"
+    name, _, values = text.partition('=')
+    if not values:
+        raise argparse.ArgumentTypeError(f"Grid entries look like name=v1,v2,... (got '{text}').")
+    try:
+        return name.strip(), [parse_quantity(value) for value in values.split(',')]
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def _to_serializable(value):
+    return str(value) if hasattr(value, 'dim') else value
+
+def prepare_warmups(target_name, grid, warmup):
+    # Simulates the burn-in here, once per distinct circuit structure in the grid,
+    # so that workers only ever restore it.
+    if target_name not in WARMUP_TARGETS:
+        raise ValueError(f"The '{target_name}' target does not support --warmup.")
+    warm_up_target = resolve_target(WARMUP_TARGETS[target_name])
+    structural = {name: values for name, values in grid.items()
+                  if name in inspect.signature(warm_up_target).parameters}
+    for params in expand_grid(structural):
+        path = warm_up_target(warmup, **params)
+        logging.info(f"Warm-up for {params or 'the base circuit'} stored in {path}.")
+
+def main(args):
+    setup_logging()
+    target, reducer = TARGETS[args.target]
+    grid = dict(args.grid)
+    points = expand_grid(grid)
+
+    name = f"{args.target}_sweep"
+    key = result_key(name, run_arguments(args), seed=args.seed)
+
+    def sweep_points():
+        start_time = time.perf_counter()
+        target_kwargs = {}
+        if args.warmup:
+            configure_backend(args.backend, args.cache_dir)
+            target_kwargs['warmup'] = {'dir': args.checkpoint_dir, 'duration': args.warmup * second}
+            prepare_warmups(args.target, grid, target_kwargs['warmup'])
+
+        output = {}
+        sweep = run_sweep(target, points, reducer=reducer, n_workers=args.workers, base_seed=args.seed,
+                          backend=args.backend, cache_dir=args.cache_dir, target_kwargs=target_kwargs)
+        for index, params, summary in tqdm(sweep, total=len(points), desc=f"{args.target} sweep"):
+            output[f'{index:05d}'] = {
+                'params': {k: _to_serializable(v) for k, v in params.items()},
+                'summary': summary,
+            }
+        elapsed = time.perf_counter() - start_time
+        logging.info(f"Sweep of {len(points)} points finished in {elapsed:.1f} s.")
+        return {'elapsed': elapsed, 'points': dict(sorted(output.items()))}
+
+    # Every point has a seed derived from --seed, so a stored sweep of the same grid is reused.
+    _, found = cached_result(args.store_dir, name, key, sweep_points, reuse=not args.rerun, seed=args.seed)
+    if found:
+        logging.info(f"Reused the stored sweep {key}; pass --rerun to run it again.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a parameter sweep across a process pool.")
+    parser.add_argument('target', choices=sorted(TARGETS), help='Which simulation to sweep.')
+    parser.add_argument('--grid', type=parse_grid_argument, action='append', default=[],
+                        help="Parameter values, e.g. --grid dopamine=0,0.5,1 --grid duration=200*ms,500*ms.")
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: all cores).')
+    parser.add_argument('--seed', type=int, default=0, help='Base seed; each point gets its own derived seed.')
+    parser.add_argument('--warmup', type=float, default=0.0,
+                        help='Seconds of shared burn-in simulated once and branched into every point.')
+    parser.add_argument('--checkpoint-dir', default=DEFAULT_CHECKPOINT_DIR,
+                        help='Where stored warm-ups are kept.')
+    add_backend_arguments(parser)
+    add_store_arguments(parser)
+    args = parser.parse_args()
+    main(args)
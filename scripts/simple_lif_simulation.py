@@ -1,26 +1,57 @@
-import matplotlib.pyplot as plt
+import argparse
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.startup import skip_pylab
+skip_pylab()
 import logging
 from src.logging_config import setup_logging
-import json
+from src.result_store import add_store_arguments, run_arguments, result_key, cached_result
 
 from brian2 import *
-from brian2 import prefs
 
-prefs.codegen.target = 'numpy'
+from src.backend import configure_backend, add_backend_arguments, prepare_run, run_network
+from src.plotting import plot_raster, add_plot_arguments
 
 from src.neuron_models import LIF_EQS, LIF_PARAMS
 from src.synapses import STDP_EQS, STDP_PARAMS
 from src.stimuli import generate_oscillatory_input
-from scipy.signal import welch
-
-def run_simple_lif_simulation(duration=1*second):
+from src.monitors import (DEFAULT_RECORD_DT, sampling_rate, clock_kwargs, expect_input_clock, add_clock_arguments,
+                          clock_periods)
+from src.recording import (record_state, recorded_mean, merge_policies, add_recording_arguments,
+                           recording_overrides)
+from src.connectivity import fixed_probability
+from src.topology import (node_population, edge_population, load_or_create_topology, check_population,
+                          set_node_params, connect_from_edges)
+
+LAYERS = ['L2_3', 'L4', 'L5', 'L6']
+# Recording policy per monitor (see src/recording.py). Only the population mean
+# of v is needed, so it is reduced in-run instead of recording every neuron.
+RECORDING = {
+    'lfp': {'policy': 'population', 'reduce': 'mean'},
+}
+
+def generate_simple_lif_topology(n_neurons=100):
+    v_rest = LIF_PARAMS['v_rest']
+    v_thresh = LIF_PARAMS['v_thresh']
+    nodes = {layer: node_population(n_neurons, LIF_EQS, v=v_rest + np.random.rand(n_neurons) * (v_thresh - v_rest))
+             for layer in LAYERS}
+    nodes['input'] = node_population(n_neurons, 'poisson')
+    edges = {}
+    for pre_name in LAYERS:
+        for post_name in LAYERS:
+            i, j = fixed_probability(n_neurons, n_neurons, 0.1)
+            edges[f'{pre_name}_{post_name}'] = edge_population(pre_name, post_name, i, j, weight=np.random.rand(len(i)))
+    i, j = fixed_probability(n_neurons, n_neurons, 0.2)
+    edges['input'] = edge_population('input', 'L4', i, j)
+    return nodes, edges
+
+def run_simple_lif_simulation(duration=1*second, n_neurons=100, topology_path=None, record_dt=DEFAULT_RECORD_DT,
+                              input_dt=None, recording=None):
+    # topology_path: wire from this topology directory (written there first if missing)
+    # so that different models can run on exactly the same network.
     start_scope()
     
-    n_neurons = 100
-    
     objects = []
     
     model_ns = {
@@ -34,9 +65,20 @@ def run_simple_lif_simulation(duration=1*second):
         'A_pre': STDP_PARAMS['A_pre'],
         'A_post': STDP_PARAMS['A_post']
     }
+    prepare_run('simple_lif_simulation', LIF_EQS, STDP_EQS, STDP_PARAMS, model_ns, n_neurons, duration, topology_path,
+                record_dt, input_dt, recording)
+
+    if topology_path is None:
+        nodes, edges = generate_simple_lif_topology(n_neurons)
+    else:
+        topology = load_or_create_topology(topology_path, lambda: generate_simple_lif_topology(n_neurons),
+                                           name='simple_lif')
+        nodes, edges = topology['nodes'], topology['edges']
+        for population in nodes:
+            check_population(topology, population, n_neurons)
     
     layers = {}
-    for layer_name in ['L2_3', 'L4', 'L5', 'L6']:
+    for layer_name in LAYERS:
         group = NeuronGroup(n_neurons, LIF_EQS, 
                             threshold="v > v_thresh", 
                             reset="v = v_reset",
@@ -44,9 +86,7 @@ def run_simple_lif_simulation(duration=1*second):
                             method='exact', 
                             name=f'{layer_name}_neurons',
                             namespace=model_ns)
-        v_rest = LIF_PARAMS['v_rest']
-        v_thresh = LIF_PARAMS['v_thresh']
-        group.v = v_rest + np.random.rand(n_neurons) * (v_thresh - v_rest)
+        set_node_params(group, nodes[layer_name])
         layers[layer_name] = group
         objects.append(group)
 
@@ -58,42 +98,48 @@ def run_simple_lif_simulation(duration=1*second):
                            on_post=STDP_PARAMS['on_post'],
                            namespace=model_ns,
                            name=f'syn_{pre_name}_{post_name}')
-            syn.connect(p=0.1)
-            syn.w = 'rand()'
+            connect_from_edges(syn, edges[f'{pre_name}_{post_name}'], weight='w')
             objects.append(syn)
     
     theta_drive = generate_oscillatory_input(6*Hz, duration)
     gamma_drive = generate_oscillatory_input(40*Hz, duration)
 
-    input_group = PoissonGroup(n_neurons, rates='50*Hz + 20*Hz*theta_drive(t) + 10*Hz*gamma_drive(t)')
-    input_syn = Synapses(input_group, layers['L4'], on_pre='v_post += 1.5 * mV')
-    input_syn.connect(p=0.2)
+    input_clock = clock_kwargs(input_dt)
+    input_group = PoissonGroup(n_neurons, rates='50*Hz + 20*Hz*theta_drive(t) + 10*Hz*gamma_drive(t)',
+                               name='input', **input_clock)
+    input_syn = Synapses(input_group, layers['L4'], on_pre='v_post += 1.5 * mV', name='input_syn', **input_clock)
+    expect_input_clock(input_syn)
+    connect_from_edges(input_syn, edges['input'])
     objects.extend([input_group, input_syn])
 
-    spike_mon = SpikeMonitor(layers['L4'])
-    state_mon = StateMonitor(layers['L4'], 'v', record=True)
-    objects.extend([spike_mon, state_mon])
+    spike_mon = SpikeMonitor(layers['L4'], name='spike_mon')
+    policies = merge_policies(RECORDING, recording)
+    lfp_mon = record_state(layers['L4'], 'v', policies['lfp'], dt=record_dt, name='lfp_L4')
+    objects.extend([spike_mon, *lfp_mon['objects']])
 
     net = Network(objects)
-    net.run(duration, report='text')
+    run_network(net, duration, report='text')
 
-    return spike_mon, state_mon
+    return spike_mon, lfp_mon
 
-def plot_simple_lif_results(spike_mon, state_mon):
+def plot_simple_lif_results(spike_mon, lfp_mon):
+    import matplotlib.pyplot as plt
+    from scipy.signal import welch
     plt.figure(figsize=(10, 4))
-    plt.plot(spike_mon.t/ms, spike_mon.i, '.k')
+    plot_raster(plt.gca(), spike_mon.t_, spike_mon.i, len(spike_mon.source), 0.0, float(spike_mon.clock.t / second))
     plt.xlabel('Time (ms)')
     plt.ylabel('Neuron index')
     plt.title('Spike Raster - Layer 4')
     plt.savefig("figures/simple_lif_simulation_spike_raster.png")
     plt.show()
 
-    lfp = np.mean(state_mon.v / mV, axis=0)
-    freqs, psd = welch(lfp, fs=1000.0)
+    lfp_time, lfp = recorded_mean(lfp_mon)
+    lfp = lfp / float(mV)
+    freqs, psd = welch(lfp, fs=sampling_rate(lfp_mon))
 
     plt.figure(figsize=(12, 4))
     plt.subplot(121)
-    plt.plot(state_mon.t/ms, lfp)
+    plt.plot(lfp_time / float(ms), lfp)
     plt.xlabel('Time (ms)')
     plt.ylabel('Mean Voltage (mV)')
     plt.title('Simulated LFP - Layer 4')
@@ -108,26 +154,46 @@ def plot_simple_lif_results(spike_mon, state_mon):
     plt.show()
 
 if __name__ == "__main__":
-    setup_logging()
-    spike_mon, state_mon = run_simple_lif_simulation()
-    
-    plot_simple_lif_results(spike_mon, state_mon)
-
-    lfp = np.mean(state_mon.v / mV, axis=0)
-    freqs, psd = welch(lfp, fs=1000.0)
-
-    results = {
-        "spike_times": [float(t) for t in spike_mon.t/ms],
-        "neuron_indices": [int(i) for i in spike_mon.i],
-        "lfp": [float(v) for v in lfp],
-        "lfp_time": [float(t) for t in state_mon.t/ms],
-        "psd_frequencies": [float(f) for f in freqs],
-        "psd_power": [float(p) for p in psd]
-    }
+    parser = argparse.ArgumentParser(description="Run the multi-layer STDP simulation.")
+    parser.add_argument('--topology', default=None,
+                        help='Wire the network from this topology directory, writing it there first if missing.')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed the wiring, initial potentials and inputs; seeded runs are reused from the result store.')
+    add_clock_arguments(parser)
+    add_recording_arguments(parser)
+    add_plot_arguments(parser)
+    add_backend_arguments(parser)
+    add_store_arguments(parser)
+    args = parser.parse_args()
 
-    results_dir = os.path.join(os.path.dirname(__file__), '..', 'results')
-    if not os.path.exists(results_dir):
-        os.makedirs(results_dir)
-        
-    with open(os.path.join(results_dir, "simple_lif_simulation.json"), "w") as f:
-        json.dump(results, f, indent=4)
+    setup_logging()
+    configure_backend(args.backend, args.cache_dir)
+    if args.seed is not None:
+        seed(args.seed)
+    overrides = recording_overrides(args)
+    key = result_key('simple_lif_simulation', {**run_arguments(args), 'recording': overrides}, seed=args.seed)
+
+    def simulate():
+        spike_mon, lfp_mon = run_simple_lif_simulation(topology_path=args.topology, recording=overrides,
+                                                       **clock_periods(args))
+        if not args.no_plot:
+            plot_simple_lif_results(spike_mon, lfp_mon)
+
+        from scipy.signal import welch
+        lfp_time, lfp = recorded_mean(lfp_mon)
+        lfp = lfp / float(mV)
+        freqs, psd = welch(lfp, fs=sampling_rate(lfp_mon))
+        return {
+            "spike_times": np.asarray(spike_mon.t/ms),
+            "neuron_indices": np.asarray(spike_mon.i),
+            "lfp": np.asarray(lfp),
+            "lfp_time": lfp_time / float(ms),
+            "psd_frequencies": freqs,
+            "psd_power": psd
+        }
+
+    # Unseeded runs differ every time, so they are never reused and only the latest is kept.
+    results, found = cached_result(args.store_dir, 'simple_lif_simulation', key, simulate,
+                                   reuse=not args.rerun, reproducible=args.seed is not None, seed=args.seed)
+    if found:
+        logging.info(f"Reused the stored run {key}; pass --rerun to simulate (and plot) again.")
@@ -0,0 +1,40 @@
+import argparse
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from src.startup import skip_pylab
+skip_pylab()
+import logging
+from src.logging_config import setup_logging
+
+from src.backend import configure_backend, add_backend_arguments
+from src.worker import DEFAULT_SOCKET_DIR, DEFAULT_MAX_MODELS, serve, start_workers, stop_workers
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve simulation requests from warm, already built networks.")
+    parser.add_argument('--socket', default=os.path.join(DEFAULT_SOCKET_DIR, 'worker-0.sock'),
+                        help='Unix socket to listen on.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Start this many workers on worker-<k>.sock sockets next to --socket.')
+    parser.add_argument('--max-models', type=int, default=DEFAULT_MAX_MODELS,
+                        help='Built models each worker keeps; the least recently used is dropped first.')
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.workers > 1:
+        workers = start_workers(args.workers, os.path.dirname(os.path.abspath(args.socket)), args.backend,
+                                args.cache_dir, args.max_models)
+        try:
+            for worker in workers:
+                worker['process'].wait()
+        except KeyboardInterrupt:
+            logging.info("Stopping workers.")
+        finally:
+            stop_workers(workers)
+    else:
+        configure_backend(args.backend, args.cache_dir)
+        try:
+            serve(args.socket, args.max_models)
+        except KeyboardInterrupt:
+            logging.info("Worker stopped.")
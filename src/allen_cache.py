@@ -0,0 +1,245 @@
+import os
+import time
+import logging
+from contextlib import ExitStack
+import numpy as np
+from tqdm import tqdm
+
+from src.fingerprint import fingerprint
+from src.instrumentation import span
+from src.spike_trains import SpikeTrains
+from src.lfp import lfp_from_session, open_cached_lfp, default_lfp_channel, iter_lfp_chunks
+from src.results_io import save_results, load_results, read_metadata, list_results
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROBE_CACHE_DIR = os.path.join("ecephys_cache", "preprocessed")
+# Bump when the extracted layout changes so stale caches are re-extracted.
+CACHE_VERSION = 2
+
+
+def probe_cache_path(cache_dir, session_id, probe_id):
+    return os.path.join(cache_dir, f"session_{session_id}_probe_{probe_id}")
+
+
+def probe_fingerprint(session_id, probe_id, unit_ids, counts, channel_ids, lfp_shape):
+    # What a cache was extracted from: the kept units and their spike counts, the
+    # LFP channels and the LFP shape. Computed the same way from a session and
+    # from a cache's own contents.
+    return fingerprint(CACHE_VERSION, int(session_id), int(probe_id), np.asarray(unit_ids, dtype=np.int64),
+                       np.asarray(counts, dtype=np.int64), np.asarray(channel_ids, dtype=np.int64),
+                       [int(n) for n in lfp_shape])
+
+
+def _session_id(session):
+    return int(getattr(session, 'ecephys_session_id', getattr(session, 'session_id', 0)))
+
+
+def extract_probe(session, probe_id=None, cache_dir=DEFAULT_PROBE_CACHE_DIR):
+    if probe_id is None:
+        if session.probes.empty:
+            raise ValueError("No probes found in the session.")
+        probe_id = session.probes.index[0]
+    session_id = _session_id(session)
+
+    kept_ids, trains, rates = _probe_units(session, session_id, probe_id)
+    counts = np.array([len(train) for train in trains], dtype=np.int64)
+    offsets = np.zeros(len(trains) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    times = np.concatenate(trains) if trains else np.zeros(0, dtype=np.float64)
+    rates = np.asarray(rates, dtype=np.float64)
+
+    path = probe_cache_path(cache_dir, session_id, probe_id)
+    os.makedirs(cache_dir, exist_ok=True)
+    with ExitStack() as stack:
+        try:
+            lfp_source = stack.enter_context(lfp_from_session(session, probe_id))
+        except Exception as e:
+            raise ConnectionError(f"Could not fetch LFP data for probe {probe_id}. Original error: {e}")
+        lfp = _stage_lfp(lfp_source, path)
+        stack.callback(_remove_staged, lfp)
+        channel_ids = lfp_source['channel_ids'].astype(np.int64)
+        lfp_values = lfp['values']
+        cache_key = probe_fingerprint(session_id, probe_id, kept_ids, counts, channel_ids, lfp_values.shape)
+        _save_probe(path, session_id, probe_id, kept_ids, offsets, times, rates, lfp, lfp_source, cache_key,
+                    session_source(session, probe_id))
+    logger.info(f"Cached probe {probe_id} ({len(times)} spikes, LFP {lfp_values.shape}) in {path}.")
+    return path
+
+
+def _probe_units(session, session_id, probe_id):
+    units = session.units
+    unit_ids = np.asarray(units.index[units['probe_id'] == probe_id], dtype=np.int64)
+    logger.info(f"Extracting {len(unit_ids)} units from session {session_id}, probe {probe_id}...")
+
+    # Same selection as get_probe_data: units with at least two spikes.
+    kept_ids, trains, rates = [], [], []
+    for unit_id in tqdm(unit_ids, desc="Extracting spike times"):
+        spikes = np.asarray(session.spike_times[unit_id], dtype=np.float64)
+        if len(spikes) > 1:
+            kept_ids.append(unit_id)
+            trains.append(np.sort(spikes))
+            rates.append(len(spikes) / (spikes[-1] - spikes[0]))
+    return kept_ids, trains, rates
+
+
+def session_source(session, probe_id):
+    # What a cache claims to be extracted from, from the session's tables only (no
+    # spike trains or LFP are read): session and probe id, and the probe's unit
+    # and channel ids.
+    units = session.units
+    unit_ids = np.sort(np.asarray(units.index[units['probe_id'] == probe_id], dtype=np.int64))
+    channels = getattr(session, 'channels', None)
+    channel_ids = (np.sort(np.asarray(channels.index[channels['probe_id'] == probe_id], dtype=np.int64))
+                   if channels is not None and 'probe_id' in channels else None)
+    return fingerprint(CACHE_VERSION, _session_id(session), int(probe_id), unit_ids, channel_ids)
+
+
+def session_fingerprint(session, probe_id=None):
+    # The fingerprint extract_probe would give this session's probe. Reads every
+    # spike train and opens the LFP, so it is only used on request.
+    if probe_id is None:
+        probe_id = session.probes.index[0]
+    session_id = _session_id(session)
+    kept_ids, trains, _ = _probe_units(session, session_id, probe_id)
+    with lfp_from_session(session, probe_id) as lfp_source:
+        return probe_fingerprint(session_id, probe_id, kept_ids, [len(train) for train in trains],
+                                 lfp_source['channel_ids'], lfp_source['data'].shape)
+
+
+def cache_fingerprint(path):
+    # Recomputed from the cache's stored arrays, to check against the stored one.
+    meta = read_metadata(path)
+    cached = load_results(path, mmap=True)
+    return probe_fingerprint(cached['session_id'], cached['probe_id'], cached['unit_ids'],
+                             np.diff(cached['unit_offsets']), cached['lfp']['channel_ids'],
+                             meta['arrays']['lfp/values']['shape'])
+
+
+def _stage_lfp(lfp_source, path):
+    # Copies the LFP chunk by chunk into memory-mapped staging files, accumulating
+    # each channel's sum of squares on the way, so the probe is never held whole.
+    n_samples, n_channels = lfp_source['data'].shape
+    staged = {'files': [f"{path}.lfp-{os.getpid()}.npy", f"{path}.times-{os.getpid()}.npy"]}
+    staged['values'] = np.lib.format.open_memmap(staged['files'][0], mode='w+', dtype=np.float32,
+                                                 shape=(n_samples, n_channels))
+    staged['times'] = np.lib.format.open_memmap(staged['files'][1], mode='w+', dtype=np.float64,
+                                                shape=(n_samples,))
+    sum_sq = np.zeros(n_channels)
+    position = 0
+    for times, block in iter_lfp_chunks(lfp_source):
+        stop = position + block.shape[1]
+        staged['values'][position:stop] = block.T
+        staged['times'][position:stop] = times
+        sum_sq += np.einsum('ij,ij->i', block, block, dtype=np.float64)
+        position = stop
+    staged['rms'] = np.sqrt(sum_sq / max(n_samples, 1))
+    return staged
+
+
+def _remove_staged(staged):
+    for name in ('values', 'times'):
+        staged.pop(name, None)
+    for staged_file in staged['files']:
+        if os.path.exists(staged_file):
+            os.remove(staged_file)
+
+
+def _save_probe(path, session_id, probe_id, kept_ids, offsets, times, rates, lfp, lfp_source, cache_key, source):
+    save_results(path, {
+        'session_id': session_id,
+        'probe_id': int(probe_id),
+        'unit_ids': np.asarray(kept_ids, dtype=np.int64),
+        'unit_offsets': offsets,
+        'spike_times': times,
+        'firing_rates': rates,
+        'mean_firing_rate': float(np.mean(rates)) if len(rates) else 0.0,
+        'std_firing_rate': float(np.std(rates)) if len(rates) else 0.0,
+        'lfp': {
+            'values': lfp['values'],
+            'times': lfp['times'],
+            'channel_ids': lfp_source['channel_ids'].astype(np.int64),
+            'channel_depths': lfp_source['depths'],
+            'fs': lfp_source['fs'],
+            'channel_rms': lfp['rms'],
+        },
+    }, metadata={'cache_version': CACHE_VERSION, 'fingerprint': cache_key, 'source': source})
+
+
+def find_cached_probe(cache_dir=DEFAULT_PROBE_CACHE_DIR, session_id=None, probe_id=None, expected=None,
+                      source=None):
+    # A cache is used only if its contents match its stored fingerprint and, when
+    # given, its source matches `source` (session_source) and its fingerprint
+    # matches `expected` (session_fingerprint).
+    for name in list_results(cache_dir):
+        path = os.path.join(cache_dir, name)
+        metadata = read_metadata(path)['metadata']
+        if metadata.get('cache_version') != CACHE_VERSION:
+            continue
+        if session_id is not None and name.split('_')[1] != str(session_id):
+            continue
+        if probe_id is not None and name.split('_')[3] != str(probe_id):
+            continue
+        stored = metadata.get('fingerprint')
+        if stored != cache_fingerprint(path):
+            logger.warning(f"Ignoring {path}: its contents do not match its fingerprint.")
+            continue
+        if source is not None and metadata.get('source') != source:
+            logger.info(f"Ignoring {path}: it was extracted from another session's units or channels.")
+            continue
+        if expected is not None and stored != expected:
+            logger.info(f"Ignoring {path}: it was extracted from different data.")
+            continue
+        return path
+    return None
+
+
+def load_probe_cache(path, lfp_channel=None):
+    start_time = time.perf_counter()
+    cached = load_results(path, mmap=True)
+    lfp_source = open_cached_lfp(path)
+    if lfp_channel is None:
+        lfp_channel = default_lfp_channel(lfp_source)
+    probe_data = {
+        "mean_firing_rate": cached['mean_firing_rate'],
+        "std_firing_rate": cached['std_firing_rate'],
+        "firing_rates": cached['firing_rates'],
+        "spike_times": SpikeTrains(cached['spike_times'], cached['unit_offsets'], cached['unit_ids']),
+        # One channel of the memory-mapped (time x channel) array, as get_probe_data returns.
+        "lfp": lfp_source['data'][:, lfp_channel],
+        "lfp_fs": lfp_source['fs'],
+        "lfp_channel": lfp_channel,
+        "lfp_channel_id": int(lfp_source['channel_ids'][lfp_channel]),
+        "lfp_source": lfp_source,
+        "session_id": cached['session_id'],
+        "probe_id": cached['probe_id'],
+        "fingerprint": read_metadata(path)['metadata']['fingerprint'],
+    }
+    logger.info(f"Loaded cached probe {probe_data['probe_id']} in {1000 * (time.perf_counter() - start_time):.1f} ms.")
+    return probe_data
+
+
+def get_cached_probe_data(cache_dir=DEFAULT_PROBE_CACHE_DIR, session_id=None, probe_id=None,
+                          ecephys_cache_dir="ecephys_cache", session=None, lfp_channel=None, verify_data=False):
+    # With a session at hand, the cache must come from that session's probe, units
+    # and channels, which its tables tell without reading any data. verify_data=True
+    # also compares every unit's spike count and the LFP shape against the session,
+    # which reads all of its spike trains.
+    expected = source = None
+    if session is not None:
+        session_id = _session_id(session)
+        probe_id = session.probes.index[0] if probe_id is None else probe_id
+        source = session_source(session, probe_id)
+        if verify_data:
+            expected = session_fingerprint(session, probe_id)
+    path = find_cached_probe(cache_dir, session_id, probe_id, expected, source)
+    if path is None:
+        logger.info("No valid preprocessed probe cache found; extracting from the AllenSDK session.")
+        if session is None:
+            from src.allen_data import get_session_data
+            with span('allen_session'):
+                session = get_session_data(ecephys_cache_dir, session_id)
+        with span('probe_extract'):
+            path = extract_probe(session, probe_id, cache_dir)
+    with span('probe_cache_load'):
+        return load_probe_cache(path, lfp_channel)
@@ -1,11 +1,13 @@
 import os
 import numpy as np
-from allensdk.brain_observatory.ecephys.ecephys_project_cache import EcephysProjectCache
 import warnings
 import logging
 from tqdm import tqdm
+from src.lfp import lfp_from_session, default_lfp_channel
 
 def get_session_data(cache_dir="ecephys_cache", session_id=None):
+    # Imported here so cached and synthetic data paths never pay for allensdk.
+    from allensdk.brain_observatory.ecephys.ecephys_project_cache import EcephysProjectCache
     logging.info("Initializing AllenSDK cache...")
     manifest_path = os.path.join(cache_dir, "manifest.json")
     
@@ -43,7 +45,7 @@ def get_session_data(cache_dir="ecephys_cache", session_id=None):
     logging.info("Session data downloaded.")
     return session
 
-def get_probe_data(session, probe_id=None):
+def get_probe_data(session, probe_id=None, lfp_channel=None):
     if probe_id is None:
         probes = session.probes
         if probes.empty:
@@ -78,18 +80,19 @@ def get_probe_data(session, probe_id=None):
 
     logging.info(f"Retrieving LFP data for probe {probe_id}...")
     try:
-        lfp = session.get_lfp(probe_id)
-        logging.info("LFP data retrieved.")
+        with lfp_from_session(session, probe_id) as lfp_source:
+            logging.info("LFP data retrieved.")
+            # A single channel: flattening (time x channel) would splice channels into one fake series.
+            if lfp_channel is None:
+                lfp_channel = default_lfp_channel(lfp_source)
+            probe_data['lfp'] = np.asarray(lfp_source['data'][:, lfp_channel])
+            probe_data['lfp_fs'] = lfp_source['fs']
+            probe_data['lfp_channel'] = lfp_channel
+            probe_data['lfp_channel_id'] = int(lfp_source['channel_ids'][lfp_channel])
     except Exception as e:
         logging.error(f"Failed to get LFP data for probe {probe_id}.")
         raise ConnectionError(f"Could not fetch LFP data from AllenSDK. Original error: {e}")
+    # Reopened (and closed again) by iter_lfp_chunks for multi-channel analysis.
+    probe_data['lfp_source'] = {'session': session, 'probe_id': probe_id}
 
-    probe_data['lfp'] = lfp.values.flatten()
-    
-    if hasattr(lfp, 'time') and len(lfp['time']) > 1:
-        lfp_time = lfp['time'].values
-        probe_data['lfp_fs'] = 1.0 / (lfp_time[1] - lfp_time[0])
-    else:
-        probe_data['lfp_fs'] = 1250.0 
-    
     return probe_data
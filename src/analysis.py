@@ -1,11 +1,14 @@
 import numpy as np
-from scipy.signal import welch, coherence, butter, filtfilt, hilbert, find_peaks
 import logging
-from scipy.stats import ks_2samp
+from src.spike_trains import SpikeTrains
+from src.sketches import ISI_RANGE, RATE_RANGE, LogHistogram, compare_sketches
+from src.spectral import band_powers as compute_band_powers, coherence_matrix, design_band_sos
 
 logger = logging.getLogger(__name__)
 
 def analyze_lfp_bands(lfp_data, fs, win_seconds=2):
+    # scipy.signal is imported on first use; it roughly doubles the import time otherwise.
+    from scipy.signal import welch
     win_size = int(fs * win_seconds)
     if len(lfp_data) < win_size:
         logger.warning("LFP data is too short for the requested window size. Skipping analysis.")
@@ -13,21 +16,7 @@ def analyze_lfp_bands(lfp_data, fs, win_seconds=2):
     
     try:
         freqs, psd = welch(lfp_data, fs, nperseg=win_size)
-
-        bands = {
-            'delta': (1, 4),
-            'theta': (4, 8),
-            'alpha': (8, 13),
-            'beta': (13, 30),
-            'gamma': (30, 100)
-        }
-        
-        df = freqs[1] - freqs[0]
-        band_powers = {}
-        for band_name, (low, high) in bands.items():
-            mask = (freqs >= low) & (freqs <= high)
-            band_power = np.sum(psd[mask]) * df
-            band_powers[band_name] = max(band_power, 1e-10)
+        band_powers = {name: float(power) for name, power in compute_band_powers(freqs, psd).items()}
         
         return freqs, psd, band_powers
     except Exception as e:
@@ -35,24 +24,34 @@ def analyze_lfp_bands(lfp_data, fs, win_seconds=2):
         return None
 
 def analyze_isi_distribution(spike_monitor):
-    all_isis = []
-    for _, spikes in spike_monitor.items():
-        if len(spikes) > 1:
-            isis = np.diff(spikes)
-            all_isis.extend(isis)
-    all_isis = np.array(all_isis)
-    all_isis = all_isis[all_isis < 1.0]
-    return all_isis
+    # Accepts SpikeTrains or any {unit: spike_times} mapping; ISIs of 1 s or more are dropped.
+    spike_trains = SpikeTrains.from_dict(spike_monitor)
+    return spike_trains.isis(max_isi=1.0)
+
+def isi_sketch(spike_monitor, max_isi=1.0, sketch=None, chunk_size=1_000_000):
+    # The same ISIs as analyze_isi_distribution, streamed into a fixed-size sketch
+    # (a new one, or merged into `sketch`) instead of concatenated.
+    spike_trains = SpikeTrains.from_dict(spike_monitor)
+    sketch = LogHistogram(*ISI_RANGE) if sketch is None else sketch
+    for isis in spike_trains.iter_isis(max_isi=max_isi, chunk_size=chunk_size):
+        sketch.update(isis)
+    return sketch
+
+def rate_sketch(rates, sketch=None):
+    # rates: per-unit firing rates in Hz, or SpikeTrains (using their rates()).
+    if isinstance(rates, SpikeTrains):
+        rates = rates.rates()
+    sketch = LogHistogram(*RATE_RANGE) if sketch is None else sketch
+    return sketch.update(rates)
 
 def bandpass_filter(data, lowcut, highcut, fs, order=5):
-    nyquist = 0.5 * fs
-    low = lowcut / nyquist
-    high = highcut / nyquist
-    b, a = butter(order, [low, high], btype='band')
-    y = filtfilt(b, a, data)
+    from scipy.signal import sosfiltfilt
+    sos = design_band_sos(lowcut, highcut, float(fs), order)
+    y = sosfiltfilt(sos, data)
     return y
 
 def compare_isi_distributions(isis1, isis2): 
+    from scipy.stats import ks_2samp
     if isis1 is None or isis2 is None or len(isis1) == 0 or len(isis2) == 0:
         return None, None
     try:
@@ -62,7 +61,30 @@ def compare_isi_distributions(isis1, isis2):
         logger.error(f"Error during KS test: {e}")
         return None, None
 
+def comparison_summary(sim_spike_trains, sim_isis, real_isis, real_rates, real_mean_rate, real_std_rate,
+                       n_boot=1000, seed=None):
+    # Headline statistics of a simulated run against the recording, as aggregated by
+    # scripts/results.py. sim_isis and real_isis are ISI sketches (isi_sketch), so the
+    # recording's ISIs are never held in memory; intervals are bootstrapped from them.
+    rates = sim_spike_trains.rates()
+    isi = compare_sketches(real_isis, sim_isis, n_boot=n_boot, seed=seed)
+    rate = compare_sketches(rate_sketch(real_rates), rate_sketch(rates), n_boot=0)
+    return {
+        'sim_mean_rate': float(np.mean(rates)),
+        'sim_std_rate': float(np.std(rates)),
+        'sim_cv_isi': sim_isis.cv(),
+        'real_cv_isi': real_isis.cv(),
+        'real_mean_rate': real_mean_rate,
+        'real_std_rate': real_std_rate,
+        **isi,
+        'rate_ks_statistic': rate['ks_statistic'],
+        'rate_wasserstein': rate['wasserstein'],
+    }
+
 def calculate_lfp(state_monitor): 
+    if isinstance(state_monitor, dict):
+        # Population monitor from src.monitors: the mean is already reduced in-run.
+        return state_monitor['monitor'].total[0] / 0.001
     if 'I_syn' not in state_monitor.variables:
         logger.error("StateMonitor must record 'I_syn' to calculate LFP.")
         return None 
@@ -71,8 +93,8 @@ def calculate_lfp(state_monitor):
 
 def compute_coherence(signal1, signal2, fs=1000):
     nperseg = min(1024, len(signal1))
-    f, Cxy = coherence(signal1, signal2, fs=fs, nperseg=nperseg)
-    return f, Cxy
+    f, Cxy = coherence_matrix(np.vstack([signal1, signal2]), fs, nperseg=nperseg, rows=[0], cols=[1])
+    return f, Cxy[0, 0]
 
 def infer_cognitive_state(theta_power, gamma_power, mean_firing_rate):
     if theta_power is None or gamma_power is None:
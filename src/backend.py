@@ -0,0 +1,134 @@
+import gc
+import os
+import time
+import logging
+from brian2 import prefs, set_device, get_device, device
+
+from src.fingerprint import fingerprint
+from src import instrumentation
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('numpy', 'cython', 'cpp_standalone')
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'build_cache')
+
+
+def _process_age():
+    # Seconds since the interpreter was launched, so that startup includes imports.
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = float(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0.0
+
+
+_state = {
+    'backend': 'numpy',
+    'cache_dir': DEFAULT_CACHE_DIR,
+    'process_start': time.perf_counter() - _process_age(),
+    'last_timings': None,
+    'run_counts': {},
+    'run_hooks': [],
+}
+
+
+# Scripts default to the numpy target unless configure_backend() says otherwise.
+prefs.codegen.target = 'numpy'
+
+
+def add_backend_arguments(parser):
+    parser.add_argument('--backend', choices=BACKENDS, default='numpy',
+                        help='Brian2 code generation backend.')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='Directory for compiled model artifacts, reused across runs.')
+    return parser
+
+
+def configure_backend(backend='numpy', cache_dir=None):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}'. Choose one of {', '.join(BACKENDS)}.")
+    cache_dir = os.path.abspath(cache_dir or DEFAULT_CACHE_DIR)
+    _state.update(backend=backend, cache_dir=cache_dir)
+
+    if backend == 'cpp_standalone':
+        # The project directory depends on the model, so the device is set in prepare_run.
+        return
+    if get_device().__class__.__name__ == 'CPPStandaloneDevice':
+        set_device('runtime')
+    prefs.codegen.target = backend
+    if backend == 'cython':
+        # Cython modules are named after a hash of their generated code, so a
+        # persistent directory is enough to skip recompilation on later runs.
+        prefs.codegen.runtime.cython.cache_dir = os.path.join(cache_dir, 'cython')
+    logger.info(f"Using Brian2 '{backend}' backend.")
+
+
+def current_backend():
+    return _state['backend']
+
+
+def prepare_run(name, *model_parts):
+    # Call after start_scope() and before any Brian2 object is created.
+    key = fingerprint(name, *model_parts)
+    if _state['backend'] != 'cpp_standalone':
+        return key
+
+    # Objects from earlier runs in this process shift Brian2's automatic code
+    # object names, so repeated runs of one model get their own directory.
+    # Collecting first makes the set of surviving objects deterministic.
+    gc.collect()
+    run_index = _state['run_counts'].get((name, key), 0)
+    _state['run_counts'][(name, key)] = run_index + 1
+    suffix = f'-{run_index}' if run_index else ''
+    directory = os.path.join(_state['cache_dir'], 'cpp_standalone', f'{name}-{key}{suffix}')
+    if getattr(device, 'has_been_run', False):
+        device.reinit()
+        device.activate()
+    # Brian2 still generates all code on every run, but only rewrites sources
+    # whose content changed, so for an unchanged model in the same directory make
+    # finds the object files up to date and skips the C++ compilation.
+    set_device('cpp_standalone', directory=directory, build_on_run=True)
+    logger.info(f"Using standalone project directory {directory}.")
+    return key
+
+
+def add_run_hook(hook):
+    # hook(net) is called just before each run_network, e.g. to attach extra monitors.
+    _state['run_hooks'].append(hook)
+    return hook
+
+
+def run_network(net, duration, level=0, **kwargs):
+    for hook in _state['run_hooks']:
+        hook(net)
+    if instrumentation.profiling_enabled():
+        kwargs.setdefault('profile', True)
+    call_start = time.perf_counter()
+    # level + 1 makes Brian2 resolve identifiers in the caller's namespace.
+    net.run(duration, level=level + 1, **kwargs)
+    call_end = time.perf_counter()
+
+    # _last_run_time covers only the simulation loop, so what precedes it is
+    # code generation, compilation and initialisation.
+    run_time = getattr(get_device(), '_last_run_time', None) or 0.0
+    first_step = call_end - run_time
+    timings = {
+        'backend': _state['backend'],
+        'startup_to_first_step': first_step - _state['process_start'],
+        'build': first_step - call_start,
+        'run': run_time,
+    }
+    _state['last_timings'] = timings
+    instrumentation.add_span('codegen', timings['build'])
+    instrumentation.add_span('net.run', timings['run'])
+    instrumentation.record_profile(net)
+    logger.info(f"[{timings['backend']}] startup to first timestep {timings['startup_to_first_step']:.2f} s "
+                 f"(build {timings['build']:.2f} s), simulation {timings['run']:.2f} s.")
+    return timings
+
+
+def last_run_timings():
+    return _state['last_timings']
@@ -0,0 +1,142 @@
+import os
+import time
+import pickle
+import logging
+from brian2 import SpikeMonitor, StateMonitor, PopulationRateMonitor, defaultclock, second
+
+from src.backend import current_backend, run_network
+from src.instrumentation import span
+from src.recording import is_recorder
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 1
+# Name of the snapshot inside a checkpoint file; the file is Brian2's store format.
+SNAPSHOT = 'checkpoint'
+META_KEY = 'synmodel_meta'
+
+MONITOR_TYPES = (SpikeMonitor, StateMonitor, PopulationRateMonitor)
+
+
+def _require_runtime():
+    # Standalone builds the whole run into one binary, so it cannot be split into segments.
+    if current_backend() == 'cpp_standalone':
+        raise ValueError("Checkpoints and warm-up branching need a runtime backend (numpy or cython).")
+
+
+def checkpoint_path(checkpoint_dir, name, key):
+    return os.path.join(checkpoint_dir, f'{name}-{key}.pkl')
+
+
+def save_checkpoint(net, path, key=None, **metadata):
+    # Brian2's store covers state variables, synaptic weights and indices, queued
+    # spikes, monitor contents and the device's random number generator.
+    _require_runtime()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    net.store(SNAPSHOT, filename=tmp_path)
+    with open(tmp_path, 'rb') as f:
+        stored = pickle.load(f)
+    stored[META_KEY] = {
+        'version': CHECKPOINT_VERSION,
+        'fingerprint': key,
+        't': float(net.t / second),
+        'created': time.time(),
+        **metadata,
+    }
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(stored, f, protocol=pickle.HIGHEST_PROTOCOL)
+    # Swap the finished file in so a crash mid-write keeps the previous checkpoint.
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_checkpoint_metadata(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f).get(META_KEY, {})
+
+
+def restore_checkpoint(net, path, key=None, restore_random_state=True):
+    _require_runtime()
+    meta = read_checkpoint_metadata(path)
+    if meta.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"{path} has checkpoint version {meta.get('version')}, expected {CHECKPOINT_VERSION}.")
+    if key is not None and meta.get('fingerprint') != key:
+        raise ValueError(f"{path} was written for model {meta.get('fingerprint')}, not {key}.")
+    # Objects must carry the names they had when stored, which build_microcircuit guarantees.
+    net.restore(SNAPSHOT, filename=path, restore_random_state=restore_random_state)
+    logger.info(f"Restored checkpoint {path} at t = {meta['t']:.3f} s.")
+    return meta
+
+
+def run_with_checkpoints(net, duration, path, every, resume=False, key=None, level=0, **kwargs):
+    # Runs until net.t has advanced by `duration`, saving a checkpoint after every
+    # `every` of simulated time. With resume=True an existing checkpoint is picked up
+    # first; the end time is computed before restoring, so it is the same as for
+    # the interrupted run.
+    _require_runtime()
+    t_stop = float(net.t / second) + float(duration / second)
+    if resume and os.path.exists(path):
+        restore_checkpoint(net, path, key)
+    elif resume:
+        logger.info(f"No checkpoint at {path}; starting from the beginning.")
+
+    every = float(every / second)
+    timings = {'backend': current_backend(), 'startup_to_first_step': None, 'build': 0.0, 'run': 0.0}
+    # Half a time step of slack absorbs rounding in the clock's float time.
+    while float(net.t / second) < t_stop - 0.5 * float(defaultclock.dt / second):
+        segment = min(every, t_stop - float(net.t / second))
+        segment_timings = run_network(net, segment * second, level=level + 1, **kwargs)
+        timings['build'] += segment_timings['build']
+        timings['run'] += segment_timings['run']
+        if timings['startup_to_first_step'] is None:
+            timings['startup_to_first_step'] = segment_timings['startup_to_first_step']
+        with span('checkpoint'):
+            save_checkpoint(net, path, key, t_stop=t_stop)
+        logger.info(f"Checkpoint at t = {float(net.t / second):.3f} s of {t_stop:.3f} s written to {path}.")
+    return timings
+
+
+def set_monitors_active(net, active):
+    for obj in net.objects:
+        # Online statistics and ring buffers count as monitors too.
+        if isinstance(obj, MONITOR_TYPES) or is_recorder(obj):
+            obj.active = active
+
+
+def warm_up(net, duration, path=None, key=None, level=0, **kwargs):
+    # Simulates a burn-in with monitors switched off, so branches only record what
+    # follows it. With a path, the burn-in is stored once and later calls (from
+    # other processes too) restore it instead of simulating it again.
+    _require_runtime()
+    if path is not None and os.path.exists(path):
+        meta = restore_checkpoint(net, path, key, restore_random_state=False)
+        if abs(meta.get('warmup', -1.0) - float(duration / second)) > 0.5 * float(defaultclock.dt / second):
+            raise ValueError(f"{path} holds a {meta.get('warmup')} s warm-up, not {float(duration / second)} s.")
+        return None
+    set_monitors_active(net, False)
+    with span('warm_up'):
+        timings = run_network(net, duration, level=level + 1, **kwargs)
+    set_monitors_active(net, True)
+    if path is not None:
+        save_checkpoint(net, path, key, warmup=float(duration / second))
+        logger.info(f"Stored {float(duration / second):.3f} s warm-up in {path}.")
+    else:
+        net.store(SNAPSHOT)
+    return timings
+
+
+def run_branches(net, duration, variants, apply_variant, collect, warmup_path=None, key=None, level=0, **kwargs):
+    # Forks the warmed-up state into each variant in turn: restore, apply the
+    # variant's parameters, run for `duration` and hand the network to collect()
+    # before the next restore overwrites it. Call warm_up() first.
+    for index, variant in enumerate(variants):
+        if warmup_path is None:
+            net.restore(SNAPSHOT)
+        else:
+            restore_checkpoint(net, warmup_path, key, restore_random_state=False)
+        apply_variant(variant)
+        run_network(net, duration, level=level + 1, **kwargs)
+        yield index, variant, collect()
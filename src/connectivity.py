@@ -0,0 +1,150 @@
+import numpy as np
+
+
+def _as_rng(rng):
+    if rng is None:
+        # Draw from the global numpy state so brian2's seed() keeps runs reproducible.
+        return np.random.default_rng(np.random.randint(0, 2**31 - 1))
+    if isinstance(rng, np.random.Generator):
+        return rng
+    return np.random.default_rng(rng)
+
+
+def _sorted_unique(values):
+    values = np.sort(values)
+    if len(values) == 0:
+        return values
+    keep = np.empty(len(values), dtype=bool)
+    keep[0] = True
+    np.not_equal(values[1:], values[:-1], out=keep[1:])
+    return values[keep]
+
+
+def _sample_offsets(counts, sizes, rng):
+    # For every row r pick counts[r] distinct offsets in [0, sizes[r]).
+    # Duplicates are rejected and redrawn, which keeps subsets uniform and
+    # costs O(total synapses) instead of O(rows * sizes).
+    counts = np.minimum(np.asarray(counts, dtype=np.int64), sizes)
+    sizes = np.asarray(sizes, dtype=np.int64)
+    full = counts == sizes
+    rows = np.repeat(np.nonzero(full)[0], sizes[full])
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(sizes[full]) - sizes[full], sizes[full])
+    chosen_rows = [rows]
+    chosen_offsets = [offsets]
+
+    partial = np.nonzero(~full & (counts > 0))[0]
+    missing = counts[partial]
+    keys = np.empty(0, dtype=np.int64)
+    stride = max(1, int(sizes.max())) if len(sizes) else 1
+    while len(partial) > 0:
+        draw_rows = np.repeat(partial, missing)
+        draw_offsets = (rng.random(len(draw_rows)) * sizes[draw_rows]).astype(np.int64)
+        keys = _sorted_unique(np.concatenate([keys, draw_rows * stride + draw_offsets]))
+        have = np.bincount(keys // stride, minlength=len(sizes))
+        missing = counts[partial] - have[partial]
+        keep = missing > 0
+        partial, missing = partial[keep], missing[keep]
+    chosen_rows.append(keys // stride)
+    chosen_offsets.append(keys % stride)
+    return np.concatenate(chosen_rows), np.concatenate(chosen_offsets)
+
+
+def _sorted_pairs(i, j, n_post):
+    keys = np.sort(np.asarray(i, dtype=np.int64) * n_post + j)
+    return (keys // n_post).astype(np.int32), (keys % n_post).astype(np.int32)
+
+
+def ring_local_distant(n, local_radius=10, p_local=0.3, p_distant=0.05, rng=None):
+    rng = _as_rng(rng)
+    src = np.arange(n, dtype=np.int64)
+
+    # Local targets: j in [i - radius, i + radius) without i itself.
+    lo = np.maximum(0, src - local_radius)
+    hi = np.minimum(n, src + local_radius)
+    n_local_candidates = hi - lo - 1
+    n_local = (n_local_candidates * p_local).astype(np.int64)
+    rows, offsets = _sample_offsets(n_local, n_local_candidates, rng)
+    local_j = lo[rows] + offsets
+    local_j += local_j >= rows
+    local_i = rows
+
+    # Distant targets: |i - j| > radius.
+    n_below = np.maximum(0, src - local_radius)
+    n_above = np.maximum(0, n - src - local_radius - 1)
+    n_distant_candidates = n_below + n_above
+    n_distant = (n_distant_candidates * p_distant).astype(np.int64)
+    rows, offsets = _sample_offsets(n_distant, n_distant_candidates, rng)
+    above = offsets >= n_below[rows]
+    distant_j = np.where(above, rows + local_radius + 1 + offsets - n_below[rows], offsets)
+    distant_i = rows
+
+    return _sorted_pairs(np.concatenate([local_i, distant_i]),
+                         np.concatenate([local_j, distant_j]), n)
+
+
+def fixed_probability(n_pre, n_post, p, allow_autapses=True, rng=None):
+    rng = _as_rng(rng)
+    sizes = np.full(n_pre, n_post, dtype=np.int64)
+    exclude_self = not allow_autapses and n_pre == n_post
+    if exclude_self:
+        sizes -= 1
+    counts = rng.binomial(sizes, p)
+    i, j = _sample_offsets(counts, sizes, rng)
+    if exclude_self:
+        j += j >= i
+    return _sorted_pairs(i, j, n_post)
+
+
+def fixed_indegree(n_pre, n_post, k, allow_autapses=True, rng=None):
+    rng = _as_rng(rng)
+    sizes = np.full(n_post, n_pre, dtype=np.int64)
+    exclude_self = not allow_autapses and n_pre == n_post
+    if exclude_self:
+        sizes -= 1
+    counts = np.full(n_post, k, dtype=np.int64)
+    j, i = _sample_offsets(counts, sizes, rng)
+    if exclude_self:
+        i += i >= j
+    return _sorted_pairs(i, j, n_post)
+
+
+def gaussian_kernel(sigma, p_max=1.0):
+    def kernel(distance):
+        return p_max * np.exp(-distance**2 / (2 * sigma**2))
+    return kernel
+
+
+def distance_dependent(pre_positions, post_positions, kernel, ring_length=None,
+                       allow_autapses=True, block_size=1024, rng=None):
+    rng = _as_rng(rng)
+    pre_positions = np.asarray(pre_positions, dtype=float)
+    post_positions = np.asarray(post_positions, dtype=float)
+    if pre_positions.ndim == 1:
+        pre_positions = pre_positions[:, None]
+        post_positions = post_positions[:, None]
+
+    pairs_i, pairs_j = [], []
+    for start in range(0, len(pre_positions), block_size):
+        block = pre_positions[start:start + block_size]
+        delta = np.abs(block[:, None, :] - post_positions[None, :, :])
+        if ring_length is not None:
+            delta = np.minimum(delta, ring_length - delta)
+        distance = np.sqrt(np.sum(delta**2, axis=-1))
+        hits = rng.random(distance.shape) < kernel(distance)
+        if not allow_autapses:
+            rows = np.arange(len(block))
+            cols = start + rows
+            valid = cols < hits.shape[1]
+            hits[rows[valid], cols[valid]] = False
+        i, j = np.nonzero(hits)
+        pairs_i.append(i + start)
+        pairs_j.append(j)
+    if not pairs_i:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    return _sorted_pairs(np.concatenate(pairs_i), np.concatenate(pairs_j), len(post_positions))
+
+
+def connect_pairs(synapses, i, j):
+    if len(i) > 0:
+        synapses.connect(i=np.asarray(i), j=np.asarray(j))
+    return len(i)
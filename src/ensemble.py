@@ -0,0 +1,68 @@
+import numpy as np
+
+from src.spike_trains import SpikeTrains
+
+# K independent replicas of a circuit share one set of Brian2 objects: replica k
+# owns neurons [k * n, (k + 1) * n) of every group and only synapses inside its
+# own block, so per-timestep overhead is paid once for the whole ensemble.
+
+
+def replica_seeds(base_seed, n_replicas):
+    # Independent seeds per replica; without a base seed they are drawn from the
+    # global numpy state, so brian2's seed() keeps ensembles reproducible.
+    if base_seed is None:
+        base_seed = np.random.randint(0, 2**31 - 1)
+    return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(base_seed).spawn(n_replicas)]
+
+
+def replica_rngs(base_seed, n_replicas):
+    return [np.random.default_rng(s) for s in replica_seeds(base_seed, n_replicas)]
+
+
+def replica_index(n_replicas, n_per_replica):
+    return np.repeat(np.arange(n_replicas), n_per_replica)
+
+
+def replica_subsets(n_replicas, n_per_replica):
+    # For population_monitor: one reduction per replica.
+    return {k: np.arange(k * n_per_replica, (k + 1) * n_per_replica) for k in range(n_replicas)}
+
+
+def per_replica(values, n_replicas, n_per_replica):
+    # Expands a scalar or one value per replica to one value per neuron (or synapse).
+    values = np.asarray(values)
+    if values.ndim == 0:
+        values = np.full(n_replicas, values)
+    if len(values) != n_replicas:
+        raise ValueError(f"Expected one value per replica ({n_replicas}), got {len(values)}.")
+    return np.repeat(values, n_per_replica)
+
+
+def block_diagonal(pairs, n_pre, n_post):
+    # pairs: one (i, j) per replica in local indices; returns global indices.
+    offsets = np.arange(len(pairs))
+    i = np.concatenate([np.asarray(i, dtype=np.int64) + k * n_pre for k, (i, _) in zip(offsets, pairs)])
+    j = np.concatenate([np.asarray(j, dtype=np.int64) + k * n_post for k, (_, j) in zip(offsets, pairs)])
+    return i, j
+
+
+def split_spike_trains(trains, n_replicas):
+    # Replica k's units are a contiguous run of the CSR layout, so each replica is
+    # a view with local unit ids 0..n-1.
+    n = trains.n_units // n_replicas
+    replicas = []
+    for k in range(n_replicas):
+        offsets = trains.offsets[k * n:(k + 1) * n + 1]
+        times = trains.times[offsets[0]:offsets[-1]]
+        replicas.append(SpikeTrains(times, offsets - offsets[0], None, trains.t_start, trains.t_stop))
+    return replicas
+
+
+def split_spike_monitor(spike_monitor, n_replicas, t_start=0.0, t_stop=None):
+    return split_spike_trains(SpikeTrains.from_spike_monitor(spike_monitor, t_start, t_stop), n_replicas)
+
+
+def split_replicas(values, n_replicas):
+    # (n_replicas * n, ...) per-neuron array -> (n_replicas, n, ...).
+    values = np.asarray(values)
+    return values.reshape((n_replicas, values.shape[0] // n_replicas) + values.shape[1:])
@@ -0,0 +1,32 @@
+import hashlib
+import json
+import numpy as np
+
+
+def _canonical(obj):
+    if isinstance(obj, dict):
+        return {str(k): _canonical(v) for k, v in sorted(obj.items(), key=lambda item: str(item[0]))}
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        items = sorted(obj, key=repr) if isinstance(obj, (set, frozenset)) else obj
+        return [_canonical(v) for v in items]
+    if isinstance(obj, np.ndarray):
+        # Quantities are ndarrays too; repr keeps their unit, the digest their values.
+        digest = hashlib.sha256(np.ascontiguousarray(obj).tobytes()).hexdigest()
+        if obj.size == 1:
+            return repr(obj)
+        return f"{type(obj).__name__}{obj.shape}:{obj.dtype}:{getattr(obj, 'dim', '')}:{digest}"
+    if isinstance(obj, (np.integer, np.floating, np.bool_)):
+        return obj.item()
+    if isinstance(obj, (str, int, float, bool)) or obj is None:
+        return obj
+    if hasattr(obj, 'values') and hasattr(obj, 'dt') and hasattr(obj, 'name'):
+        # TimedArray
+        return {'timed_array': _canonical(np.asarray(obj.values)), 'dt': obj.dt}
+    if callable(obj):
+        return f"{getattr(obj, '__module__', '')}.{getattr(obj, '__qualname__', repr(obj))}"
+    return repr(obj)
+
+
+def fingerprint(*parts, length=16):
+    payload = json.dumps(_canonical(list(parts)), sort_keys=True, default=repr)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:length]
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import socket
+import logging
+import datetime
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+# Spans and counters go to the active recorder; with none active they cost nothing,
+# so library code can be instrumented unconditionally.
+_active = {'recorder': None}
+
+
+class Recorder:
+    def __init__(self, name, profile=False, **metadata):
+        self.name = name
+        self.profile = profile
+        self.metadata = metadata
+        self.started = time.perf_counter()
+        self.timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+        self.spans = []
+        self.counters = {}
+        self.values = {}
+        self.profiles = []
+        self._stack = []
+
+    @contextmanager
+    def span(self, name):
+        path = '/'.join(self._stack + [name])
+        self._stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            self.add_span(path, time.perf_counter() - start, start)
+
+    def add_span(self, path, duration, start=None):
+        # For phases timed elsewhere, e.g. the build/run split reported by Brian2.
+        if '/' not in path and self._stack:
+            path = '/'.join(self._stack + [path])
+        start = time.perf_counter() - duration if start is None else start
+        self.spans.append({'path': path, 'start': start - self.started, 'duration': duration})
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_value(self, name, value):
+        self.values[name] = value
+
+    def phase_totals(self):
+        totals = {}
+        for span in self.spans:
+            totals[span['path']] = totals.get(span['path'], 0.0) + span['duration']
+        return totals
+
+    def as_record(self):
+        return {
+            'name': self.name,
+            'timestamp': self.timestamp,
+            'host': socket.gethostname(),
+            'total_s': time.perf_counter() - self.started,
+            'metadata': self.metadata,
+            'phases': self.phase_totals(),
+            'spans': sorted(self.spans, key=lambda span: span['start']),
+            'counters': self.counters,
+            'values': self.values,
+            'profile': self.profiles,
+        }
+
+    def write(self, path):
+        # One JSON object per line so successive runs accumulate into a history.
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.as_record(), default=str) + '\n')
+        return path
+
+    def summary(self):
+        lines = [f"{self.name}: {time.perf_counter() - self.started:.2f} s total"]
+        for path, seconds in self.phase_totals().items():
+            lines.append(f"  {'  ' * path.count('/')}{path.rsplit('/', 1)[-1]:<24} {seconds:8.3f} s")
+        return '\n'.join(lines)
+
+
+def start_recording(name, profile=False, **metadata):
+    _active['recorder'] = Recorder(name, profile=profile, **metadata)
+    return _active['recorder']
+
+
+def stop_recording():
+    recorder, _active['recorder'] = _active['recorder'], None
+    return recorder
+
+
+def get_recorder():
+    return _active['recorder']
+
+
+def span(name):
+    recorder = _active['recorder']
+    return recorder.span(name) if recorder is not None else nullcontext()
+
+
+def add_span(path, duration):
+    if _active['recorder'] is not None:
+        _active['recorder'].add_span(path, duration)
+
+
+def count(name, value=1):
+    if _active['recorder'] is not None:
+        _active['recorder'].count(name, value)
+
+
+def set_value(name, value):
+    if _active['recorder'] is not None:
+        _active['recorder'].set_value(name, value)
+
+
+def profiling_enabled():
+    recorder = _active['recorder']
+    return recorder is not None and recorder.profile
+
+
+def _object_kind(obj):
+    from brian2 import NeuronGroup, PoissonGroup, SpikeGeneratorGroup, Synapses
+    if isinstance(obj, (NeuronGroup, PoissonGroup, SpikeGeneratorGroup)):
+        return 'populations'
+    if isinstance(obj, Synapses):
+        return 'projections'
+    if 'monitor' in type(obj).__name__.lower():
+        return 'monitors'
+    return 'other'
+
+
+def rollup_profile(net):
+    # Brian2 reports one time per scheduled object ("excitatory_stateupdater",
+    # "ee_syn_pre", "spike_mon_exc", ...); each is attributed to the network
+    # object whose name it is or starts with, longest name first.
+    owners = sorted(net.objects, key=lambda obj: len(obj.name), reverse=True)
+    rollup = {'populations': {}, 'projections': {}, 'monitors': {}, 'other': {}}
+    code_objects = {}
+    for code_object, elapsed in net.profiling_info:
+        seconds = float(elapsed)
+        code_objects[code_object] = seconds
+        owner = next((obj for obj in owners
+                      if code_object == obj.name or code_object.startswith(obj.name + '_')), None)
+        kind = _object_kind(owner) if owner is not None else 'other'
+        key = owner.name if owner is not None else code_object
+        rollup[kind][key] = rollup[kind].get(key, 0.0) + seconds
+    rollup['code_objects'] = code_objects
+    return rollup
+
+
+def record_profile(net):
+    recorder = _active['recorder']
+    if recorder is None or not recorder.profile:
+        return None
+    try:
+        rollup = rollup_profile(net)
+    except Exception as e:
+        logger.warning(f"Could not read Brian2 profiling info: {e}")
+        return None
+    recorder.profiles.append(rollup)
+    return rollup
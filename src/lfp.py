@@ -0,0 +1,192 @@
+import os
+import logging
+from contextlib import contextmanager
+import numpy as np
+
+from src.results_io import load_results
+
+logger = logging.getLogger(__name__)
+
+# 2**16 samples is ~52 s at 1250 Hz, or 100 MB for all 384 channels in float32.
+DEFAULT_CHUNK_SIZE = 2 ** 16
+
+# An LFP source is a dict holding a (samples x channels) array that supports
+# slicing without loading the rest (np.memmap, h5py.Dataset or an in-memory
+# array), its sample times, the channel ids and their depths along the probe.
+# Sources backed by an open file are only valid inside their `with` block.
+
+
+def _make_source(data, times, fs, channel_ids, depths=None):
+    if depths is None:
+        depths = np.full(len(channel_ids), np.nan)
+    return {
+        'data': data,
+        'times': times,
+        'fs': float(fs),
+        'channel_ids': np.asarray(channel_ids),
+        'depths': np.asarray(depths, dtype=np.float64),
+    }
+
+
+def open_cached_lfp(path):
+    lfp = load_results(path, mmap=True)['lfp']
+    return _make_source(lfp['values'], lfp['times'], lfp['fs'], lfp['channel_ids'], lfp['channel_depths'])
+
+
+def _electrode_table(f, series):
+    # The electrodes region points at rows of the NWB electrodes table.
+    region = series['electrodes']
+    if 'table' in region.attrs:
+        return f[region.attrs['table']]
+    return f['general']['extracellular_ephys']['electrodes']
+
+
+@contextmanager
+def open_nwb_lfp(nwb_path, probe_id=None):
+    import h5py
+    with h5py.File(nwb_path, 'r') as f:
+        acquisition = f['acquisition']
+        if probe_id is None:
+            names = [name for name in acquisition if name.startswith('probe_') and name.endswith('_lfp')]
+            if len(names) != 1:
+                raise ValueError(f"{nwb_path} holds {len(names)} probe LFP series; pass probe_id.")
+            probe_id = names[0][len('probe_'):-len('_lfp')]
+        series = acquisition[f'probe_{probe_id}_lfp'][f'probe_{probe_id}_lfp_data']
+        times = series['timestamps']
+        fs = 1.0 / (times[1] - times[0]) if len(times) > 1 else 1250.0
+        depths = None
+        if 'electrodes' in series:
+            # Row indices into the electrodes table, mapped to that table's channel ids.
+            rows = np.asarray(series['electrodes'][()], dtype=np.int64)
+            table = _electrode_table(f, series)
+            channel_ids = np.asarray(table['id'][()])[rows]
+            if 'probe_vertical_position' in table:
+                depths = np.asarray(table['probe_vertical_position'][()], dtype=np.float64)[rows]
+        else:
+            channel_ids = np.arange(series['data'].shape[1])
+        yield _make_source(series['data'], times, fs, channel_ids, depths)
+
+
+def _session_lfp_path(session, probe_id):
+    # AllenSDK sessions keep a loader of each probe's LFP NWB file.
+    paths = getattr(getattr(session, 'api', None), 'probe_lfp_paths', None) or {}
+    path = paths.get(probe_id)
+    return path() if callable(path) else path
+
+
+@contextmanager
+def lfp_from_session(session, probe_id):
+    # Streams from the probe's NWB file when the session exposes it; otherwise
+    # falls back to session.get_lfp, which loads the whole probe.
+    path = _session_lfp_path(session, probe_id)
+    if path is not None:
+        with open_nwb_lfp(path, probe_id) as source:
+            channels = getattr(session, 'channels', None)
+            if channels is not None and 'probe_vertical_position' in channels and np.all(np.isnan(source['depths'])):
+                source['depths'] = channels['probe_vertical_position'].reindex(source['channel_ids']).to_numpy(dtype=np.float64)
+            yield source
+        return
+    logger.warning(f"No LFP file for probe {probe_id}; loading it whole through session.get_lfp.")
+    lfp = session.get_lfp(probe_id)
+    times = np.asarray(lfp['time'].values)
+    fs = 1.0 / (times[1] - times[0]) if len(times) > 1 else 1250.0
+    channel_ids = np.asarray(lfp['channel'].values)
+    depths = None
+    channels = getattr(session, 'channels', None)
+    if channels is not None and 'probe_vertical_position' in channels:
+        depths = channels['probe_vertical_position'].reindex(channel_ids).to_numpy(dtype=np.float64)
+    yield _make_source(lfp.values, times, fs, channel_ids, depths)
+
+
+@contextmanager
+def open_lfp(source, probe_id=None):
+    # source: an LFP source dict, a cache directory, an LFP NWB file, or a
+    # {'session', 'probe_id'} reference to a session's probe.
+    if isinstance(source, dict) and 'session' in source:
+        with lfp_from_session(source['session'], source['probe_id']) as opened:
+            yield opened
+    elif isinstance(source, dict):
+        yield source
+    elif os.path.isdir(source):
+        yield open_cached_lfp(source)
+    else:
+        with open_nwb_lfp(source, probe_id) as opened:
+            yield opened
+
+
+def select_lfp_channels(source, channels=None, depth_range=None):
+    # channels are column indices into the source, kept in the given order;
+    # depth_range is (low, high) in microns.
+    n_channels = len(source['channel_ids'])
+    index = np.arange(n_channels)
+    if channels is not None:
+        index = np.atleast_1d(np.asarray(channels, dtype=np.int64))
+        if np.any((index < 0) | (index >= n_channels)):
+            raise ValueError(f"LFP channel indices must be in [0, {n_channels}) (got {index.tolist()}).")
+        if len(np.unique(index)) != len(index):
+            raise ValueError(f"LFP channel indices are repeated (got {index.tolist()}).")
+    if depth_range is not None:
+        depths = source['depths'][index]
+        index = index[(depths >= depth_range[0]) & (depths <= depth_range[1])]
+    if len(index) == 0:
+        raise ValueError("No LFP channels match the requested selection.")
+    return index
+
+
+def _time_to_sample(source, t):
+    # Binary search element by element so h5py timestamps are never read in full.
+    times = source['times']
+    low, high = 0, source['data'].shape[0]
+    while low < high:
+        mid = (low + high) // 2
+        if times[mid] < t:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+
+def iter_lfp_chunks(source, channels=None, depth_range=None, window=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                    dtype=np.float32, probe_id=None):
+    # Files opened here are closed once the iteration finishes or is abandoned.
+    with open_lfp(source, probe_id) as source:
+        yield from _iter_chunks(source, channels, depth_range, window, chunk_size, dtype)
+
+
+def _iter_chunks(source, channels, depth_range, window, chunk_size, dtype):
+    index = select_lfp_channels(source, channels, depth_range)
+    t_start, t_stop = window if window is not None else (None, None)
+    start = 0 if t_start is None else _time_to_sample(source, t_start)
+    stop = source['data'].shape[0] if t_stop is None else _time_to_sample(source, t_stop)
+    logger.debug(f"Streaming LFP samples {start}:{stop} of {len(index)} channels in chunks of {chunk_size}.")
+
+    # Columns are read in increasing order (h5py requires it) and put back in the
+    # requested order; a contiguous range is a plain slice, read without a gather.
+    order = np.argsort(index, kind='stable')
+    ordered = index[order]
+    restore = None if np.all(order == np.arange(len(order))) else np.argsort(order)
+    if len(ordered) > 1 and np.all(np.diff(ordered) == 1):
+        columns = slice(int(ordered[0]), int(ordered[-1]) + 1)
+    else:
+        columns = ordered
+    data, times = source['data'], source['times']
+    for chunk_start in range(start, stop, chunk_size):
+        chunk_stop = min(chunk_start + chunk_size, stop)
+        block = np.asarray(data[chunk_start:chunk_stop, columns], dtype=dtype)
+        if restore is not None:
+            block = block[:, restore]
+        yield np.asarray(times[chunk_start:chunk_stop]), np.ascontiguousarray(block.T)
+
+
+def read_lfp(source, channels=None, depth_range=None, window=None, chunk_size=DEFAULT_CHUNK_SIZE, probe_id=None):
+    chunks = list(iter_lfp_chunks(source, channels, depth_range, window, chunk_size, probe_id=probe_id))
+    if not chunks:
+        return np.zeros(0), np.zeros((0, 0), dtype=np.float32)
+    return (np.concatenate([times for times, _ in chunks]),
+            np.concatenate([block for _, block in chunks], axis=1))
+
+
+def default_lfp_channel(source):
+    # Middle of the probe rather than a tip or surface channel.
+    return len(source['channel_ids']) // 2
+
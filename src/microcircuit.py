@@ -0,0 +1,301 @@
+import copy
+import logging
+import numpy as np
+from brian2 import NeuronGroup, Synapses, PoissonGroup, SpikeMonitor, Network, seed, mV, ms, Hz, second
+
+from src.neuron_models import EXC_EQS, INH_EQS, NETWORK_PARAMS
+from src.connectivity import ring_local_distant, fixed_probability, fixed_indegree
+from src.monitors import population_monitor, rate_monitor, monitor_objects, clock_kwargs, expect_input_clock
+from src.recording import record_state
+from src.topology import (topology_key, get_topology, load_or_create_topology, node_population, edge_population, set_node_params,
+                          check_population, uniform_delay, connect_from_edges)
+
+MICROCIRCUIT_CONFIG = {
+    'n_exc': 120,
+    'n_inh': 30,
+    'seed': None,
+    'input_rate': 5 * Hz,
+    # Update period of the Poisson drive; None updates it every simulation step.
+    'input_dt': None,
+    'input_fraction': 0.8,
+    'input_gain': 1.2,
+    'synaptic_weight': NETWORK_PARAMS['synaptic_weight'],
+    'exc_v_std': 8 * mV,
+    'inh_v_std': 6 * mV,
+    'exc_sigma': 4.5 * mV,
+    'inh_sigma': 3.0 * mV,
+    'adaptation_increment': 3 * mV,
+    'tau_w_mean': 80 * ms,
+    'tau_w_std': 40 * ms,
+    'tau_w_range': (20 * ms, 200 * ms),
+    # Weights are synaptic_weight * gain * (low + span * U(0, 1)).
+    'projections': {
+        'ee': {'pre': 'exc', 'post': 'exc', 'rule': 'ring', 'local_radius': 10,
+               'p_local': 0.3, 'p_distant': 0.05, 'gain': 1.0, 'jitter': (0.5, 0.5), 'sign': 1},
+        'ei': {'pre': 'exc', 'post': 'inh', 'rule': 'probability', 'p': 0.4,
+               'gain': 1.5, 'jitter': (0.8, 0.4), 'sign': 1},
+        'ie': {'pre': 'inh', 'post': 'exc', 'rule': 'probability', 'p': 0.6,
+               'gain': 3.0, 'jitter': (0.7, 0.6), 'sign': -1, 'delay': 1 * ms},
+        'ii': {'pre': 'inh', 'post': 'inh', 'rule': 'probability', 'p': 0.2,
+               'gain': 2.0, 'jitter': (1.0, 0.0), 'sign': -1},
+    },
+    # None keeps the weights as given; 'sqrt_k' multiplies each projection by
+    # sqrt(K_ref / K) so that input fluctuations stay comparable as N grows.
+    'weight_scaling': None,
+    'reference_sizes': {'n_exc': 120, 'n_inh': 30},
+    # With a seed, the generated wiring is stored here by fingerprint and reused.
+    'topology_dir': None,
+    # Wire from this topology (written there first if missing), whatever the seed.
+    'topology_path': None,
+    'record': {
+        'spikes': True,
+        'rates': True,
+        # Per-neuron traces are only kept for a few example neurons (any policy from
+        # src/recording.py); the LFP proxy is the mean I_syn over the whole
+        # excitatory population, reduced in-run.
+        'state_variables': ['v'],
+        'state': {'policy': 'subset', 'n': 4, 'select': 'first'},
+        'lfp': True,
+        # Sampling period of the state, rate and LFP traces; None records every step.
+        'dt': None,
+    },
+}
+
+
+def _population_sizes(config):
+    return {'exc': config['n_exc'], 'inh': config['n_inh']}
+
+
+def expected_indegree(projection, n_pre):
+    rule = projection['rule']
+    if rule == 'ring':
+        radius = projection['local_radius']
+        n_local = min(2 * radius - 1, n_pre - 1)
+        n_distant = max(0, n_pre - 2 * radius - 1)
+        return int(n_local * projection['p_local']) + int(n_distant * projection['p_distant'])
+    if rule == 'probability':
+        return projection['p'] * n_pre
+    if rule == 'indegree':
+        return projection['k']
+    raise ValueError(f"Unknown connectivity rule '{rule}'.")
+
+
+def scale_microcircuit_config(config, factor, keep_indegree=False):
+    scaled = copy.deepcopy(config)
+    scaled['n_exc'] = max(1, int(round(config['n_exc'] * factor)))
+    scaled['n_inh'] = max(1, int(round(config['n_inh'] * factor)))
+    if keep_indegree:
+        # Shrink connection densities so every neuron keeps the same number of inputs.
+        for projection in scaled['projections'].values():
+            if projection['rule'] == 'ring':
+                projection['p_distant'] = projection['p_distant'] / factor
+            elif projection['rule'] == 'probability':
+                projection['p'] = min(1.0, projection['p'] / factor)
+    return scaled
+
+
+def _connect(projection, n_pre, n_post):
+    rule = projection['rule']
+    if rule == 'ring':
+        return ring_local_distant(n_pre, local_radius=projection['local_radius'],
+                                  p_local=projection['p_local'], p_distant=projection['p_distant'])
+    if rule == 'probability':
+        return fixed_probability(n_pre, n_post, projection['p'])
+    if rule == 'indegree':
+        return fixed_indegree(n_pre, n_post, projection['k'])
+    raise ValueError(f"Unknown connectivity rule '{rule}'.")
+
+
+def _weight_scale(config, projection):
+    if config['weight_scaling'] is None:
+        return 1.0
+    if config['weight_scaling'] != 'sqrt_k':
+        raise ValueError(f"Unknown weight scaling '{config['weight_scaling']}'.")
+    sizes = _population_sizes(config)
+    reference_sizes = {'exc': config['reference_sizes']['n_exc'], 'inh': config['reference_sizes']['n_inh']}
+    k = expected_indegree(projection, sizes[projection['pre']])
+    k_ref = expected_indegree(projection, reference_sizes[projection['pre']])
+    if k <= 0 or k_ref <= 0:
+        return 1.0
+    return np.sqrt(k_ref / k)
+
+
+# Config entries that determine the wiring and initial node values.
+TOPOLOGY_KEYS = ('n_exc', 'n_inh', 'seed', 'input_fraction', 'synaptic_weight', 'exc_v_std', 'inh_v_std',
+                 'tau_w_mean', 'tau_w_std', 'tau_w_range', 'projections', 'weight_scaling', 'reference_sizes')
+
+
+def microcircuit_topology_key(config):
+    return topology_key('microcircuit', EXC_EQS, INH_EQS, NETWORK_PARAMS['v_rest'],
+                        {key: config[key] for key in TOPOLOGY_KEYS})
+
+
+def generate_microcircuit_topology(config):
+    # Draws from the global numpy state in the order the circuit has always been built.
+    n_exc = config['n_exc']
+    n_inh = config['n_inh']
+    v_exc = NETWORK_PARAMS['v_rest'] + np.random.randn(n_exc) * config['exc_v_std']
+    v_inh = NETWORK_PARAMS['v_rest'] + np.random.randn(n_inh) * config['inh_v_std']
+    tau_w_values = config['tau_w_mean'] + np.random.randn(n_exc) * config['tau_w_std']
+    nodes = {
+        'exc': node_population(n_exc, EXC_EQS, v=v_exc, tau_w=np.clip(tau_w_values, *config['tau_w_range'])),
+        'inh': node_population(n_inh, INH_EQS, v=v_inh),
+        'input': node_population(n_exc, 'poisson'),
+    }
+
+    sizes = _population_sizes(config)
+    edges = {}
+    for name, projection in config['projections'].items():
+        i, j = _connect(projection, sizes[projection['pre']], sizes[projection['post']])
+        low, span = projection['jitter']
+        scale = projection['gain'] * _weight_scale(config, projection)
+        weight = config['synaptic_weight'] * scale * (low + span * np.random.rand(len(i)))
+        edges[name] = edge_population(projection['pre'], projection['post'], i, j, weight=weight,
+                                      delay=projection.get('delay'), weight_unit='volt')
+
+    n_connections = int(config['input_fraction'] * n_exc)
+    connect_indices = np.random.choice(n_exc, n_connections, replace=False)
+    edges['input'] = edge_population('input', 'exc', connect_indices, connect_indices)
+    return nodes, edges
+
+
+def microcircuit_topology(config):
+    if config.get('topology_path') is not None:
+        return load_or_create_topology(config['topology_path'], lambda: generate_microcircuit_topology(config),
+                                       name='microcircuit')
+    if config.get('topology_dir') is None or config['seed'] is None:
+        nodes, edges = generate_microcircuit_topology(config)
+        return {'nodes': nodes, 'edges': edges}
+    return get_topology(config['topology_dir'], 'microcircuit', microcircuit_topology_key(config),
+                        lambda: generate_microcircuit_topology(config))
+
+
+def build_microcircuit(config=None, topology=None):
+    # topology: a loaded topology (see src/topology.py) to wire the circuit from;
+    # by default it is generated from the config, or reused from topology_dir.
+    config = copy.deepcopy(MICROCIRCUIT_CONFIG if config is None else config)
+    if config['seed'] is not None:
+        seed(config['seed'])
+    n_exc = config['n_exc']
+    n_inh = config['n_inh']
+
+    if topology is None:
+        topology = microcircuit_topology(config)
+    for population, n in (('exc', n_exc), ('inh', n_inh), ('input', n_exc)):
+        check_population(topology, population, n)
+    if config['seed'] is not None:
+        # The run's random stream must not depend on whether the wiring was drawn or loaded.
+        seed(int(np.random.SeedSequence([config['seed'], 1]).generate_state(1)[0]))
+    nodes, edges = topology['nodes'], topology['edges']
+
+    model_ns = {
+        'v_rest': NETWORK_PARAMS['v_rest'],
+        'v_reset': NETWORK_PARAMS['v_reset'],
+        'v_thresh': NETWORK_PARAMS['v_thresh'],
+        'tau_m_exc': NETWORK_PARAMS['tau_m_exc'],
+        'tau_m_inh': NETWORK_PARAMS['tau_m_inh'],
+        'synaptic_weight': config['synaptic_weight'],
+        'refractory_period': NETWORK_PARAMS['refractory_period'],
+        'adaptation_increment': config['adaptation_increment'],
+    }
+
+    excitatory = NeuronGroup(n_exc, EXC_EQS,
+                             threshold='v > v_thresh',
+                             reset='v = v_reset; w += adaptation_increment',
+                             refractory='refractory_period',
+                             method='euler',
+                             namespace=model_ns,
+                             name='excitatory')
+
+    inhibitory = NeuronGroup(n_inh, INH_EQS,
+                             threshold='v > v_thresh',
+                             reset='v = v_reset',
+                             refractory='refractory_period',
+                             method='euler',
+                             namespace=model_ns,
+                             name='inhibitory')
+
+    set_node_params(excitatory, nodes['exc'])
+    set_node_params(inhibitory, nodes['inh'])
+    excitatory.sigma = config['exc_sigma']
+    inhibitory.sigma = config['inh_sigma']
+    excitatory.w = 0 * mV
+
+    groups = {'exc': excitatory, 'inh': inhibitory}
+    synapses = {}
+    for name, projection in config['projections'].items():
+        pre, post = groups[projection['pre']], groups[projection['post']]
+        op = '+=' if projection['sign'] > 0 else '-='
+        delay = uniform_delay(edges[name])
+        syn = Synapses(pre, post, 'w_syn : volt', on_pre=f'I_syn_post {op} w_syn',
+                       delay=None if delay is None else delay * second, namespace=model_ns, name=f'{name}_syn')
+        connect_from_edges(syn, edges[name], weight='w_syn')
+        synapses[name] = syn
+
+    input_clock = clock_kwargs(config['input_dt'])
+    input_neurons = PoissonGroup(n_exc, rates=config['input_rate'], name='input', **input_clock)
+    input_syn = Synapses(input_neurons, excitatory, on_pre='I_syn_post += synaptic_weight * input_gain',
+                         namespace={**model_ns, 'input_gain': config['input_gain']}, name='input_syn', **input_clock)
+    expect_input_clock(input_syn)
+    connect_from_edges(input_syn, edges['input'])
+    synapses['input'] = input_syn
+
+    record = config['record']
+    record_dt = record.get('dt')
+    monitors = {}
+    if record['spikes']:
+        monitors['spike_exc'] = SpikeMonitor(excitatory, name='spike_mon_exc')
+        monitors['spike_inh'] = SpikeMonitor(inhibitory, name='spike_mon_inh')
+    if record['state_variables']:
+        monitors['state_exc'] = record_state(excitatory, record['state_variables'], record['state'],
+                                             dt=record_dt, name='state_mon_exc')
+    if record['rates']:
+        monitors['rate_exc'] = rate_monitor(excitatory, dt=record_dt, name='rate_mon_exc')
+        monitors['rate_inh'] = rate_monitor(inhibitory, dt=record_dt, name='rate_mon_inh')
+    if record.get('lfp'):
+        monitors['lfp_exc'] = population_monitor(excitatory, 'I_syn', reduce='mean', dt=record_dt, name='lfp_exc')
+    monitor_list = [obj for monitor in monitors.values() for obj in monitor_objects(monitor)]
+
+    network = Network(excitatory, inhibitory, input_neurons, *synapses.values(), *monitor_list)
+    logging.info(f"Built microcircuit with {n_exc + n_inh} neurons and "
+                 f"{sum(len(s) for s in synapses.values())} synapses.")
+
+    return {
+        'network': network,
+        'excitatory': excitatory,
+        'inhibitory': inhibitory,
+        'input': input_neurons,
+        'synapses': synapses,
+        'monitors': monitors,
+        'config': config,
+    }
+
+
+# Parameters that can change on an already built (e.g. warmed-up) circuit; the
+# rest of the config determines its structure and needs a fresh build.
+BRANCHABLE_PARAMETERS = ('input_rate', 'synaptic_weight', 'exc_sigma', 'inh_sigma', 'adaptation_increment')
+
+
+def apply_microcircuit_variant(circuit, variant):
+    # Values are absolute and applied against the state as built or restored, so
+    # calling this after each restore of the same snapshot does not compound.
+    unknown = set(variant) - set(BRANCHABLE_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Cannot change {', '.join(sorted(unknown))} on a built circuit; "
+                         f"branchable parameters are {', '.join(BRANCHABLE_PARAMETERS)}.")
+    excitatory, inhibitory = circuit['excitatory'], circuit['inhibitory']
+    if 'input_rate' in variant:
+        circuit['input'].rates = variant['input_rate']
+    if 'synaptic_weight' in variant:
+        factor = float(variant['synaptic_weight'] / circuit['config']['synaptic_weight'])
+        for name, syn in circuit['synapses'].items():
+            if name != 'input':
+                syn.w_syn = syn.w_syn[:] * factor
+        for group in (excitatory, inhibitory, *circuit['synapses'].values()):
+            group.namespace['synaptic_weight'] = variant['synaptic_weight']
+    if 'exc_sigma' in variant:
+        excitatory.sigma = variant['exc_sigma']
+    if 'inh_sigma' in variant:
+        inhibitory.sigma = variant['inh_sigma']
+    if 'adaptation_increment' in variant:
+        excitatory.namespace['adaptation_increment'] = variant['adaptation_increment']
@@ -0,0 +1,217 @@
+import logging
+import weakref
+import numpy as np
+from brian2 import NeuronGroup, Synapses, StateMonitor, PopulationRateMonitor, ms, second
+from brian2.units.fundamentalunits import get_unit, DIMENSIONLESS
+
+logger = logging.getLogger(__name__)
+
+# Scripts record at 1 ms unless told otherwise: ten times fewer samples than the
+# 0.1 ms simulation step, and still well above the gamma band.
+DEFAULT_RECORD_DT = 1 * ms
+
+
+def _unit_string(group, variable):
+    dim = group.variables[variable].dim
+    return '1' if dim is DIMENSIONLESS else repr(get_unit(dim))
+
+
+def _subset_weights(n, subsets, reduce):
+    # Returns names and a list of (indices, weights) per subset.
+    if subsets is None:
+        subsets = {'all': np.arange(n)}
+    names, members = [], []
+    for subset_name, subset in subsets.items():
+        subset = np.asarray(subset)
+        if subset.dtype.kind == 'f' and len(subset) == n:
+            # A weight per neuron; zero-weight neurons are left out.
+            indices = np.flatnonzero(subset)
+            weights = subset[indices].astype(np.float64)
+        else:
+            indices = subset.astype(np.int64)
+            weights = np.ones(len(indices))
+        if reduce == 'mean':
+            weights = weights / weights.sum()
+        elif reduce != 'sum':
+            raise ValueError(f"Unknown reduction '{reduce}'.")
+        names.append(str(subset_name))
+        members.append((indices, weights))
+    return names, members
+
+
+def population_monitor(group, variable, subsets=None, reduce='mean', variance=False, dt=None, name=None):
+    # Reduces `variable` across `group` inside the simulation and records only
+    # one value per subset per tick. Works on every backend, including standalone:
+    # the reduction is a (summed) synaptic variable onto a tiny reducer group.
+    name = name or f'{group.name}_{variable}_{reduce}'
+    names, members = _subset_weights(len(group), subsets, reduce)
+    unit = _unit_string(group, variable)
+
+    reducer_eqs = f'total : {unit}'
+    synapse_eqs = f'''w_reduce : 1
+                      total_post = w_reduce * {variable}_pre : {unit} (summed)'''
+    if variance:
+        # E[x^2] - E[x]^2 needs weights that sum to one, i.e. reduce='mean'.
+        if reduce != 'mean':
+            raise ValueError("variance=True requires reduce='mean'.")
+        reducer_eqs += f'\ntotal_sq : {unit}**2'
+        synapse_eqs += f'\ntotal_sq_post = w_reduce * {variable}_pre**2 : {unit}**2 (summed)'
+
+    clock = clock_kwargs(dt)
+    reducer = NeuronGroup(len(names), reducer_eqs, name=f'{name}_reducer', **clock)
+    synapses = Synapses(group, reducer, synapse_eqs, name=f'{name}_syn', **clock)
+    sources = np.concatenate([indices for indices, _ in members])
+    targets = np.concatenate([np.full(len(indices), k) for k, (indices, _) in enumerate(members)])
+    synapses.connect(i=sources, j=targets)
+    synapses.w_reduce = np.concatenate([weights for _, weights in members])
+
+    recorded = ['total', 'total_sq'] if variance else ['total']
+    # Recorded at the end of the step, after the summed variable has been updated.
+    monitor = StateMonitor(reducer, recorded, record=True, when='end', name=f'{name}_mon', **clock)
+    logger.debug(f"Population monitor {name}: {len(names)} subset(s) over {len(sources)} neurons.")
+    return {
+        'name': name,
+        'variable': variable,
+        'reduce': reduce,
+        'variance': variance,
+        'subsets': names,
+        'objects': [reducer, synapses, monitor],
+        'monitor': monitor,
+    }
+
+
+def reduced_trace(reduction, subset=None):
+    # Returns (t, value) or (t, value, variance) as plain arrays in base SI units;
+    # value has one row per subset unless a single subset is requested.
+    monitor = reduction['monitor']
+    values = np.asarray(monitor.total_)
+    row = slice(None) if subset is None else reduction['subsets'].index(subset)
+    output = [np.asarray(monitor.t_), values[row]]
+    if reduction['variance']:
+        output.append(np.asarray(monitor.total_sq_)[row] - values[row] ** 2)
+    if subset is None and len(reduction['subsets']) == 1:
+        output = [output[0]] + [array[0] for array in output[1:]]
+    return tuple(output)
+
+
+def clock_kwargs(dt):
+    # Also used for an input group and its synapses on a coarser clock than their
+    # target; pass those synapses to expect_input_clock.
+    return {} if dt is None else {'dt': dt}
+
+
+# Synapses whose pathway runs on a coarser input clock on purpose.
+_coarse_input_synapses = weakref.WeakSet()
+
+
+class _CoarseInputFilter(logging.Filter):
+    # Drops Brian2's dt-mismatch note for those synapses only; any other pathway
+    # with mismatched clocks still reports it.
+    def filter(self, record):
+        if not record.name.endswith('synapses_dt_mismatch'):
+            return True
+        message = record.getMessage()
+        return not any(f"Synapses object '{synapses.name}'" in message for synapses in _coarse_input_synapses)
+
+
+_coarse_input_filter = _CoarseInputFilter()
+
+
+def expect_input_clock(synapses):
+    # Brian2 runs the pathway on the input's clock, which is what we want here.
+    _coarse_input_synapses.add(synapses)
+    for handler in logging.getLogger('brian2').handlers:
+        if _coarse_input_filter not in handler.filters:
+            handler.addFilter(_coarse_input_filter)
+    return synapses
+
+
+def sampling_rate(monitor):
+    # Samples per second of a StateMonitor or PopulationRateMonitor, or of a
+    # population_monitor / rate_monitor reduction.
+    if isinstance(monitor, dict):
+        monitor = monitor['monitor']
+    return 1.0 / float(monitor.clock.dt / second)
+
+
+def rate_monitor(group, dt=None, name=None):
+    # Population rate of `group`. Without dt this is Brian2's PopulationRateMonitor,
+    # which stores one value per simulation step; with dt, spikes are counted into
+    # a one-neuron reducer that is sampled and cleared every dt.
+    name = name or f'{group.name}_rate'
+    if dt is None:
+        return PopulationRateMonitor(group, name=name)
+    counter = NeuronGroup(1, 'count : 1', name=f'{name}_counter')
+    synapses = Synapses(group, counter, on_pre='count_post += 1', name=f'{name}_syn')
+    synapses.connect(i=np.arange(len(group)), j=0)
+    # At the start of each tick, the count holds the spikes of the preceding dt.
+    monitor = StateMonitor(counter, 'count', record=0, dt=dt, when='start', order=0, name=f'{name}_mon')
+    counter.run_regularly('count = 0', dt=dt, when='start', order=1, name=f'{name}_reset')
+    return {
+        'name': name,
+        'n': len(group),
+        'objects': [counter, synapses, monitor],
+        'monitor': monitor,
+    }
+
+
+def monitor_objects(monitor):
+    return monitor['objects'] if isinstance(monitor, dict) else [monitor]
+
+
+def _gaussian_smooth(values, width, dt):
+    # Same window as PopulationRateMonitor.smooth_rate(window='gaussian'), applied
+    # by FFT so the cost does not grow with the window length.
+    from scipy.signal import fftconvolve
+    width_dt = int(np.round(2 * width / dt))
+    window = np.exp(-np.arange(-width_dt, width_dt + 1) ** 2 / (2 * (width / dt) ** 2))
+    return fftconvolve(values, window / window.sum(), mode='same')
+
+
+def decimate(t, values, factor):
+    # Averages consecutive groups of `factor` samples (the last group may be shorter).
+    starts = np.arange(0, len(values), max(1, int(factor)))
+    if len(starts) == 0:
+        return t, values
+    sizes = np.diff(np.append(starts, len(values)))
+    return np.asarray(t)[starts], np.add.reduceat(values, starts) / sizes
+
+
+def rate_trace(monitor, width=None, bin_size=None):
+    # Returns (t, rate) in seconds and Hz; t is the start of each bin. bin_size
+    # averages the rate into coarser bins first, and width then smooths it with a
+    # Gaussian, so a smoothed trace costs O(duration / bin_size) whatever the dt.
+    if not isinstance(monitor, dict):
+        dt = float(monitor.clock.dt / second)
+        t, rate = np.asarray(monitor.t_), np.asarray(monitor.rate_)
+    else:
+        state = monitor['monitor']
+        dt = float(state.clock.dt / second)
+        # Sample k covers [t_k - dt, t_k), so the first one (at t = 0) is empty and the
+        # last bin is still in the counter.
+        t = np.asarray(state.t_)
+        counts = np.append(np.asarray(state.count[0])[1:], state.source.count[0]) if len(t) else np.zeros(0)
+        rate = counts / (monitor['n'] * dt)
+    if bin_size is not None and float(bin_size / second) > dt:
+        factor = int(round(float(bin_size / second) / dt))
+        t, rate = decimate(t, rate, factor)
+        dt *= factor
+    if width is not None and len(rate):
+        rate = _gaussian_smooth(rate, float(width / second), dt)
+    return t, rate
+
+
+def add_clock_arguments(parser, record_dt=DEFAULT_RECORD_DT, inputs=True):
+    default = None if record_dt is None else float(record_dt / ms)
+    parser.add_argument('--record-dt', type=float, default=default,
+                        help='Sampling period of recorded traces in ms (0 records every simulation step).')
+    if inputs:
+        parser.add_argument('--input-dt', type=float, default=None,
+                            help='Update period of the Poisson input drive in ms (default: every simulation step).')
+
+
+def clock_periods(args):
+    return {
+        'record_dt': args.record_dt * ms if args.record_dt else None,
+        'input_dt': args.input_dt * ms if getattr(args, 'input_dt', None) else None,
+    }
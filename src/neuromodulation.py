@@ -1,15 +1,70 @@
-from brian2 import mV
-
-def apply_dopamine_effect(synapse, dopamine_level, base_A_pre, base_A_post):
-    if 'A_pre' not in synapse.namespace or 'A_post' not in synapse.namespace:
-        raise ValueError("Synapse namespace must contain 'A_pre' and 'A_post' to apply dopamine effect.")
-        
-    synapse.namespace['A_pre'] = base_A_pre * (1 + dopamine_level)
-    synapse.namespace['A_post'] = base_A_post * (1 + dopamine_level)
-    print(f"Dopamine at level {dopamine_level}: A_pre={synapse.namespace['A_pre']}, A_post={synapse.namespace['A_post']}")
-
-def apply_acetylcholine_effect(neuron_group, acetylcholine_level, base_v_rest):
-    if 'v_rest' not in neuron_group.namespace:
-        raise ValueError("Neuron group namespace must contain 'v_rest' to apply acetylcholine effect.")
-        
-    neuron_group.namespace['v_rest'] = base_v_rest + acetylcholine_level * 5 * mV
+import numpy as np
+from brian2 import NeuronGroup, Synapses, SpikeGeneratorGroup, TimedArray, mV, ms
+
+MODULATORS = ('dopamine', 'acetylcholine')
+
+# Acetylcholine shifts the resting potential by this much per unit level, and
+# dopamine scales both STDP trace increments by (1 + level); see
+# NEUROMODULATED_LIF_EQS and DOPAMINE_STDP_PARAMS.
+ACH_V_REST_SHIFT = 5 * mV
+DOPAMINE_DECAY = 200 * ms
+
+
+def modulator_variables(names=MODULATORS):
+    # Equation lines declaring modulator levels in a group that reads them. Set them
+    # directly for fixed per-neuron levels, or fill them from a modulator group.
+    return ''.join(f'\n{name} : 1' for name in names)
+
+
+def modulator_group(levels, decay=None, name='modulators'):
+    # A single-neuron group holding the global level of each modulator.
+    # levels: {modulator: number or TimedArray schedule}. Numbers become a `<m>_tonic`
+    # variable that can be changed between runs. decay: {modulator: tau} adds a
+    # phasic part that reward events increment and that relaxes back with tau.
+    decay = decay or {}
+    eqs, update, namespace = [], [], {}
+    for modulator, level in levels.items():
+        eqs.append(f'{modulator} : 1')
+        if isinstance(level, TimedArray):
+            namespace[f'{modulator}_schedule'] = level
+            tonic = f'{modulator}_schedule(t)'
+        else:
+            eqs.append(f'{modulator}_tonic : 1')
+            tonic = f'{modulator}_tonic'
+        if modulator in decay:
+            eqs.append(f'd{modulator}_phasic/dt = -{modulator}_phasic / tau_{modulator} : 1')
+            namespace[f'tau_{modulator}'] = decay[modulator]
+            tonic += f' + {modulator}_phasic'
+        update.append(f'{modulator} = {tonic}')
+
+    group = NeuronGroup(1, '\n'.join(eqs), method='exact', namespace=namespace, name=name)
+    for modulator, level in levels.items():
+        if not isinstance(level, TimedArray):
+            setattr(group, f'{modulator}_tonic', level)
+            setattr(group, modulator, level)
+    # Refreshed at the start of every step, before anything reads the levels.
+    group.run_regularly('\n'.join(update), when='start', order=-1, name=f'{name}_update')
+    return group
+
+
+def broadcast_modulators(modulators, group, names=None, name=None):
+    # Copies the global levels into `group`'s own modulator variables every step
+    # (a summed variable over one synapse per neuron, so it works on every backend).
+    # The group's equations read them as usual and its synapses as `<m>_post`.
+    names = [n for n in MODULATORS if n in modulators.variables] if names is None else names
+    eqs = '\n'.join(f'{modulator}_post = {modulator}_pre : 1 (summed)' for modulator in names)
+    synapses = Synapses(modulators, group, eqs, name=name or f'{modulators.name}_to_{group.name}')
+    synapses.connect(i=np.zeros(len(group), dtype=np.int64), j=np.arange(len(group)))
+    return synapses
+
+
+def reward_events(modulators, times, amount=1.0, modulator='dopamine', name='reward'):
+    # Each event at `times` adds `amount` to the modulator's phasic part, which
+    # modulator_group only has when given a decay for it.
+    if f'{modulator}_phasic' not in modulators.variables:
+        raise ValueError(f"'{modulators.name}' has no phasic {modulator}; give modulator_group a decay for it.")
+    events = SpikeGeneratorGroup(1, np.zeros(len(times), dtype=np.int64), times, name=f'{name}_events')
+    synapses = Synapses(events, modulators, on_pre=f'{modulator}_phasic_post += reward_amount',
+                        namespace={'reward_amount': amount}, name=f'{name}_syn')
+    synapses.connect(i=0, j=0)
+    return [events, synapses]
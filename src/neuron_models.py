@@ -4,6 +4,12 @@ LIF_EQS = '''
 dv/dt = (v_rest - v + I_syn) / tau : volt (unless refractory)
 I_syn : volt
 '''
+# LIF_EQS with the resting potential shifted by ach_v_shift per unit acetylcholine;
+# add the modulator variables with neuromodulation.modulator_variables().
+NEUROMODULATED_LIF_EQS = '''
+dv/dt = (v_rest + ach_v_shift * acetylcholine - v + I_syn) / tau : volt (unless refractory)
+I_syn : volt
+'''
 LIF_PARAMS = {
     'v_rest': -70 * mV,
     'v_reset': -65 * mV,
@@ -1,17 +1,94 @@
-import matplotlib.pyplot as plt
 import numpy as np
-from brian2 import ms, Hz, mV
+from brian2 import ms, second
+from src.spectral import FREQUENCY_BANDS
+from src.monitors import rate_trace
+from src.recording import read_recording
+from src.sketches import LogHistogram
+
+# Rasters are drawn as a (neuron bin x time bin) spike-count image, so render time
+# and memory depend on the image size rather than on the number of spikes.
+RASTER_TIME_BINS = 1000
+RASTER_UNIT_BINS = 400
+# Spikes are binned this many at a time to bound the temporaries.
+RASTER_CHUNK = 1_000_000
+RATE_WIDTH = 50 * ms
+RATE_BIN = 5 * ms
+# ISI sketches are drawn on coarser log bins than they are kept at.
+ISI_PLOT_BINS_PER_DECADE = 20
+
+def add_plot_arguments(parser):
+    parser.add_argument('--no-plot', action='store_true',
+                        help='Headless run: compute and save results without building any figures.')
+
+def raster_image(times, indices, n_units, t_start=0.0, t_stop=None, time_bins=RASTER_TIME_BINS,
+                 unit_bins=RASTER_UNIT_BINS):
+    # times in seconds, counted over [t_start, t_stop); returns (unit_bins x time_bins
+    # counts, (t_start, t_stop)).
+    times = np.asarray(times)
+    indices = np.asarray(indices)
+    if t_stop is None:
+        # Just past the last spike, since the window excludes t_stop.
+        t_stop = float(np.nextafter(times.max(), np.inf)) if len(times) else t_start
+    t_stop = max(float(t_stop), float(t_start) + 1e-9)
+    unit_bins = max(1, min(unit_bins, n_units))
+    image = np.zeros(unit_bins * time_bins, dtype=np.int64)
+    scale = time_bins / (t_stop - t_start)
+    for start in range(0, len(times), RASTER_CHUNK):
+        # Filtered on time first: the cast truncates towards zero, so spikes just
+        # before t_start would otherwise land in bin 0.
+        chunk = times[start:start + RASTER_CHUNK]
+        keep = (chunk >= t_start) & (chunk < t_stop)
+        time_bin = np.minimum(((chunk[keep] - t_start) * scale).astype(np.int64), time_bins - 1)
+        unit_bin = indices[start:start + RASTER_CHUNK][keep].astype(np.int64) * unit_bins // n_units
+        image += np.bincount(unit_bin * time_bins + time_bin, minlength=image.size)
+    return image.reshape(unit_bins, time_bins), (t_start, t_stop)
+
+def plot_raster(ax, times, indices, n_units, t_start=0.0, t_stop=None, offset=0, cmap='Greys', **bins):
+    # Draws the raster of one population into rows [offset, offset + n_units) of
+    # ax, with time in ms; empty bins stay transparent so populations can be stacked.
+    # By default one bin per screen pixel of the axes, so single spikes stay visible.
+    extent = ax.get_window_extent()
+    bins.setdefault('time_bins', max(1, int(extent.width)))
+    bins.setdefault('unit_bins', max(1, int(extent.height)))
+    image, (t_start, t_stop) = raster_image(times, indices, n_units, t_start, t_stop, **bins)
+    masked = np.ma.masked_equal(image, 0)
+    vmax = max(1, np.percentile(image[image > 0], 99)) if image.any() else 1
+    ax.imshow(masked, origin='lower', aspect='auto', interpolation='nearest', cmap=cmap, vmin=0, vmax=vmax,
+              extent=[t_start * 1000, t_stop * 1000, offset, offset + n_units])
+    ax.set_xlim(t_start * 1000, t_stop * 1000)
+    return image
+
+def comparison_arrays(sim_results):
+    # Plain arrays (seconds, Hz, SI units) of everything plot_comparison draws from
+    # the simulation, so a stored run can be plotted without its monitors.
+    arrays = {
+        't_start': float(sim_results.get('t_start', 0 * ms) / second),
+        'duration': float(sim_results['duration'] / second),
+        'n_exc': sim_results['n_exc'],
+        'n_inh': sim_results['n_inh'],
+        'state_exc': read_recording(sim_results['state_mon_exc']),
+    }
+    for population in ('exc', 'inh'):
+        spike_mon = sim_results[f'spike_mon_{population}']
+        arrays[f'spikes_{population}'] = {'t': np.asarray(spike_mon.t_), 'i': np.asarray(spike_mon.i, dtype=np.int32)}
+        t, rate = rate_trace(sim_results[f'rate_mon_{population}'], width=RATE_WIDTH, bin_size=RATE_BIN)
+        arrays[f'rate_{population}'] = {'t': t, 'rate': rate}
+    return arrays
 
 def plot_comparison(plot_data):
+    # plot_data['simulation'] is comparison_arrays() of the simulated run.
+    # pyplot is imported here so that runs without figures never load it.
+    import matplotlib.pyplot as plt
     real_mean_rate = plot_data['real_mean_rate']
     real_std_rate = plot_data['real_std_rate']
     sim_mean_rate = plot_data['sim_mean_rate']
-    real_isis = plot_data['real_isis']
-    sim_isis = plot_data['sim_isis']
+    # ISI distributions are LogHistogram sketches (as dicts).
+    real_isis = LogHistogram.from_dict(plot_data['real_isis'])
+    sim_isis = LogHistogram.from_dict(plot_data['sim_isis'])
     real_band_powers = plot_data['real_band_powers']
     sim_band_powers = plot_data['sim_band_powers']
-    sim_results = plot_data['sim_results']
-    n_exc = sim_results['n_exc']
+    simulation = plot_data['simulation']
+    n_exc = simulation['n_exc']
 
     plt.figure(figsize=(15, 10))
 
@@ -23,10 +100,10 @@ def plot_comparison(plot_data):
     plt.title('Firing Rate Comparison')
 
     plt.subplot(3, 3, 2)
-    if len(real_isis) > 0:
-        plt.hist(real_isis*1000, bins=60, alpha=0.6, label='Real', density=True, color='blue')
-    if len(sim_isis) > 0:
-        plt.hist(np.array(sim_isis)*1000, bins=60, alpha=0.6, label='Simulated', density=True, color='green')
+    for sketch, label, color in ((real_isis, 'Real', 'blue'), (sim_isis, 'Simulated', 'green')):
+        if sketch.n > 0:
+            edges, density = sketch.density(bins_per_decade=ISI_PLOT_BINS_PER_DECADE)
+            plt.stairs(density / 1000, edges * 1000, fill=True, alpha=0.6, label=label, color=color)
     plt.xlabel('ISI (ms)')
     plt.ylabel('Density')
     plt.title('ISI Distribution')
@@ -34,7 +111,7 @@ def plot_comparison(plot_data):
     plt.xlim(0, 500)
 
     plt.subplot(3, 3, 3)
-    bands = ['delta', 'theta', 'alpha', 'beta', 'gamma']
+    bands = list(FREQUENCY_BANDS)
     real_powers = [real_band_powers.get(band, 1e-10) for band in bands]
     sim_powers = [sim_band_powers.get(band, 1e-10) for band in bands]
     x = np.arange(len(bands))
@@ -49,34 +126,44 @@ def plot_comparison(plot_data):
     plt.yscale('log')
 
     plt.subplot(3, 3, 4)
-    spike_mon_exc = sim_results['spike_mon_exc']
-    spike_mon_inh = sim_results['spike_mon_inh']
-    time_mask = spike_mon_exc.t/ms < 2000
-    plt.plot(spike_mon_exc.t[time_mask]/ms, spike_mon_exc.i[time_mask], '.g', markersize=0.8, alpha=0.7)
-    time_mask_inh = spike_mon_inh.t/ms < 2000
-    plt.plot(spike_mon_inh.t[time_mask_inh]/ms, spike_mon_inh.i[time_mask_inh] + n_exc, '.r', markersize=1.0)
+    spikes_exc = simulation['spikes_exc']
+    spikes_inh = simulation['spikes_inh']
+    # The first two recorded seconds.
+    t_start = float(simulation['t_start'])
+    t_stop = t_start + min(2.0, float(simulation['duration']))
+    ax = plt.gca()
+    plot_raster(ax, spikes_exc['t'], spikes_exc['i'], n_exc, t_start, t_stop, cmap='Greens')
+    plot_raster(ax, spikes_inh['t'], spikes_inh['i'], simulation['n_inh'], t_start, t_stop, offset=n_exc,
+                cmap='Reds')
+    plt.ylim(0, n_exc + simulation['n_inh'])
     plt.xlabel('Time (ms)')
     plt.ylabel('Neuron Index')
     plt.title('Network Raster Plot')
-    plt.xlim(0, 2000)
 
     plt.subplot(3, 3, 5)
-    rate_mon_exc = sim_results['rate_mon_exc']
-    rate_mon_inh = sim_results['rate_mon_inh']
-    if len(rate_mon_exc.t) > 0:
-        plt.plot(rate_mon_exc.t/ms, rate_mon_exc.smooth_rate(window='gaussian', width=50*ms)/Hz, color='green', linewidth=2, label='Excitatory')
-    if len(rate_mon_inh.t) > 0:
-        plt.plot(rate_mon_inh.t/ms, rate_mon_inh.smooth_rate(window='gaussian', width=50*ms)/Hz, color='red', linewidth=2, label='Inhibitory')
+    rate_t_exc, rate_exc = simulation['rate_exc']['t'], simulation['rate_exc']['rate']
+    rate_t_inh, rate_inh = simulation['rate_inh']['t'], simulation['rate_inh']['rate']
+    if len(rate_t_exc) > 0:
+        plt.plot(rate_t_exc * 1000, rate_exc, color='green', linewidth=2, label='Excitatory')
+    if len(rate_t_inh) > 0:
+        plt.plot(rate_t_inh * 1000, rate_inh, color='red', linewidth=2, label='Inhibitory')
     plt.xlabel('Time (ms)')
     plt.ylabel('Population Rate (Hz)')
     plt.title('Population Rates')
     plt.legend()
 
     plt.subplot(3, 3, 6)
-    state_mon_exc = sim_results['state_mon_exc']
-    for i in range(min(4, state_mon_exc.v.shape[0])):
-        plt.plot(state_mon_exc.t/ms, state_mon_exc.v[i]/mV, alpha=0.8, linewidth=1)
-    plt.xlabel('Time (ms)')
+    state_exc = simulation['state_exc']
+    if 't' in state_exc:
+        for i in range(min(4, state_exc['v'].shape[0])):
+            plt.plot(state_exc['t'] * 1000, state_exc['v'][i] * 1000, alpha=0.8, linewidth=1)
+        plt.xlabel('Time (ms)')
+    else:
+        # Online statistics: mean and range per recorded neuron.
+        stats = state_exc['v']
+        plt.errorbar(state_exc['indices'], stats['mean'] * 1000,
+                     yerr=[(stats['mean'] - stats['min']) * 1000, (stats['max'] - stats['mean']) * 1000], fmt='.')
+        plt.xlabel('Neuron Index')
     plt.ylabel('Voltage (mV)')
     plt.title('Membrane Voltages')
 
@@ -0,0 +1,39 @@
+import re
+
+# Command-line values are "<number>" or "<number>*<unit>" (also "<number> <unit>"
+# or "<number><unit>"), with the unit looked up here. Parsed explicitly rather than
+# evaluated, so no expression from the command line is ever executed.
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+_QUANTITY = re.compile(rf'^\s*({_NUMBER})\s*(?:\*?\s*([A-Za-z]+))?\s*$')
+
+UNIT_NAMES = (
+    'second', 'ms', 'us',
+    'Hz', 'kHz',
+    'volt', 'mV', 'uvolt',
+    'amp', 'nA', 'pA',
+    'siemens', 'mS', 'uS', 'nS',
+    'farad', 'uF', 'nF', 'pF',
+    'ohm', 'kohm', 'Mohm',
+    'metre', 'mm', 'um', 'cm',
+)
+
+
+def units():
+    import brian2
+    return {name: getattr(brian2, name) for name in UNIT_NAMES}
+
+
+def parse_quantity(text):
+    # An int or float, or a Brian2 Quantity for a whitelisted unit; ValueError otherwise.
+    match = _QUANTITY.match(str(text))
+    if match is None:
+        raise ValueError(f"Expected a number with an optional unit, e.g. 0.5 or 200*ms (got '{text}').")
+    number, unit = match.groups()
+    if unit is None:
+        # Integer literals stay ints (counts, seeds, sizes).
+        return int(number) if re.fullmatch(r'[-+]?\d+', number) else float(number)
+    value = float(number)
+    table = units()
+    if unit not in table:
+        raise ValueError(f"Unknown unit '{unit}' in '{text}'; known units are {', '.join(UNIT_NAMES)}.")
+    return value * table[unit]
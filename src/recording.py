@@ -0,0 +1,326 @@
+import json
+import logging
+import numpy as np
+from brian2 import NeuronGroup, Synapses, StateMonitor, network_operation, second
+
+from src.backend import current_backend
+from src.monitors import population_monitor, reduced_trace, clock_kwargs, _unit_string
+from src.quantities import parse_quantity
+
+logger = logging.getLogger(__name__)
+
+# A recording policy says what a monitor keeps, as a plain dict:
+#   {'policy': 'all'}                          every neuron, every tick (StateMonitor record=True)
+#   {'policy': 'subset', 'n': 10, 'select': 'random'}
+#                                              traces of a subset of neurons
+#   {'policy': 'snapshots', 'every': 100*ms}   the (selected) state every `every`
+#   {'policy': 'window', 'duration': 200*ms}   only the last `duration`, in a ring buffer
+#                                              (runtime backends only, not cpp_standalone)
+#   {'policy': 'stats'}                        online per-neuron mean, variance, min and max
+#   {'policy': 'population', 'reduce': 'mean'} one in-run reduction per subset (population_monitor)
+# Selection keys (n, fraction, select, strata, seed) apply to every policy but
+# 'population'; 'dt' sets the sampling period, falling back to the script's record dt.
+POLICIES = ('all', 'subset', 'snapshots', 'window', 'stats', 'population')
+SELECTIONS = ('first', 'random', 'stratified')
+SELECTION_KEYS = ('n', 'fraction', 'select', 'strata', 'seed')
+POLICY_KEYS = {
+    'all': ('dt',),
+    'subset': ('dt',) + SELECTION_KEYS,
+    'snapshots': ('every',) + SELECTION_KEYS,
+    'window': ('dt', 'duration') + SELECTION_KEYS,
+    'stats': ('dt',) + SELECTION_KEYS,
+    'population': ('dt', 'reduce', 'subsets', 'variance'),
+}
+# Objects that only exist to record, which warm-ups switch off like monitors.
+RECORDER_FLAG = 'synmodel_recorder'
+
+
+def mark_recorder(obj):
+    # Brian2 groups only accept attributes declared with add_attribute.
+    if hasattr(obj, 'add_attribute'):
+        obj.add_attribute(RECORDER_FLAG)
+    setattr(obj, RECORDER_FLAG, True)
+
+
+def is_recorder(obj):
+    return getattr(obj, RECORDER_FLAG, False) is True
+
+
+def check_policy(policy):
+    policy = dict(policy)
+    kind = policy.get('policy', 'all')
+    if kind not in POLICIES:
+        raise ValueError(f"Unknown recording policy '{kind}'; choose from {', '.join(POLICIES)}.")
+    unknown = set(policy) - {'policy'} - set(POLICY_KEYS[kind])
+    if unknown:
+        raise ValueError(f"Recording policy '{kind}' does not take {', '.join(sorted(unknown))}.")
+    if policy.get('select', 'first') not in SELECTIONS:
+        raise ValueError(f"Unknown selection '{policy['select']}'; choose from {', '.join(SELECTIONS)}.")
+    if kind == 'window' and 'duration' not in policy:
+        raise ValueError("The 'window' policy needs a duration.")
+    if kind == 'window' and current_backend() == 'cpp_standalone':
+        # The ring buffer is filled from Python each tick, which a standalone build cannot call.
+        raise ValueError("The 'window' policy needs the numpy or cython backend; "
+                         "use 'stats', 'subset' or 'snapshots' with cpp_standalone.")
+    if kind == 'snapshots' and 'every' not in policy:
+        raise ValueError("The 'snapshots' policy needs an 'every' period.")
+    policy['policy'] = kind
+    return policy
+
+
+def select_indices(n, policy):
+    # Which of the group's n neurons (or synapses) to record.
+    if 'n' not in policy and 'fraction' not in policy:
+        return np.arange(n)
+    k = policy['n'] if 'n' in policy else int(round(policy['fraction'] * n))
+    k = max(0, min(int(k), n))
+    select = policy.get('select', 'first')
+    rng = np.random.default_rng(policy.get('seed'))
+    if select == 'first':
+        return np.arange(k)
+    if select == 'random':
+        return np.sort(rng.choice(n, size=k, replace=False))
+    # Stratified: k spread over the strata in proportion to their size (at least one
+    # each while k allows), drawn at random within each. Without labels the strata
+    # are k equal blocks of the index range.
+    strata = np.asarray(policy['strata']) if 'strata' in policy else np.arange(n) * k // max(n, 1)
+    labels, sizes = np.unique(strata, return_counts=True)
+    quota = _stratum_quotas(sizes, k, rng)
+    chosen = [rng.choice(np.flatnonzero(strata == label), size=q, replace=False)
+              for label, q in zip(labels, quota)]
+    return np.sort(np.concatenate(chosen)) if chosen else np.zeros(0, dtype=np.int64)
+
+
+def _stratum_quotas(sizes, k, rng):
+    # Largest-remainder allocation: k * size / n per stratum rounded so the quotas
+    # add up to exactly k, at least one each while k allows and never more than a
+    # stratum holds. Ties, and which strata go without when k is smaller than their
+    # number, are settled in random order rather than by label.
+    order = rng.permutation(len(sizes))
+    quota = np.zeros(len(sizes), dtype=np.int64)
+    if k < len(sizes):
+        quota[order[:k]] = 1
+        return quota
+    ideal = k * sizes / sizes.sum()
+    quota = np.minimum(sizes, np.maximum(1, np.floor(ideal))).astype(np.int64)
+    remainder = ideal - quota
+    while quota.sum() != k:
+        # Short: add to the largest remainders; over (from the minimum of one): take
+        # from the smallest among strata with more than one.
+        step = 1 if quota.sum() < k else -1
+        candidates = order[quota[order] < sizes[order]] if step > 0 else order[quota[order] > 1]
+        pick = np.argmax(remainder[candidates]) if step > 0 else np.argmin(remainder[candidates])
+        quota[candidates[pick]] += step
+        remainder[candidates[pick]] -= step
+    return quota
+
+
+def record_state(group, variables, policy=None, dt=None, name=None):
+    # Records `variables` of `group` according to `policy`; dt is the default
+    # sampling period. Returns a dict whose 'objects' go into the Network and
+    # which read_recording() turns into arrays.
+    policy = check_policy(policy or {})
+    variables = [variables] if isinstance(variables, str) else list(variables)
+    name = name or f'{group.name}_{"_".join(variables)}'
+    kind = policy['policy']
+    dt = policy.get('dt', dt)
+    recording = {'name': name, 'policy': kind, 'variables': variables}
+
+    if kind == 'population':
+        if len(variables) != 1:
+            raise ValueError("The 'population' policy reduces a single variable.")
+        reduction = population_monitor(group, variables[0], subsets=policy.get('subsets'),
+                                       reduce=policy.get('reduce', 'mean'), variance=policy.get('variance', False),
+                                       dt=dt, name=name)
+        return {**recording, 'objects': reduction['objects'], 'monitor': reduction['monitor'], 'reduction': reduction}
+
+    indices = select_indices(len(group), policy)
+    recording['indices'] = indices
+    if kind == 'all':
+        monitor = StateMonitor(group, variables, record=True, name=name, **clock_kwargs(dt))
+        return {**recording, 'objects': [monitor], 'monitor': monitor}
+    if kind in ('subset', 'snapshots'):
+        period = policy['every'] if kind == 'snapshots' else dt
+        monitor = StateMonitor(group, variables, record=indices, name=name, **clock_kwargs(period))
+        return {**recording, 'objects': [monitor], 'monitor': monitor}
+    if kind == 'window':
+        return {**recording, **_ring_buffer(group, variables, indices, policy['duration'], dt, name)}
+    return {**recording, **_online_stats(group, variables, indices, dt, name)}
+
+
+def _ring_buffer(group, variables, indices, duration, dt, name):
+    # Keeps the last `duration` of samples in preallocated arrays. It is a
+    # network_operation, so it needs a runtime backend and is not part of
+    # checkpoints; the window refills after a restore.
+    period = float((dt if dt is not None else group.clock.dt) / second)
+    n_slots = max(1, int(round(float(duration / second) / period)))
+    buffer = {
+        'values': {var: np.zeros((n_slots, len(indices))) for var in variables},
+        't': np.zeros(n_slots),
+        'count': 0,
+    }
+
+    # Sampled where a StateMonitor would be, at the start of the step.
+    @network_operation(when='start', name=name, **clock_kwargs(dt))
+    def fill(t):
+        slot = buffer['count'] % n_slots
+        for var in variables:
+            buffer['values'][var][slot] = np.asarray(getattr(group, f'{var}_'))[indices]
+        buffer['t'][slot] = float(t / second)
+        buffer['count'] += 1
+
+    mark_recorder(fill)
+    return {'objects': [fill], 'monitor': fill, 'buffer': buffer}
+
+
+def _online_stats(group, variables, indices, dt, name):
+    # Running sums, minimum and maximum per recorded neuron, updated in the model
+    # (so on every backend) from a copy of the variables made each sampling tick.
+    if not isinstance(group, NeuronGroup):
+        raise ValueError("The 'stats' policy needs a NeuronGroup; record synapses with 'subset' or 'snapshots'.")
+    eqs, syn_eqs, update = ['n_samples : 1'], [], []
+    for var in variables:
+        unit = _unit_string(group, var)
+        squared = '1' if unit == '1' else f'{unit}**2'
+        eqs.extend([f'{var} : {unit}', f'{var}_sum : {unit}', f'{var}_sumsq : {squared}',
+                    f'{var}_min : {unit}', f'{var}_max : {unit}'])
+        syn_eqs.append(f'{var}_post = {var}_pre : {unit} (summed)')
+        update.extend([f'{var}_sum += {var}',
+                       f'{var}_sumsq += {var}**2',
+                       f'{var}_min = {var} + int(n_samples > 0 and {var}_min < {var}) * ({var}_min - {var})',
+                       f'{var}_max = {var} + int(n_samples > 0 and {var}_max > {var}) * ({var}_max - {var})'])
+    update.append('n_samples += 1')
+    stats = NeuronGroup(len(indices), '\n'.join(eqs), name=f'{name}_stats', **clock_kwargs(dt))
+    copy = Synapses(group, stats, '\n'.join(syn_eqs), name=f'{name}_syn', **clock_kwargs(dt))
+    copy.connect(i=indices, j=np.arange(len(indices)))
+    stats.run_regularly('\n'.join(update), when='end', name=f'{name}_update', **clock_kwargs(dt))
+    for obj in (stats, copy):
+        mark_recorder(obj)
+    return {'objects': [stats, copy], 'monitor': stats}
+
+
+def read_recording(recording):
+    # Plain arrays in base SI units. Traces: {'t', 'indices', var: (neurons x samples)};
+    # stats: {'indices', 'n_samples', var: {'mean', 'var', 'min', 'max'}};
+    # population: {'t', 'subsets', var: (subsets x samples)[, 'variance']}.
+    kind = recording['policy']
+    monitor = recording['monitor']
+    if kind == 'population':
+        trace = reduced_trace(recording['reduction'])
+        output = {'t': trace[0], 'subsets': recording['reduction']['subsets'],
+                  recording['variables'][0]: np.atleast_2d(trace[1])}
+        if len(trace) > 2:
+            output['variance'] = np.atleast_2d(trace[2])
+        return output
+    output = {'indices': recording['indices']}
+    if kind == 'window':
+        buffer = recording['buffer']
+        n_slots = len(buffer['t'])
+        order = (np.arange(min(buffer['count'], n_slots)) + max(0, buffer['count'] - n_slots)) % n_slots
+        output['t'] = buffer['t'][order]
+        for var in recording['variables']:
+            output[var] = buffer['values'][var][order].T
+    elif kind == 'stats':
+        n = np.asarray(monitor.n_samples_)
+        output['n_samples'] = n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for var in recording['variables']:
+                mean = np.asarray(getattr(monitor, f'{var}_sum_')) / n
+                output[var] = {
+                    'mean': mean,
+                    'var': np.maximum(np.asarray(getattr(monitor, f'{var}_sumsq_')) / n - mean ** 2, 0.0),
+                    'min': np.asarray(getattr(monitor, f'{var}_min_')),
+                    'max': np.asarray(getattr(monitor, f'{var}_max_')),
+                }
+    else:
+        output['t'] = np.asarray(monitor.t_)
+        for var in recording['variables']:
+            output[var] = np.asarray(getattr(monitor, f'{var}_'))
+    return output
+
+
+def recorded_mean(recording, variable=None, labels=None):
+    # (t, mean trace) of a trace or population recording. With per-neuron labels
+    # (e.g. replica ids), one row per label in 0..max(labels); labels with no
+    # recorded neuron give NaN rows. A population recording's subsets are its rows.
+    data = read_recording(recording)
+    variable = variable or recording['variables'][0]
+    if 't' not in data:
+        raise ValueError(f"A '{recording['policy']}' recording has no traces.")
+    values = data[variable]
+    if recording['policy'] == 'population':
+        return data['t'], values if labels is not None else values[0] if len(values) == 1 else values
+    if labels is None:
+        return data['t'], values.mean(axis=0)
+    labels = np.asarray(labels, dtype=np.int64)
+    n_labels = int(labels.max(initial=-1)) + 1
+    labels = labels[data['indices']]
+    sums = np.zeros((n_labels, values.shape[1]))
+    np.add.at(sums, labels, values)
+    counts = np.bincount(labels, minlength=n_labels)[:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return data['t'], sums / counts
+
+
+def recording_objects(recordings):
+    return [obj for recording in recordings.values() for obj in recording['objects']]
+
+
+def clear_buffer(recording):
+    # Empties a 'window' recording's ring buffer, which net.restore() leaves as it was
+    # because it lives outside the model; other policies are restored with the network.
+    buffer = recording.get('buffer') if isinstance(recording, dict) else None
+    if buffer is not None:
+        buffer['count'] = 0
+        buffer['t'][:] = 0
+        for values in buffer['values'].values():
+            values[:] = 0
+
+
+def parse_value(text):
+    # "100*ms", "0.2", "true", "random": numbers with an optional unit and booleans
+    # are parsed (see src/quantities.py), other words are kept as strings.
+    if not isinstance(text, str):
+        return text
+    if text.lower() in ('true', 'false'):
+        return text.lower() == 'true'
+    try:
+        return parse_quantity(text)
+    except ValueError:
+        return text
+
+
+def merge_policies(defaults, overrides):
+    # overrides: {monitor: policy}; a policy that switches kind replaces the
+    # default instead of being merged into it.
+    merged = {name: dict(policy) for name, policy in defaults.items()}
+    for name, policy in (overrides or {}).items():
+        if name not in merged:
+            raise ValueError(f"No monitor '{name}' to configure; known monitors are {', '.join(sorted(merged))}.")
+        policy = {key: parse_value(value) for key, value in policy.items()}
+        if policy.get('policy', merged[name].get('policy')) != merged[name].get('policy', 'all'):
+            merged[name] = {}
+        merged[name].update(policy)
+    return merged
+
+
+def add_recording_arguments(parser):
+    parser.add_argument('--recording', default=None,
+                        help='JSON file of {monitor: policy} overrides, e.g. {"lfp": {"policy": "subset", "n": 10}}.')
+    parser.add_argument('--record', action='append', default=[], metavar='MONITOR.KEY=VALUE',
+                        help="Override one recording policy setting, e.g. --record state.policy=window "
+                             "--record state.duration=200*ms. May be repeated.")
+
+
+def recording_overrides(args):
+    overrides = {}
+    if args.recording:
+        with open(args.recording) as f:
+            overrides = json.load(f)
+    for item in args.record:
+        key, _, value = item.partition('=')
+        monitor, _, setting = key.partition('.')
+        if not value or not setting:
+            raise ValueError(f"Recording overrides look like monitor.key=value (got '{item}').")
+        overrides.setdefault(monitor, {})[setting] = value
+    return overrides
@@ -0,0 +1,138 @@
+import os
+import time
+import glob
+import shutil
+import hashlib
+import logging
+from functools import lru_cache
+
+from src.fingerprint import fingerprint
+from src.results_io import save_results, load_results, read_metadata, is_results_dir
+
+logger = logging.getLogger(__name__)
+
+# Results addressed by what produced them: the entry point, its model config and
+# seed, the input data's fingerprint and the code version. An entry is a results
+# directory (see results_io) named <name>-<key>, so a lookup is one stat and a
+# load is memory-mapped.
+STORE_FORMAT = 'synmodel-result-store'
+STORE_VERSION = 1
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_STORE_DIR = os.path.join(REPO_DIR, 'results', 'store')
+# Command-line arguments that change where output goes or how the work is spread,
+# not the result itself, so they are left out of a run's key. Recording policies
+# enter keys as the parsed overrides rather than as --record/--recording.
+OUTPUT_ARGUMENTS = ('store_dir', 'rerun', 'no_plot', 'cache_dir', 'checkpoint_dir', 'workers', 'recording', 'record')
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    # Hash of every module under src/ and scripts/, so any code change (committed
+    # or not) gives new keys instead of returning results the code no longer produces.
+    paths = sorted(glob.glob(os.path.join(REPO_DIR, 'src', '*.py')) + glob.glob(os.path.join(REPO_DIR, 'scripts', '*.py')))
+    contents = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            contents.append((os.path.relpath(path, REPO_DIR), hashlib.sha256(f.read()).hexdigest()))
+    return fingerprint('code', contents)
+
+
+def result_key(name, config, seed=None, data_fingerprint=None):
+    return fingerprint('result', STORE_VERSION, name, config, seed, data_fingerprint, code_version())
+
+
+def run_arguments(args):
+    # The parsed arguments that determine a script's results, for result_key.
+    return {name: value for name, value in sorted(vars(args).items()) if name not in OUTPUT_ARGUMENTS}
+
+
+def add_store_arguments(parser):
+    parser.add_argument('--store-dir', default=DEFAULT_STORE_DIR,
+                        help='Result store; a seeded run already stored there for the same model, data and code is reused.')
+    parser.add_argument('--rerun', action='store_true',
+                        help='Simulate even if the result store already holds this run.')
+    return parser
+
+
+def result_path(store_dir, name, key):
+    return os.path.join(store_dir, f'{name}-{key}')
+
+
+def lookup_result(store_dir, name, key):
+    # The stored results, or None if nothing was stored under this key.
+    path = result_path(store_dir, name, key)
+    if not is_results_dir(path):
+        return None
+    meta = read_metadata(path)['metadata']
+    if meta.get('format') != STORE_FORMAT or meta.get('key') != key:
+        logger.warning(f"Ignoring {path}: not a store entry for {key}.")
+        return None
+    logger.info(f"Using stored {name} result {key}.")
+    return load_results(path)
+
+
+def store_result(store_dir, name, key, results, **metadata):
+    meta = {'format': STORE_FORMAT, 'version': STORE_VERSION, 'name': name, 'key': key,
+            'code_version': code_version(), 'created': time.time(), **metadata}
+    os.makedirs(store_dir, exist_ok=True)
+    path = save_results(result_path(store_dir, name, key), results, metadata=meta)
+    logger.info(f"Stored {name} result {key} in {path}.")
+    return path
+
+
+def cached_result(store_dir, name, key, compute, reuse=True, reproducible=True, **metadata):
+    # compute() -> results, called only when there is no entry for key (or reuse is
+    # False). Runs that are not reproducible (unseeded) are never looked up, so only
+    # the latest of them is kept, for scripts/results.py. Returns (results, found).
+    if reuse and reproducible:
+        results = lookup_result(store_dir, name, key)
+        if results is not None:
+            return results, True
+    results = compute()
+    store_result(store_dir, name, key, results, reproducible=reproducible, **metadata)
+    if not reproducible:
+        prune_store(store_dir, name)
+    return results, False
+
+
+def list_store(store_dir, name=None):
+    # Metadata of every entry (of one entry point), oldest first.
+    entries = []
+    for entry in sorted(os.listdir(store_dir)) if os.path.isdir(store_dir) else []:
+        path = os.path.join(store_dir, entry)
+        if not is_results_dir(path):
+            continue
+        meta = read_metadata(path)['metadata']
+        if meta.get('format') == STORE_FORMAT and (name is None or meta.get('name') == name):
+            entries.append({**meta, 'path': path})
+    return sorted(entries, key=lambda meta: meta.get('created', 0))
+
+
+def latest_result(store_dir, name, current_code=False):
+    # The most recently stored result of an entry point, optionally only among those
+    # written by the current code; None if there is none.
+    entries = [meta for meta in list_store(store_dir, name)
+               if not current_code or meta.get('code_version') == code_version()]
+    if not entries:
+        return None
+    return load_results(entries[-1]['path'])
+
+
+def prune_store(store_dir, name=None, current_code=False):
+    # Removes the entries that can no longer be hits: all but the latest
+    # non-reproducible run of each entry point and, with current_code=True, every
+    # entry written by other code. Returns the removed paths.
+    entries = list_store(store_dir, name)
+    latest = {}
+    for meta in entries:
+        if not meta.get('reproducible', True):
+            latest[meta['name']] = meta['path']
+    removed = []
+    for meta in entries:
+        stale = current_code and meta.get('code_version') != code_version()
+        if stale or (not meta.get('reproducible', True) and latest[meta['name']] != meta['path']):
+            shutil.rmtree(meta['path'])
+            removed.append(meta['path'])
+    if removed:
+        logger.info(f"Removed {len(removed)} entries from {store_dir}.")
+    return removed
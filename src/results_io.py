@@ -0,0 +1,264 @@
+import os
+import re
+import json
+import struct
+import shutil
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_NAME = 'synmodel-results'
+FORMAT_VERSION = 1
+META_FILE = 'meta.json'
+COMPRESSED_FILE = 'arrays.npz'
+
+# Short lists stay in the JSON sidecar; anything longer becomes a column.
+MIN_ARRAY_LENGTH = 16
+
+
+def _unit_name(value):
+    from brian2.units.fundamentalunits import get_unit
+    return str(get_unit(value.dim))
+
+
+def _as_column(value):
+    if isinstance(value, np.ndarray) and value.ndim > 0:
+        return np.asarray(value)
+    if isinstance(value, (list, tuple)) and len(value) >= MIN_ARRAY_LENGTH:
+        array = np.asarray(value)
+        if array.dtype.kind in 'biuf':
+            return array
+    return None
+
+
+def _as_scalar(value):
+    if hasattr(value, 'dim'):
+        return float(np.asarray(value))
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [_as_scalar(v) for v in value]
+    return value
+
+
+# Column paths join keys with '/', so '%' and '/' inside a key are escaped.
+# Keys that are not strings come back as their type if it is one of these.
+KEY_TYPES = {'int': int, 'float': float, 'bool': lambda text: text == 'True'}
+
+
+def _escape(key):
+    return key.replace('%', '%25').replace('/', '%2F')
+
+
+def _unescape(key):
+    return key.replace('%2F', '/').replace('%25', '%')
+
+
+def _key_name(key, path, key_types):
+    if isinstance(key, np.generic):
+        key = key.item()
+    if isinstance(key, str):
+        return key
+    # bool before int, which it subclasses.
+    kind = next((kind for kind, cls in (('bool', bool), ('int', int), ('float', float)) if isinstance(key, cls)), None)
+    if kind is None:
+        raise TypeError(f"Cannot store the {type(key).__name__} key {key!r} at '{path}'; "
+                        f"keys must be strings, ints, floats or bools.")
+    key_types[f"{path}/{_escape(str(key))}" if path else _escape(str(key))] = kind
+    return str(key)
+
+
+def _dims(value):
+    # Exponents of the SI base units, or None for plain and dimensionless values.
+    dim = getattr(value, 'dim', None)
+    dims = getattr(dim, '_dims', None)
+    return list(dims) if dims is not None and any(dims) else None
+
+
+def _flatten(results, prefix, columns, scalars, key_types, units):
+    names = set()
+    for key, value in results.items():
+        key = _key_name(key, prefix, key_types)
+        if key in names:
+            raise ValueError(f"Two keys at '{prefix}' are both stored as '{key}'.")
+        names.add(key)
+        path = f"{prefix}/{_escape(key)}" if prefix else _escape(key)
+        if isinstance(value, dict):
+            scalars[key] = {}
+            _flatten(value, path, columns, scalars[key], key_types, units)
+            continue
+        column = _as_column(value)
+        if column is not None:
+            columns[path] = (column, _unit_name(value) if hasattr(value, 'dim') else None, _dims(value))
+        else:
+            scalars[key] = _as_scalar(value)
+            if _dims(value) is not None:
+                units[path] = _dims(value)
+
+
+def _restore(results, meta, units=False):
+    # Typed keys and, with units=True, Brian2 units on scalars and columns.
+    dims = dict(meta.get('units', {})) if units else {}
+    if units:
+        dims.update({path: info['dim'] for path, info in meta['arrays'].items() if info.get('dim')})
+    key_types = meta.get('key_types', {})
+    if not dims and not key_types:
+        return results
+    from_dims = None
+    if dims:
+        from brian2.units.fundamentalunits import Quantity, get_or_create_dimension
+        from_dims = lambda value, exponents: Quantity(value, dim=get_or_create_dimension(exponents), copy=False)
+
+    def rebuild(node, prefix):
+        output = {}
+        for key, value in node.items():
+            path = f"{prefix}/{_escape(key)}" if prefix else _escape(key)
+            if isinstance(value, dict):
+                value = rebuild(value, path)
+            elif path in dims:
+                value = from_dims(value, dims[path])
+            kind = key_types.get(path)
+            output[KEY_TYPES[kind](key) if kind else key] = value
+        return output
+    return rebuild(results, '')
+
+
+def _file_name(index, path):
+    return f"{index:04d}_{re.sub(r'[^A-Za-z0-9_.-]+', '_', path)[:80]}.npy"
+
+
+def save_results(path, results, compress=False, metadata=None):
+    columns, scalars, key_types, units = {}, {}, {}, {}
+    _flatten(results, '', columns, scalars, key_types, units)
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    arrays = {}
+    for index, (column_path, (array, unit, dims)) in enumerate(columns.items()):
+        name = _file_name(index, column_path)
+        arrays[column_path] = {'file': name, 'dtype': array.dtype.str, 'shape': list(array.shape), 'unit': unit,
+                               'dim': dims}
+        if not compress:
+            np.save(os.path.join(tmp_path, name), np.ascontiguousarray(array), allow_pickle=False)
+    if compress:
+        np.savez_compressed(os.path.join(tmp_path, COMPRESSED_FILE),
+                            **{info['file']: columns[column_path][0] for column_path, info in arrays.items()})
+
+    meta = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'compressed': compress,
+        'scalars': scalars,
+        'arrays': arrays,
+        'units': units,
+        'key_types': key_types,
+        'metadata': metadata or {},
+    }
+    with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=1, default=_as_scalar)
+
+    # Swap the finished directory in so readers never see a partial write. The old
+    # one is moved aside first and deleted last, so a crash at any point leaves
+    # either the old or the new results on disk.
+    old_path = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    return path
+
+
+def is_results_dir(path):
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def read_metadata(path):
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    if meta.get('format') != FORMAT_NAME:
+        raise ValueError(f"{path} is not a results directory.")
+    return meta
+
+
+def _insert(results, column_path, value):
+    node = results
+    *parents, leaf = column_path.split('/')
+    for parent in parents:
+        node = node.setdefault(_unescape(parent), {})
+    node[_unescape(leaf)] = value
+
+
+def load_results(path, mmap=True, units=False):
+    # Values come back in base SI units; units=True turns those stored from Brian2
+    # Quantities back into Quantities.
+    meta = read_metadata(path)
+    results = json.loads(json.dumps(meta['scalars']))
+
+    if meta['compressed']:
+        archive = np.load(os.path.join(path, COMPRESSED_FILE), allow_pickle=False)
+        loader = lambda info: archive[info['file']]
+    else:
+        mode = 'r' if mmap else None
+        loader = lambda info: np.load(os.path.join(path, info['file']), mmap_mode=mode, allow_pickle=False)
+
+    for column_path, info in meta['arrays'].items():
+        _insert(results, column_path, loader(info))
+    return _restore(results, meta, units)
+
+
+# The same layout as one message instead of a directory: an 8-byte little-endian
+# header length, the meta.json content, then the raw bytes of every column at the
+# 'offset' its entry gives. Used to send results between processes.
+def results_to_bytes(results, metadata=None):
+    columns, scalars, key_types, units = {}, {}, {}, {}
+    _flatten(results, '', columns, scalars, key_types, units)
+    arrays, chunks, offset = {}, [], 0
+    for column_path, (array, unit, dims) in columns.items():
+        array = np.ascontiguousarray(array)
+        arrays[column_path] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape), 'unit': unit,
+                               'dim': dims}
+        chunks.append(array.tobytes())
+        offset += array.nbytes
+    meta = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'compressed': False,
+        'scalars': scalars,
+        'arrays': arrays,
+        'units': units,
+        'key_types': key_types,
+        'metadata': metadata or {},
+    }
+    header = json.dumps(meta, default=_as_scalar).encode('utf-8')
+    return b''.join([struct.pack('<Q', len(header)), header, *chunks])
+
+
+def results_from_bytes(data):
+    # Returns (results, metadata); arrays are read-only views into `data`.
+    (length,) = struct.unpack_from('<Q', data)
+    meta = json.loads(bytes(data[8:8 + length]).decode('utf-8'))
+    if meta.get('format') != FORMAT_NAME:
+        raise ValueError("Message does not hold serialized results.")
+    results = json.loads(json.dumps(meta['scalars']))
+    for column_path, info in meta['arrays'].items():
+        dtype = np.dtype(info['dtype'])
+        count = int(np.prod(info['shape'], dtype=np.int64))
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=8 + length + info['offset'])
+        _insert(results, column_path, array.reshape(info['shape']))
+    return _restore(results, meta), meta['metadata']
+
+
+def list_results(results_dir):
+    if not os.path.isdir(results_dir):
+        return []
+    return sorted(name for name in os.listdir(results_dir)
+                  if is_results_dir(os.path.join(results_dir, name)))
@@ -0,0 +1,262 @@
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Distributions of positive values (ISIs, firing rates) kept as counts on fixed
+# log-spaced bins. Memory is set by the bin layout, not by how many values go in;
+# sketches with the same layout merge exactly, so they can be built per unit,
+# chunk, probe or worker and combined afterwards. Quantiles are resolved to one
+# bin (10 ** (1 / bins_per_decade) relative width, 2.3% by default) and distances
+# are computed between the binned distributions.
+ISI_RANGE = (1e-4, 1e3)
+RATE_RANGE = (1e-3, 1e3)
+DEFAULT_BINS_PER_DECADE = 100
+DEFAULT_N_BOOT = 1000
+# Bootstrap resamples drawn at a time, so their memory is bounded too.
+BOOT_BATCH = 256
+
+
+class LogHistogram:
+    # counts[0] holds values below lo (including zeros), counts[-1] values at or
+    # above hi; counts[k] for 1 <= k <= n_bins holds [edges[k - 1], edges[k]).
+    # Exact count, sum, sum of squares, min and max are kept alongside.
+    def __init__(self, lo=ISI_RANGE[0], hi=ISI_RANGE[1], bins_per_decade=DEFAULT_BINS_PER_DECADE):
+        self.lo = float(lo)
+        self.hi = float(hi)
+        self.bins_per_decade = int(bins_per_decade)
+        self.n_bins = int(round(np.log10(self.hi / self.lo) * self.bins_per_decade))
+        self.edges = self.lo * 10.0 ** (np.arange(self.n_bins + 1) / self.bins_per_decade)
+        self.counts = np.zeros(self.n_bins + 2, dtype=np.int64)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def n(self):
+        return int(self.counts.sum())
+
+    def layout(self):
+        return self.lo, self.hi, self.bins_per_decade
+
+    def update(self, values):
+        # Non-finite values (e.g. rates of silent units) are skipped.
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return self
+        index = np.zeros(len(values), dtype=np.int64)
+        positive = values > 0
+        index[positive] = np.floor(np.log10(values[positive] / self.lo) * self.bins_per_decade).astype(np.int64) + 1
+        np.clip(index, 0, self.n_bins + 1, out=index)
+        self.counts += np.bincount(index, minlength=self.n_bins + 2)
+        self.total += float(values.sum())
+        self.total_sq += float(np.dot(values, values))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        return self
+
+    def merge(self, other):
+        if other.layout() != self.layout():
+            raise ValueError(f"Cannot merge sketches with bins {other.layout()} into {self.layout()}.")
+        self.counts += other.counts
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def copy(self):
+        return LogHistogram.from_dict(self.to_dict())
+
+    def mean(self):
+        return self.total / self.n if self.n else np.nan
+
+    def std(self):
+        if not self.n:
+            return np.nan
+        mean = self.mean()
+        return float(np.sqrt(max(self.total_sq / self.n - mean * mean, 0.0)))
+
+    def cv(self):
+        mean = self.mean()
+        return self.std() / mean if self.n and mean > 0 else 0.0
+
+    def support(self):
+        # One representative value per slot: 0 below lo, geometric bin centres, hi above.
+        return np.concatenate([[0.0], np.sqrt(self.edges[:-1] * self.edges[1:]), [self.hi]])
+
+    def quantile(self, q):
+        # Interpolated log-linearly within the bin, and clipped to the exact min and max.
+        q = np.asarray(q, dtype=np.float64)
+        if not self.n:
+            return np.full(q.shape, np.nan)
+        cumulative = np.cumsum(self.counts)
+        target = q * self.n
+        slot = np.minimum(np.searchsorted(cumulative, target, side='left'), len(self.counts) - 1)
+        before = cumulative[slot] - self.counts[slot]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.clip(np.where(self.counts[slot] > 0, (target - before) / self.counts[slot], 0.0), 0, 1)
+        regular = np.clip(slot - 1, 0, self.n_bins - 1)
+        values = self.edges[regular] * 10.0 ** (fraction / self.bins_per_decade)
+        values = np.where(slot == 0, self.min, np.where(slot == self.n_bins + 1, self.max, values))
+        return np.clip(values, self.min, self.max)
+
+    def density(self, bins_per_decade=None):
+        # (edges, density) of the regular bins, optionally on coarser bins, normalised
+        # by all values so it integrates to the in-range fraction.
+        counts, edges = _coarsen(self.counts, self.edges, self._factor(bins_per_decade))
+        return edges, counts[1:-1] / (max(self.n, 1) * np.diff(edges))
+
+    def _factor(self, bins_per_decade):
+        if bins_per_decade is None:
+            return 1
+        if self.bins_per_decade % bins_per_decade:
+            raise ValueError(f"{bins_per_decade} bins per decade does not divide {self.bins_per_decade}.")
+        return self.bins_per_decade // bins_per_decade
+
+    def to_dict(self):
+        # Plain values for results_io and worker messages.
+        return {'lo': self.lo, 'hi': self.hi, 'bins_per_decade': self.bins_per_decade, 'counts': self.counts.copy(),
+                'total': self.total, 'total_sq': self.total_sq, 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['lo'], data['hi'], data['bins_per_decade'])
+        sketch.counts = np.array(data['counts'], dtype=np.int64)
+        if len(sketch.counts) != sketch.n_bins + 2:
+            raise ValueError(f"Expected {sketch.n_bins + 2} counts, got {len(sketch.counts)}.")
+        sketch.total = float(data['total'])
+        sketch.total_sq = float(data['total_sq'])
+        sketch.min = float(data['min'])
+        sketch.max = float(data['max'])
+        return sketch
+
+
+def merge_sketches(sketches):
+    sketches = list(sketches)
+    merged = sketches[0].copy()
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    return merged
+
+
+def _coarsen(counts, edges, factor):
+    # Sums every `factor` regular bins; the last coarse bin may be narrower.
+    if factor == 1:
+        return counts, edges
+    regular = counts[..., 1:-1]
+    n_coarse = -(-regular.shape[-1] // factor)
+    padded = np.zeros(regular.shape[:-1] + (n_coarse * factor,), dtype=counts.dtype)
+    padded[..., :regular.shape[-1]] = regular
+    coarse = padded.reshape(regular.shape[:-1] + (n_coarse, factor)).sum(axis=-1)
+    coarse_edges = np.append(edges[:-1:factor], edges[-1])
+    return np.concatenate([counts[..., :1], coarse, counts[..., -1:]], axis=-1), coarse_edges
+
+
+# The distances below work on count arrays with any leading batch shape, so the
+# observed sketches and a batch of bootstrap resamples share one code path.
+def _cdf(counts):
+    counts = np.asarray(counts, dtype=np.float64)
+    return np.cumsum(counts, axis=-1) / counts.sum(axis=-1, keepdims=True)
+
+
+def _ks(counts_a, counts_b):
+    return np.max(np.abs(_cdf(counts_a) - _cdf(counts_b)), axis=-1)
+
+
+def _wasserstein(counts_a, counts_b, support):
+    return np.sum(np.abs(_cdf(counts_a) - _cdf(counts_b))[..., :-1] * np.diff(support), axis=-1)
+
+
+def _hellinger(counts_a, counts_b):
+    p = np.asarray(counts_a, dtype=np.float64)
+    q = np.asarray(counts_b, dtype=np.float64)
+    p = p / p.sum(axis=-1, keepdims=True)
+    q = q / q.sum(axis=-1, keepdims=True)
+    return np.sqrt(0.5 * np.sum((np.sqrt(p) - np.sqrt(q)) ** 2, axis=-1))
+
+
+def _check_pair(a, b):
+    if a.layout() != b.layout():
+        raise ValueError(f"Sketches have different bins: {a.layout()} and {b.layout()}.")
+    return a.n > 0 and b.n > 0
+
+
+def ks_distance(a, b):
+    # Largest CDF difference over the bin edges: a lower bound on the exact statistic,
+    # short by at most the larger sample's mass in one bin.
+    return float(_ks(a.counts, b.counts)) if _check_pair(a, b) else None
+
+
+def ks_test(a, b):
+    # (statistic, p-value), the p-value computed as ks_2samp(method='asymp') does:
+    # the one-sample Kolmogorov distribution at the rounded effective sample size.
+    from scipy.stats.distributions import kstwo
+    statistic = ks_distance(a, b)
+    if statistic is None:
+        return None, None
+    en = np.round(a.n * b.n / (a.n + b.n))
+    return statistic, float(np.clip(kstwo.sf(statistic, en), 0, 1))
+
+
+def wasserstein_distance(a, b):
+    # Earth mover's distance in the values' units, with each bin at its centre.
+    return float(_wasserstein(a.counts, b.counts, a.support())) if _check_pair(a, b) else None
+
+
+def log_histogram_distance(a, b, bins_per_decade=10):
+    # Hellinger distance (0 to 1) between the histograms on log-spaced bins,
+    # coarsened to `bins_per_decade` so sparse samples are not dominated by empty bins.
+    if not _check_pair(a, b):
+        return None
+    factor = a._factor(bins_per_decade)
+    return float(_hellinger(_coarsen(a.counts, a.edges, factor)[0], _coarsen(b.counts, b.edges, factor)[0]))
+
+
+def bootstrap_distances(a, b, n_boot=DEFAULT_N_BOOT, ci=0.95, bins_per_decade=10, seed=None):
+    # Percentile intervals of the resampled KS, Wasserstein and log-histogram
+    # distances. Each resample draws a.n and b.n values from the sketches' own
+    # bins with one multinomial call, so the cost depends on the number of bins
+    # and resamples, not on the number of values.
+    if not _check_pair(a, b):
+        return None
+    rng = np.random.default_rng(seed)
+    support = a.support()
+    factor = a._factor(bins_per_decade)
+    p_a = a.counts / a.n
+    p_b = b.counts / b.n
+    samples = {'ks': [], 'wasserstein': [], 'log_histogram': []}
+    for start in range(0, n_boot, BOOT_BATCH):
+        size = min(BOOT_BATCH, n_boot - start)
+        counts_a = rng.multinomial(a.n, p_a, size=size)
+        counts_b = rng.multinomial(b.n, p_b, size=size)
+        samples['ks'].append(_ks(counts_a, counts_b))
+        samples['wasserstein'].append(_wasserstein(counts_a, counts_b, support))
+        samples['log_histogram'].append(_hellinger(_coarsen(counts_a, a.edges, factor)[0],
+                                                   _coarsen(counts_b, b.edges, factor)[0]))
+    observed = {'ks': ks_distance(a, b), 'wasserstein': wasserstein_distance(a, b),
+                'log_histogram': log_histogram_distance(a, b, bins_per_decade)}
+    tails = [50 * (1 - ci), 50 * (1 + ci)]
+    intervals = {}
+    for name, values in samples.items():
+        low, high = np.percentile(np.concatenate(values), tails)
+        intervals[name] = {'value': observed[name], 'low': float(low), 'high': float(high)}
+    return intervals
+
+
+def compare_sketches(a, b, n_boot=DEFAULT_N_BOOT, ci=0.95, bins_per_decade=10, seed=None):
+    # Flat summary of every distance, with bootstrap intervals when n_boot > 0;
+    # None values when either sketch is empty.
+    statistic, p_value = ks_test(a, b)
+    summary = {
+        'ks_statistic': statistic,
+        'p_value': p_value,
+        'wasserstein': wasserstein_distance(a, b),
+        'log_histogram_distance': log_histogram_distance(a, b, bins_per_decade),
+    }
+    intervals = bootstrap_distances(a, b, n_boot, ci, bins_per_decade, seed) if n_boot else None
+    for name in ('ks', 'wasserstein', 'log_histogram'):
+        summary[f'{name}_ci'] = None if intervals is None else [intervals[name]['low'], intervals[name]['high']]
+    return summary
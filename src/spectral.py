@@ -0,0 +1,367 @@
+import logging
+from functools import lru_cache
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FREQUENCY_BANDS = {
+    'delta': (1, 4),
+    'theta': (4, 8),
+    'alpha': (8, 13),
+    'beta': (13, 30),
+    'gamma': (30, 100)
+}
+
+
+def band_powers(freqs, psd, bands=FREQUENCY_BANDS):
+    # Integrates the PSD over each band; psd may carry leading channel axes.
+    df = freqs[1] - freqs[0]
+    powers = {}
+    for band_name, (low, high) in bands.items():
+        mask = (freqs >= low) & (freqs <= high)
+        powers[band_name] = np.maximum(np.sum(psd[..., mask], axis=-1) * df, 1e-10)
+    return powers
+
+
+def hann_window(nperseg):
+    # Periodic Hann, as scipy.signal.get_window('hann', nperseg) returns.
+    return 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(nperseg) / nperseg)
+
+
+class WelchAccumulator:
+    # Running Welch PSD matching scipy.signal.welch(x, fs, nperseg=...) defaults:
+    # periodic Hann window, 50% overlap, constant detrend, one-sided density.
+    # Only the samples of the current, incomplete segment are kept between chunks.
+    def __init__(self, fs, nperseg=None, win_seconds=2, n_channels=None, noverlap=None):
+        self.fs = float(fs)
+        self.nperseg = int(nperseg or fs * win_seconds)
+        self.noverlap = self.nperseg // 2 if noverlap is None else int(noverlap)
+        self.step = self.nperseg - self.noverlap
+        self.window = hann_window(self.nperseg)
+        self.scale = 1.0 / (self.fs * np.sum(self.window ** 2))
+        self.freqs = np.fft.rfftfreq(self.nperseg, 1.0 / self.fs)
+        self.n_channels = n_channels
+        self.n_segments = 0
+        self.n_samples = 0
+        self._psd_sum = None
+        self._buffer = None
+
+    def _ensure_state(self, n_channels):
+        if self._buffer is None:
+            self.n_channels = n_channels
+            self._buffer = np.zeros((n_channels, 0))
+            self._psd_sum = np.zeros((n_channels, len(self.freqs)))
+        elif n_channels != self.n_channels:
+            raise ValueError(f"Expected {self.n_channels} channels, got {n_channels}.")
+
+    def update(self, chunk):
+        # chunk is (samples,) or (channels x samples).
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if chunk.ndim == 1:
+            chunk = chunk[None, :]
+        self._ensure_state(chunk.shape[0])
+        self.n_samples += chunk.shape[1]
+        buffer = np.concatenate([self._buffer, chunk], axis=1) if self._buffer.shape[1] else chunk
+
+        n_new = (buffer.shape[1] - self.nperseg) // self.step + 1 if buffer.shape[1] >= self.nperseg else 0
+        if n_new > 0:
+            segments = np.lib.stride_tricks.sliding_window_view(buffer, self.nperseg, axis=1)[:, ::self.step][:, :n_new]
+            segments = segments - segments.mean(axis=-1, keepdims=True)
+            spectrum = np.fft.rfft(segments * self.window, axis=-1)
+            self._psd_sum += np.sum(spectrum.real ** 2 + spectrum.imag ** 2, axis=1)
+            self.n_segments += n_new
+            buffer = buffer[:, n_new * self.step:]
+        self._buffer = np.array(buffer)
+        return self
+
+    def merge(self, other):
+        # Combines segment sums from another accumulator fed a disjoint stretch of data.
+        if other._psd_sum is None:
+            return self
+        self._ensure_state(other.n_channels)
+        self._psd_sum += other._psd_sum
+        self.n_segments += other.n_segments
+        self.n_samples += other.n_samples
+        return self
+
+    def psd(self):
+        if not self.n_segments:
+            return self.freqs, None
+        psd = self._psd_sum * self.scale / self.n_segments
+        # One-sided: double everything except DC and, for even nperseg, Nyquist.
+        if self.nperseg % 2:
+            psd[:, 1:] *= 2
+        else:
+            psd[:, 1:-1] *= 2
+        return self.freqs, psd if self.n_channels > 1 else psd[0]
+
+    def band_powers(self, bands=FREQUENCY_BANDS):
+        freqs, psd = self.psd()
+        if psd is None:
+            return None
+        powers = band_powers(freqs, psd, bands)
+        if self.n_channels == 1:
+            return {name: float(power) for name, power in powers.items()}
+        return powers
+
+
+def _onesided_density(spectra_product, nperseg, scale):
+    # Density scaling plus the one-sided doubling of every bin but DC (and even-length Nyquist).
+    spectra_product *= scale
+    if nperseg % 2:
+        spectra_product[..., 1:] *= 2
+    else:
+        spectra_product[..., 1:-1] *= 2
+    return spectra_product
+
+
+def _segment_batches(x, channels, nperseg, step, segment_batch, window):
+    # Yields windowed, detrended segment FFTs (channels x segments x freqs) a batch at a time.
+    n_segments = (x.shape[-1] - nperseg) // step + 1 if x.shape[-1] >= nperseg else 0
+    for first in range(0, n_segments, segment_batch):
+        count = min(segment_batch, n_segments - first)
+        start = first * step
+        stop = start + (count - 1) * step + nperseg
+        block = np.asarray(x[channels, start:stop], dtype=np.float64)
+        segments = np.lib.stride_tricks.sliding_window_view(block, nperseg, axis=1)[:, ::step][:, :count]
+        segments = segments - segments.mean(axis=-1, keepdims=True)
+        yield np.fft.rfft(segments * window, axis=-1)
+
+
+def _welch_layout(x, fs, nperseg, noverlap):
+    nperseg = min(int(nperseg), x.shape[-1])
+    noverlap = nperseg // 2 if noverlap is None else int(noverlap)
+    window = hann_window(nperseg)
+    return nperseg, nperseg - noverlap, window, np.fft.rfftfreq(nperseg, 1.0 / fs)
+
+
+def _pair_channels(x, rows, cols):
+    rows = np.arange(x.shape[0]) if rows is None else np.asarray(rows, dtype=np.int64)
+    cols = rows if cols is None else np.asarray(cols, dtype=np.int64)
+    return rows, cols
+
+
+def auto_spectra(x, fs, channels, nperseg=1024, noverlap=None, segment_batch=256):
+    # Welch PSD (channels x freqs) of the given channels, in one pass over the segments.
+    nperseg, step, window, freqs = _welch_layout(x, fs, nperseg, noverlap)
+    psd = np.zeros((len(channels), len(freqs)))
+    n_segments = 0
+    for spectra in _segment_batches(x, channels, nperseg, step, segment_batch, window):
+        psd += np.sum(spectra.real ** 2 + spectra.imag ** 2, axis=1)
+        n_segments += spectra.shape[1]
+    if not n_segments:
+        raise ValueError("Signal is shorter than one segment.")
+    return freqs, _onesided_density(psd, nperseg, 1.0 / (fs * np.sum(window ** 2) * n_segments))
+
+
+def iter_cross_spectra(x, fs, nperseg=1024, rows=None, cols=None, noverlap=None, segment_batch=256, pair_chunk=64):
+    # Welch cross-spectral densities, matching scipy.signal.csd defaults, for
+    # pair_chunk rows at a time: yields (first row, csd of rows[first:first + pair_chunk]
+    # x cols x freqs). Within a block every channel's segment FFTs are computed once
+    # and only segment_batch segments are held; the column channels are
+    # transformed again for each block, which costs far less than the pairs.
+    rows, cols = _pair_channels(x, rows, cols)
+    nperseg, step, window, freqs = _welch_layout(x, fs, nperseg, noverlap)
+    for first in range(0, len(rows), pair_chunk):
+        block_rows = rows[first:first + pair_chunk]
+        channels = np.union1d(block_rows, cols)
+        row_pos, col_pos = np.searchsorted(channels, block_rows), np.searchsorted(channels, cols)
+        # Accumulated as (freqs x rows x cols) so each batch is one batched matmul.
+        csd = np.zeros((len(freqs), len(block_rows), len(cols)), dtype=np.complex128)
+        n_segments = 0
+        for spectra in _segment_batches(x, channels, nperseg, step, segment_batch, window):
+            by_freq = spectra.transpose(2, 0, 1)
+            left = np.ascontiguousarray(by_freq[:, row_pos].conj())
+            right = np.ascontiguousarray(by_freq[:, col_pos].transpose(0, 2, 1))
+            csd += np.matmul(left, right)
+            n_segments += spectra.shape[1]
+        if not n_segments:
+            raise ValueError("Signal is shorter than one segment.")
+        scale = 1.0 / (fs * np.sum(window ** 2) * n_segments)
+        yield first, _onesided_density(csd.transpose(1, 2, 0), nperseg, scale)
+
+
+def cross_spectral_matrix(x, fs, nperseg=1024, rows=None, cols=None, noverlap=None, segment_batch=256,
+                          pair_chunk=64):
+    # The full (rows x cols x freqs) CSD assembled from iter_cross_spectra, plus the
+    # auto-spectra psd (channels x freqs) of the channels involved, indexed like
+    # np.union1d(rows, cols). Use iter_cross_spectra or coherence_matrix when the
+    # complex matrix itself does not need to be kept.
+    rows, cols = _pair_channels(x, rows, cols)
+    channels = np.union1d(rows, cols)
+    freqs, psd = auto_spectra(x, fs, channels, nperseg, noverlap, segment_batch)
+    csd = np.empty((len(rows), len(cols), len(freqs)), dtype=np.complex128)
+    for first, block in iter_cross_spectra(x, fs, nperseg, rows, cols, noverlap, segment_batch, pair_chunk):
+        csd[first:first + len(block)] = block
+    return freqs, csd, psd, channels
+
+
+def coherence_matrix(x, fs, nperseg=1024, rows=None, cols=None, noverlap=None, segment_batch=256,
+                     pair_chunk=64, bands=None):
+    # Magnitude-squared coherence for all row/column pairs, as scipy.signal.coherence:
+    # (rows x cols x freqs), or with `bands` {band: (rows x cols) mean coherence}.
+    # Each block of pair_chunk rows is reduced before the next, so at most one
+    # block of cross-spectra is held.
+    rows, cols = _pair_channels(x, rows, cols)
+    channels = np.union1d(rows, cols)
+    freqs, psd = auto_spectra(x, fs, channels, nperseg, noverlap, segment_batch)
+    pxx = psd[np.searchsorted(channels, rows)]
+    pyy = psd[np.searchsorted(channels, cols)]
+    if bands is None:
+        coherence = np.empty((len(rows), len(cols), len(freqs)))
+    else:
+        coherence = {band_name: np.empty((len(rows), len(cols))) for band_name in bands}
+    for first, csd in iter_cross_spectra(x, fs, nperseg, rows, cols, noverlap, segment_batch, pair_chunk):
+        block = np.abs(csd) ** 2
+        block /= pxx[first:first + len(block), None, :]
+        block /= pyy[None, :, :]
+        if bands is None:
+            coherence[first:first + len(block)] = block
+        else:
+            for band_name, values in band_coherence(freqs, block, bands).items():
+                coherence[band_name][first:first + len(block)] = values
+    return freqs, coherence
+
+
+def band_coherence(freqs, coherence, bands=FREQUENCY_BANDS):
+    # Mean coherence inside each band, one (rows x cols) matrix per band.
+    summary = {}
+    for band_name, (low, high) in bands.items():
+        mask = (freqs >= low) & (freqs <= high)
+        summary[band_name] = coherence[..., mask].mean(axis=-1)
+    return summary
+
+
+@lru_cache(maxsize=None)
+def design_band_sos(low, high, fs, order=5):
+    # Second-order sections stay stable for narrow low bands where (b, a) does not.
+    from scipy.signal import butter
+    return butter(order, [low, high], btype='band', fs=fs, output='sos')
+
+
+class FilterBank:
+    # Zero-phase Butterworth band-pass filters for several bands, designed once per
+    # (band, fs, order). Each chunk of input is read once and run through every band;
+    # chunks are padded with `overlap` samples of neighbouring data on both sides so
+    # the filter transients fall outside the part that is kept.
+    def __init__(self, fs, bands=FREQUENCY_BANDS, order=5):
+        self.fs = float(fs)
+        self.order = order
+        nyquist = 0.5 * self.fs
+        # Bands reaching Nyquist are clipped just below it.
+        self.bands = {name: (low, min(high, 0.99 * nyquist)) for name, (low, high) in bands.items() if low < nyquist}
+        self.sos = {name: design_band_sos(low, high, self.fs, order) for name, (low, high) in self.bands.items()}
+
+    def default_overlap(self):
+        # Ten cycles of the lowest band edge.
+        return int(np.ceil(10 * self.fs / min(low for low, _ in self.bands.values())))
+
+    def _chunks(self, n_samples, chunk_size, overlap):
+        if chunk_size is None or chunk_size >= n_samples:
+            yield 0, n_samples, 0, n_samples
+            return
+        overlap = self.default_overlap() if overlap is None else overlap
+        for start in range(0, n_samples, chunk_size):
+            stop = min(start + chunk_size, n_samples)
+            yield start, stop, max(0, start - overlap), min(n_samples, stop + overlap)
+
+    def _filter_block(self, sos, block):
+        from scipy.signal import sosfiltfilt
+        padlen = min(3 * (2 * len(sos) + 1), block.shape[-1] - 1)
+        return sosfiltfilt(sos, block, axis=-1, padlen=padlen)
+
+    def _analytic_block(self, filtered, at_start, at_end, edge):
+        # The FFT behind hilbert() wraps the block's end onto its start. Blocks at
+        # the signal's ends are extended by `edge` mirrored samples there, as inner
+        # blocks are by neighbouring data, so the wrap stays outside the kept part
+        # and chunked and whole-signal envelopes agree at the edges too.
+        from scipy.signal import hilbert
+        edge = min(edge, filtered.shape[-1] - 1)
+        before, after = (edge if at_start else 0), (edge if at_end else 0)
+        if before or after:
+            widths = [(0, 0)] * (filtered.ndim - 1) + [(before, after)]
+            filtered = np.pad(filtered, widths, mode='reflect')
+        signal = hilbert(filtered, axis=-1)
+        return signal[..., before:signal.shape[-1] - after]
+
+    def filter(self, x, chunk_size=None, overlap=None, analytic=False):
+        # x is (samples,) or (channels x samples); returns {band: filtered} with the same
+        # shape, or {band: (amplitude, phase)} of the Hilbert analytic signal.
+        n_samples = x.shape[-1]
+        edge = self.default_overlap() if overlap is None else overlap
+        outputs = {}
+        for name in self.bands:
+            if analytic:
+                outputs[name] = (np.empty(x.shape), np.empty(x.shape))
+            else:
+                outputs[name] = np.empty(x.shape)
+        for start, stop, pad_start, pad_stop in self._chunks(n_samples, chunk_size, overlap):
+            block = np.asarray(x[..., pad_start:pad_stop], dtype=np.float64)
+            keep = slice(start - pad_start, stop - pad_start)
+            for name, sos in self.sos.items():
+                filtered = self._filter_block(sos, block)
+                if analytic:
+                    signal = self._analytic_block(filtered, pad_start == 0, pad_stop == n_samples, edge)[..., keep]
+                    outputs[name][0][..., start:stop] = np.abs(signal)
+                    outputs[name][1][..., start:stop] = np.angle(signal)
+                else:
+                    outputs[name][..., start:stop] = filtered[..., keep]
+        return outputs
+
+    def envelopes(self, x, chunk_size=None, overlap=None):
+        return self.filter(x, chunk_size, overlap, analytic=True)
+
+
+def modulation_index(phase, amplitude, n_bins=18):
+    # Tort et al. (2010) phase-amplitude coupling: KL divergence of the
+    # phase-binned mean amplitude from uniform, normalised by log(n_bins).
+    bins = np.clip(((phase + np.pi) / (2 * np.pi) * n_bins).astype(np.int64), 0, n_bins - 1)
+    flat_bins = bins.reshape(-1, bins.shape[-1]) if bins.ndim > 1 else bins[None, :]
+    flat_amplitude = amplitude.reshape(flat_bins.shape)
+    offsets = np.arange(flat_bins.shape[0])[:, None] * n_bins
+    sums = np.bincount((flat_bins + offsets).ravel(), weights=flat_amplitude.ravel(),
+                       minlength=flat_bins.shape[0] * n_bins).reshape(-1, n_bins)
+    counts = np.bincount((flat_bins + offsets).ravel(), minlength=flat_bins.shape[0] * n_bins).reshape(-1, n_bins)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_amplitude = np.where(counts > 0, sums / counts, 0.0)
+        p = mean_amplitude / mean_amplitude.sum(axis=1, keepdims=True)
+        kl = np.log(n_bins) + np.sum(np.where(p > 0, p * np.log(p), 0.0), axis=1)
+    mi = kl / np.log(n_bins)
+    return float(mi[0]) if phase.ndim == 1 else mi.reshape(phase.shape[:-1])
+
+
+def welch_from_chunks(chunks, fs, win_seconds=2):
+    # Same return value as analysis.analyze_lfp_bands, fed from an iterable of chunks.
+    accumulator = WelchAccumulator(fs, win_seconds=win_seconds)
+    for chunk in chunks:
+        if isinstance(chunk, tuple):
+            chunk = chunk[1]
+        accumulator.update(chunk)
+    if not accumulator.n_segments:
+        logger.warning("LFP data is too short for the requested window size. Skipping analysis.")
+        return None
+    freqs, psd = accumulator.psd()
+    return freqs, psd, accumulator.band_powers()
+
+
+def psd_network_operation(accumulator, sample, dt, flush_every=None):
+    # Feeds sample() (a scalar or per-channel vector) into the accumulator every dt
+    # during a Brian2 run; only flush_every samples are buffered in between.
+    from brian2 import network_operation
+
+    flush_every = flush_every or accumulator.step
+    pending = []
+
+    @network_operation(dt=dt, name='psd_accumulator')
+    def accumulate_psd():
+        pending.append(np.asarray(sample(), dtype=np.float64))
+        if len(pending) >= flush_every:
+            flush()
+
+    def flush():
+        if pending:
+            accumulator.update(np.stack(pending, axis=-1))
+            pending.clear()
+
+    accumulate_psd.flush = flush
+    return accumulate_psd
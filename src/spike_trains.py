@@ -0,0 +1,165 @@
+from collections.abc import Mapping
+import numpy as np
+
+
+class SpikeTrains(Mapping):
+    # Spike trains of many units as one flat array of times (in seconds), sorted
+    # within each unit, plus offsets so unit k owns times[offsets[k]:offsets[k + 1]].
+    # Behaves as a read-only {unit_id: times} mapping; the statistics below are
+    # computed over the flat arrays without per-unit Python loops.
+    def __init__(self, times, offsets, unit_ids=None, t_start=None, t_stop=None):
+        self.times = times
+        self.offsets = offsets
+        self.unit_ids = np.arange(len(offsets) - 1) if unit_ids is None else unit_ids
+        self.t_start = t_start
+        self.t_stop = t_stop
+        self._index = None
+
+    @classmethod
+    def from_arrays(cls, times, indices, n_units=None, unit_ids=None, t_start=None, t_stop=None):
+        times = np.asarray(times, dtype=np.float64)
+        indices = np.asarray(indices, dtype=np.int64)
+        if n_units is None:
+            n_units = len(unit_ids) if unit_ids is not None else (int(indices.max()) + 1 if len(indices) else 0)
+        if len(times) < 2 or np.all(times[1:] >= times[:-1]):
+            # Monitor output is already in time order, so a stable sort by unit keeps it.
+            order = np.argsort(indices, kind='stable')
+        else:
+            order = np.lexsort((times, indices))
+        offsets = np.zeros(n_units + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices, minlength=n_units), out=offsets[1:])
+        return cls(times[order], offsets, unit_ids, t_start, t_stop)
+
+    @classmethod
+    def from_spike_monitor(cls, spike_monitor, t_start=0.0, t_stop=None):
+        t_stop = float(np.asarray(spike_monitor.clock.t_)) if t_stop is None else float(t_stop)
+        return cls.from_arrays(spike_monitor.t_, spike_monitor.i, n_units=len(spike_monitor.source),
+                               t_start=float(t_start), t_stop=t_stop)
+
+    @classmethod
+    def from_dict(cls, spike_times, t_start=None, t_stop=None):
+        if isinstance(spike_times, SpikeTrains):
+            return spike_times
+        unit_ids = np.fromiter(spike_times.keys(), dtype=np.int64, count=len(spike_times))
+        trains = [np.asarray(train, dtype=np.float64) for train in spike_times.values()]
+        counts = np.fromiter((len(train) for train in trains), dtype=np.int64, count=len(trains))
+        offsets = np.zeros(len(trains) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        times = np.concatenate(trains) if trains else np.zeros(0)
+        indices = np.repeat(np.arange(len(trains)), counts)
+        return cls.from_arrays(times, indices, n_units=len(trains), unit_ids=unit_ids,
+                               t_start=t_start, t_stop=t_stop)
+
+    def __getitem__(self, unit_id):
+        if self._index is None:
+            self._index = {int(u): k for k, u in enumerate(self.unit_ids)}
+        k = self._index[int(unit_id)]
+        return self.times[self.offsets[k]:self.offsets[k + 1]]
+
+    def __iter__(self):
+        return (int(unit_id) for unit_id in self.unit_ids)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def n_units(self):
+        return len(self)
+
+    @property
+    def counts(self):
+        return np.diff(self.offsets)
+
+    @property
+    def duration(self):
+        if self.t_start is None or self.t_stop is None:
+            return None
+        return self.t_stop - self.t_start
+
+    def unit_index(self):
+        return np.repeat(np.arange(self.n_units), self.counts)
+
+    def _isi_mask(self):
+        # ISIs are diffs of the flat array, minus those straddling two units.
+        mask = np.ones(max(len(self.times) - 1, 0), dtype=bool)
+        boundaries = self.offsets[1:-1] - 1
+        mask[boundaries[(boundaries >= 0) & (boundaries < len(mask))]] = False
+        return mask
+
+    def isis(self, max_isi=None, return_units=False):
+        mask = self._isi_mask()
+        isis = np.diff(self.times)[mask]
+        units = self.unit_index()[1:][mask] if return_units else None
+        if max_isi is not None:
+            keep = isis < max_isi
+            isis = isis[keep]
+            units = units[keep] if return_units else None
+        return (isis, units) if return_units else isis
+
+    def iter_isis(self, max_isi=None, chunk_size=1_000_000):
+        # isis() in blocks of at most chunk_size, reading that many times at a time,
+        # so memory-mapped trains of any length are never loaded whole.
+        boundaries = self.offsets[1:-1] - 1
+        for start in range(0, max(len(self.times) - 1, 0), chunk_size):
+            stop = min(start + chunk_size + 1, len(self.times))
+            isis = np.diff(np.asarray(self.times[start:stop]))
+            mask = np.ones(len(isis), dtype=bool)
+            inside = boundaries[np.searchsorted(boundaries, start):np.searchsorted(boundaries, stop - 1)]
+            mask[inside - start] = False
+            if max_isi is not None:
+                mask &= isis < max_isi
+            yield isis[mask]
+
+    def rates(self, duration=None):
+        # Without a known duration, each unit's own first-to-last spike span is
+        # used, as get_probe_data does for Allen units.
+        counts = self.counts.astype(np.float64)
+        duration = self.duration if duration is None else duration
+        if duration is not None:
+            return counts / duration
+        if not len(self.times):
+            return np.full(self.n_units, np.nan)
+        first = self.times[np.minimum(self.offsets[:-1], max(len(self.times) - 1, 0))]
+        last = self.times[np.maximum(self.offsets[1:] - 1, 0)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(counts > 1, counts / (last - first), np.nan)
+
+    def isi_moments(self):
+        isis, units = self.isis(return_units=True)
+        n = np.bincount(units, minlength=self.n_units).astype(np.float64)
+        total = np.bincount(units, weights=isis, minlength=self.n_units)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = total / n
+            var = np.bincount(units, weights=(isis - mean[units]) ** 2, minlength=self.n_units) / n
+        return n, mean, var
+
+    def cv(self):
+        n, mean, var = self.isi_moments()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(n > 1, np.sqrt(var) / mean, np.nan)
+
+    def binned_counts(self, bin_size, t_start=None, t_stop=None):
+        t_start = self.t_start if t_start is None else t_start
+        t_stop = self.t_stop if t_stop is None else t_stop
+        if t_start is None or t_stop is None:
+            raise ValueError("t_start and t_stop are needed to bin spike trains.")
+        n_bins = int(np.ceil((t_stop - t_start) / bin_size))
+        bins = np.floor((self.times - t_start) / bin_size).astype(np.int64)
+        keep = (bins >= 0) & (bins < n_bins)
+        flat = self.unit_index()[keep] * n_bins + bins[keep]
+        return np.bincount(flat, minlength=self.n_units * n_bins).reshape(self.n_units, n_bins)
+
+    def fano_factor(self, bin_size, t_start=None, t_stop=None):
+        counts = self.binned_counts(bin_size, t_start, t_stop)
+        mean = counts.mean(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(mean > 0, counts.var(axis=1) / mean, np.nan)
+
+    def select(self, units):
+        # Subset of units (by position), kept in the given order.
+        units = np.asarray(units, dtype=np.int64)
+        counts = self.counts[units]
+        offsets = np.zeros(len(units) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        take = np.repeat(self.offsets[:-1][units] - offsets[:-1], counts) + np.arange(offsets[-1])
+        return SpikeTrains(self.times[take], offsets, np.asarray(self.unit_ids)[units], self.t_start, self.t_stop)
@@ -0,0 +1,18 @@
+import sys
+
+# Script entry points call skip_pylab() before anything imports brian2. brian2's
+# package __init__ runs `from pylab import *`, which loads matplotlib.pyplot (about
+# half a second) on every run, plotting or not. With pylab marked unavailable
+# brian2 falls back to its numpy-only imports; plotting code imports
+# matplotlib.pyplot itself when it first draws a figure.
+
+
+def skip_pylab():
+    if 'brian2' not in sys.modules:
+        sys.modules.setdefault('pylab', None)
+
+
+def heavy_modules():
+    # The optional heavy dependencies that are currently loaded, for import-time checks.
+    return sorted(name for name in ('matplotlib.pyplot', 'scipy.signal', 'scipy.stats', 'pandas', 'allensdk', 'h5py')
+                  if name in sys.modules)
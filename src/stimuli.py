@@ -10,3 +10,9 @@ def generate_oscillatory_input(freq, duration, noise=0.1):
 def generate_stimulus_sequence(duration, n_items=10):
     stimulus_sequence = np.random.randint(2, size=n_items)
     return TimedArray(stimulus_sequence, dt=duration / len(stimulus_sequence))
+
+def generate_stimulus_sequences(duration, rngs, n_items=10, scale=1):
+    # One binary sequence per generator, as an (n_items x replicas) TimedArray read
+    # as stimulus(t, replica); scale is a scalar or one value per replica.
+    sequences = np.stack([rng.integers(2, size=n_items) for rng in rngs], axis=1)
+    return TimedArray(sequences * scale, dt=duration / n_items)
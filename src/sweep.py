@@ -0,0 +1,94 @@
+import os
+import sys
+import itertools
+import importlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SCRIPTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+_worker = {'slot': None}
+BLAS_THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+
+def expand_grid(grid):
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def point_seed(base_seed, index):
+    return int(np.random.SeedSequence([base_seed, index]).generate_state(1)[0] % (2**31 - 1))
+
+
+def resolve_target(spec):
+    module_name, _, attr = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def _init_worker(slot_counter, backend, cache_dir):
+    for path in (REPO_DIR, SCRIPTS_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    with slot_counter.get_lock():
+        _worker['slot'] = slot_counter.value
+        slot_counter.value += 1
+
+    from src.backend import configure_backend, DEFAULT_CACHE_DIR
+    # Standalone projects are written in place, so workers must not share directories.
+    configure_backend(backend, os.path.join(cache_dir or DEFAULT_CACHE_DIR, f"worker-{_worker['slot']}"))
+
+
+def _run_point(target, reducer, index, params, point_seed_value, target_kwargs):
+    from brian2 import seed
+    seed(point_seed_value)
+    np.random.seed(point_seed_value)
+    output = resolve_target(target)(**params, **target_kwargs)
+    if reducer is not None:
+        output = resolve_target(reducer)(output)
+    return index, output
+
+
+def run_sweep(target, grid, reducer=None, n_workers=None, base_seed=0, backend='numpy', cache_dir=None,
+              target_kwargs=None):
+    # target_kwargs are passed to every point but are not part of its parameters.
+    points = expand_grid(grid) if isinstance(grid, dict) else list(grid)
+    n_workers = min(n_workers or os.cpu_count() or 1, len(points)) or 1
+    logger.info(f"Running {len(points)} sweep points on {n_workers} workers.")
+
+    context = multiprocessing.get_context('spawn')
+    slot_counter = context.Value('i', 0)
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(slot_counter, backend, cache_dir)) as pool:
+        # One BLAS thread per worker; the pool provides the parallelism. Workers
+        # inherit the environment when they start, which is at submit time, and
+        # load numpy before any initializer runs, so the variables are set here
+        # and restored once every worker is up.
+        saved = {var: os.environ.get(var) for var in BLAS_THREAD_VARIABLES}
+        for var in BLAS_THREAD_VARIABLES:
+            os.environ.setdefault(var, '1')
+        try:
+            futures = {
+                pool.submit(_run_point, target, reducer, index, params, point_seed(base_seed, index),
+                            target_kwargs or {}): index
+                for index, params in enumerate(points)
+            }
+        finally:
+            for var, value in saved.items():
+                if value is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = value
+        for future in as_completed(futures):
+            index, output = future.result()
+            yield index, points[index], output
+
+
+def collect_sweep(*args, **kwargs):
+    ordered = {index: (params, output) for index, params, output in run_sweep(*args, **kwargs)}
+    return [ordered[index] for index in sorted(ordered)]
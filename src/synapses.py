@@ -21,3 +21,18 @@ STDP_PARAMS = {
         w = clip(w + apre, 0, 1)
     '''
 }
+
+# Same rule with both trace increments scaled by (1 + dopamine) at the postsynaptic
+# neuron, which declares dopamine as a model variable (see src/neuromodulation.py).
+DOPAMINE_STDP_PARAMS = {
+    **STDP_PARAMS,
+    'on_pre': '''
+        v_post += w * 10*mV
+        apre += A_pre * (1 + dopamine_post)
+        w = clip(w + apost, 0, 1)
+    ''',
+    'on_post': '''
+        apost += A_post * (1 + dopamine_post)
+        w = clip(w + apre, 0, 1)
+    '''
+}
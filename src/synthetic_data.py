@@ -0,0 +1,70 @@
+import numpy as np
+
+
+class SyntheticLFP:
+    # Mimics the xarray DataArray returned by EcephysSession.get_lfp.
+    class _Coord:
+        def __init__(self, values):
+            self.values = values
+
+        def __len__(self):
+            return len(self.values)
+
+    def __init__(self, values, times, channels):
+        self.values = values
+        self.coords = {'time': self._Coord(times), 'channel': self._Coord(channels)}
+        self.time = self.coords['time']
+        self.channel = self.coords['channel']
+
+    def __getitem__(self, key):
+        return self.coords[key]
+
+
+class SyntheticSession:
+    def __init__(self, session_id, probes, units, channels, spike_times, lfp):
+        self.ecephys_session_id = session_id
+        self.probes = probes
+        self.units = units
+        self.channels = channels
+        self.spike_times = spike_times
+        self._lfp = lfp
+
+    def get_lfp(self, probe_id):
+        return self._lfp[probe_id]
+
+
+def make_synthetic_session(session_id=1, n_probes=1, n_units=40, n_channels=8, duration=20.0,
+                           lfp_fs=1250.0, mean_rate=5.0, seed=0):
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    probe_ids = [1000 + p for p in range(n_probes)]
+
+    unit_rows, spike_times = [], {}
+    channel_rows, lfp = [], {}
+    t = np.arange(int(duration * lfp_fs)) / lfp_fs
+    for p, probe_id in enumerate(probe_ids):
+        for u in range(n_units):
+            unit_id = 10000 * (p + 1) + u
+            rate = rng.gamma(2.0, mean_rate / 2.0)
+            n_spikes = rng.poisson(rate * duration)
+            spike_times[unit_id] = np.sort(rng.uniform(0, duration, n_spikes))
+            unit_rows.append({'unit_id': unit_id, 'probe_id': probe_id,
+                              'firing_rate': n_spikes / duration})
+
+        channel_ids = [100000 * (p + 1) + c for c in range(n_channels)]
+        for c, channel_id in enumerate(channel_ids):
+            channel_rows.append({'channel_id': channel_id, 'probe_id': probe_id,
+                                 'probe_vertical_position': 20 * c})
+        # Theta and gamma rhythms with channel-dependent amplitude plus noise.
+        depth = np.linspace(0, 1, n_channels)[None, :]
+        values = (np.sin(2 * np.pi * 6 * t)[:, None] * (1 - depth)
+                  + 0.3 * np.sin(2 * np.pi * 40 * t)[:, None] * depth
+                  + 0.2 * rng.standard_normal((len(t), n_channels)))
+        lfp[probe_id] = SyntheticLFP(values.astype(np.float32), t, np.array(channel_ids))
+
+    probes = pd.DataFrame({'description': [f'probe{p}' for p in range(n_probes)]},
+                          index=pd.Index(probe_ids, name='id'))
+    units = pd.DataFrame(unit_rows).set_index('unit_id')
+    channels = pd.DataFrame(channel_rows).set_index('channel_id')
+    return SyntheticSession(session_id, probes, units, channels, spike_times, lfp)
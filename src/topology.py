@@ -0,0 +1,123 @@
+import os
+import logging
+import numpy as np
+from brian2 import Quantity, second
+
+from src.fingerprint import fingerprint
+from src.results_io import save_results, load_results, read_metadata
+
+logger = logging.getLogger(__name__)
+
+# A topology is a results directory (see results_io) holding
+#   nodes: {population: {'n': int, 'model': str, 'params': {variable: array}}}
+#   edges: {projection: {'source_population', 'target_population',
+#                        'source', 'target', 'weight', 'delay', 'weight_unit'}}
+# with source/target as int32 indices into the populations, weight in the base
+# SI unit named by weight_unit and delay in seconds. Arrays are memory-mapped on
+# load, so a large circuit is only read as Brian2 copies it into the Synapses.
+TOPOLOGY_FORMAT = 'synmodel-topology'
+TOPOLOGY_VERSION = 1
+DEFAULT_TOPOLOGY_DIR = os.path.join(os.path.dirname(__file__), '..', 'topology_cache')
+
+
+def topology_key(name, *parts):
+    return fingerprint('topology', TOPOLOGY_VERSION, name, *parts)
+
+
+def node_population(n, model='', **params):
+    return {'n': int(n), 'model': str(model), 'params': {k: np.asarray(v) for k, v in params.items()}}
+
+
+def edge_population(source_population, target_population, source, target, weight=None, delay=None,
+                    weight_unit='1'):
+    # weight and delay may be scalars or per-edge arrays (Quantities are stored in base SI units).
+    source = np.asarray(source, dtype=np.int32)
+    edges = {
+        'source_population': source_population,
+        'target_population': target_population,
+        'source': source,
+        'target': np.asarray(target, dtype=np.int32),
+        'weight_unit': weight_unit,
+    }
+    for key, value in (('weight', weight), ('delay', delay)):
+        if value is not None:
+            edges[key] = np.broadcast_to(np.asarray(value, dtype=np.float64), source.shape).copy()
+    return edges
+
+
+def save_topology(path, nodes, edges, key=None, **metadata):
+    for name, edge in edges.items():
+        for end in ('source', 'target'):
+            population = edge[f'{end}_population']
+            if population not in nodes:
+                raise ValueError(f"Edge population '{name}' refers to unknown node population '{population}'.")
+            if len(edge[end]) and edge[end].max() >= nodes[population]['n']:
+                raise ValueError(f"Edge population '{name}' has {end} indices beyond '{population}'.")
+    meta = {'format': TOPOLOGY_FORMAT, 'version': TOPOLOGY_VERSION, 'fingerprint': key, **metadata}
+    path = save_results(path, {'nodes': nodes, 'edges': edges}, metadata=meta)
+    logger.info(f"Saved topology with {sum(len(e['source']) for e in edges.values())} edges to {path}.")
+    return path
+
+
+def is_topology(path):
+    try:
+        return read_metadata(path)['metadata'].get('format') == TOPOLOGY_FORMAT
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def load_topology(path, key=None):
+    meta = read_metadata(path)['metadata']
+    if meta.get('format') != TOPOLOGY_FORMAT or meta.get('version') != TOPOLOGY_VERSION:
+        raise ValueError(f"{path} is not a version {TOPOLOGY_VERSION} topology.")
+    if key is not None and meta.get('fingerprint') != key:
+        raise ValueError(f"{path} was written for topology {meta.get('fingerprint')}, not {key}.")
+    topology = load_results(path, mmap=True)
+    topology['fingerprint'] = meta.get('fingerprint')
+    return topology
+
+
+def load_or_create_topology(path, generate, key=None, **metadata):
+    # generate() -> (nodes, edges), called only when there is no topology at path yet.
+    if not is_topology(path):
+        logger.info(f"No topology at {path}; generating it.")
+        nodes, edges = generate()
+        save_topology(path, nodes, edges, key=key, **metadata)
+    return load_topology(path, key)
+
+
+def get_topology(cache_dir, name, key, generate):
+    return load_or_create_topology(os.path.join(cache_dir, f'{name}-{key}'), generate, key, name=name)
+
+
+def check_population(topology, population, n):
+    found = topology['nodes'][population]['n']
+    if found != n:
+        raise ValueError(f"Topology population '{population}' has {found} nodes, the model has {n}.")
+
+
+def set_node_params(group, population):
+    for variable, values in population['params'].items():
+        setattr(group, variable, Quantity(np.asarray(values), dim=group.variables[variable].dim))
+
+
+def uniform_delay(edges):
+    # A single delay for the whole projection, which Brian2 handles more cheaply
+    # than per-synapse delays; None if there is no delay or it varies.
+    delay = edges.get('delay')
+    if delay is None or len(delay) == 0 or np.ptp(delay) > 0:
+        return None
+    return float(delay[0])
+
+
+def connect_from_edges(synapses, edges, weight=None):
+    # Creates all synapses with one connect() call and sets their weights and
+    # (heterogeneous) delays as whole arrays.
+    if len(edges['source']) > 0:
+        synapses.connect(i=np.asarray(edges['source']), j=np.asarray(edges['target']))
+    if weight is not None and 'weight' in edges:
+        dim = synapses.variables[weight].dim
+        setattr(synapses, weight, Quantity(np.asarray(edges['weight']), dim=dim))
+    if 'delay' in edges and uniform_delay(edges) is None and len(edges['source']) > 0:
+        synapses.delay = np.asarray(edges['delay']) * second
+    return len(edges['source'])
@@ -0,0 +1,319 @@
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import logging
+import subprocess
+import threading
+import socketserver
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+
+from src.fingerprint import fingerprint
+from src.results_io import results_to_bytes, results_from_bytes
+from src.sweep import REPO_DIR, SCRIPTS_DIR, resolve_target
+
+logger = logging.getLogger(__name__)
+
+# A worker is a long-lived process that keeps Brian2 imported and the models it has
+# built (with their generated and compiled code) in memory. Each model is stored
+# right after it is built; later requests for the same structure restore that
+# snapshot, set their branchable parameters and run, so they skip equation
+# parsing, code generation and compilation.
+#
+# Models: build(**params) -> {'network', 'outputs'[, 'run_kwargs', 'summary_kwargs']};
+# apply(model, variant) sets branchable parameters on a built or restored model;
+# summarize(outputs, **summary_kwargs) turns the monitors into plain arrays.
+MODELS = {
+    'one_back': {
+        'build': 'one_back_task_simulation:build_one_back_task',
+        'apply': 'one_back_task_simulation:apply_one_back_variant',
+        'summarize': 'one_back_task_simulation:summarize_one_back_task',
+        'branchable': 'one_back_task_simulation:BRANCHABLE_PARAMETERS',
+    },
+    'neuromodulation': {
+        'build': 'neuromodulation_demo:build_neuromodulation_demo',
+        'apply': 'neuromodulation_demo:apply_neuromodulation_variant',
+        'summarize': 'neuromodulation_demo:summarize_neuromodulation_demo',
+        'branchable': 'neuromodulation_demo:BRANCHABLE_PARAMETERS',
+    },
+}
+
+SNAPSHOT = 'worker'
+DEFAULT_SOCKET_DIR = os.path.join(REPO_DIR, 'results', 'workers')
+# Built models kept per worker; the least recently used one is dropped beyond this.
+DEFAULT_MAX_MODELS = 8
+STARTUP_TIMEOUT = 60.0
+
+_worker = {'models': OrderedDict(), 'max_models': DEFAULT_MAX_MODELS, 'served': 0, 'lock': threading.Lock()}
+
+
+def _add_script_paths():
+    for path in (REPO_DIR, SCRIPTS_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+# Messages are an 8-byte little-endian length followed by the payload: a JSON
+# request from the client, results_to_bytes() output from the worker.
+def send_message(sock, payload):
+    sock.sendall(struct.pack('<Q', len(payload)) + payload)
+
+
+def _recv_exactly(sock, n_bytes):
+    buffer = bytearray(n_bytes)
+    view = memoryview(buffer)
+    received = 0
+    while received < n_bytes:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("Connection closed mid-message.")
+        received += n
+    return buffer
+
+
+def recv_message(sock):
+    header = sock.recv(8, socket.MSG_WAITALL)
+    if not header:
+        return None
+    if len(header) < 8:
+        raise ConnectionError("Connection closed mid-message.")
+    (length,) = struct.unpack('<Q', header)
+    return _recv_exactly(sock, length)
+
+
+# Quantities travel as SI values plus Brian2's seven dimension exponents, so
+# requests stay plain JSON and units survive exactly.
+def encode_value(value):
+    if hasattr(value, 'dim'):
+        return {'quantity': np.asarray(value).tolist(), 'dims': list(value.dim._dims)}
+    if isinstance(value, dict):
+        return {str(k): encode_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(v) for v in value]
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, dict) and set(value) == {'quantity', 'dims'}:
+        from brian2 import Quantity
+        from brian2.units.fundamentalunits import get_or_create_dimension
+        return Quantity(np.asarray(value['quantity'], dtype=float), dim=get_or_create_dimension(value['dims']))
+    if isinstance(value, dict):
+        return {k: decode_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    return value
+
+
+def model_key(model, params):
+    # Branchable parameters only enter the key by shape: any values of them run on
+    # the same built network. Computed the same way by clients, to pick a worker.
+    spec = MODELS[model]
+    _add_script_paths()
+    branchable = resolve_target(spec['branchable'])
+    structural = {k: v for k, v in params.items() if k not in branchable}
+    shapes = {k: np.shape(v) for k, v in params.items() if k in branchable}
+    return fingerprint('worker', model, structural, shapes)
+
+
+def _get_model(model, params, key):
+    from src.recording import clear_buffer
+    models = _worker['models']
+    if key in models:
+        built = models.pop(key)
+        models[key] = built
+        built['network'].restore(SNAPSHOT)
+        for output in built['outputs']:
+            clear_buffer(output)
+        return built, True
+    built = resolve_target(MODELS[model]['build'])(**params)
+    built['network'].store(SNAPSHOT)
+    models[key] = built
+    while len(models) > _worker['max_models']:
+        dropped, _ = models.popitem(last=False)
+        logger.info(f"Dropped built model {dropped}.")
+    return built, False
+
+
+def simulate(request):
+    # request: {'model', 'duration' (seconds), 'params', 'recording', 'seed'}. The seed
+    # covers the run's noise; a reused model starts from the state it was built with.
+    from brian2 import seed, second
+    from src.backend import run_network
+    model = request['model']
+    if model not in MODELS:
+        raise ValueError(f"Unknown model '{model}'; known models are {', '.join(sorted(MODELS))}.")
+    duration = float(request['duration']) * second
+    params = {**decode_value(request.get('params') or {}), 'duration': duration}
+    if request.get('recording') is not None:
+        params['recording'] = decode_value(request['recording'])
+    key = model_key(model, params)
+
+    start = time.perf_counter()
+    if request.get('seed') is not None:
+        seed(request['seed'])
+        np.random.seed(request['seed'])
+    built, reused = _get_model(model, params, key)
+    if request.get('seed') is not None:
+        # Seeded again so the run draws the same noise whether or not the model was just built.
+        seed(request['seed'])
+        np.random.seed(request['seed'])
+    spec = MODELS[model]
+    branchable = resolve_target(spec['branchable'])
+    resolve_target(spec['apply'])(built, {k: v for k, v in params.items() if k in branchable})
+    timings = run_network(built['network'], duration, **built.get('run_kwargs', {}))
+    summary = resolve_target(spec['summarize'])(built['outputs'], **built.get('summary_kwargs', {}))
+    _worker['served'] += 1
+    info = {
+        'model': model,
+        'key': key,
+        'reused': reused,
+        'pid': os.getpid(),
+        'served': _worker['served'],
+        'build_s': timings['build'],
+        'run_s': timings['run'],
+        'wall_s': time.perf_counter() - start,
+    }
+    logger.info(f"{model} {key} ({'reused' if reused else 'built'}): {info['wall_s']:.2f} s, "
+                f"run {info['run_s']:.2f} s.")
+    return summary, info
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    # One connection may carry any number of requests, answered in order.
+    def handle(self):
+        while True:
+            message = recv_message(self.request)
+            if message is None:
+                return
+            try:
+                with _worker['lock']:
+                    summary, info = simulate(json.loads(bytes(message).decode('utf-8')))
+                payload = results_to_bytes(summary, metadata=info)
+            except Exception as e:
+                logger.exception("Request failed.")
+                payload = results_to_bytes({}, metadata={'error': f"{type(e).__name__}: {e}"})
+            send_message(self.request, payload)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path, max_models=DEFAULT_MAX_MODELS):
+    # Connections are accepted concurrently but simulations run one at a time:
+    # Brian2 state is per process, so a pool of workers (start_workers) provides
+    # the parallelism.
+    from src.backend import current_backend
+    if current_backend() == 'cpp_standalone':
+        raise ValueError("Workers restore built networks, which needs a runtime backend (numpy or cython).")
+    _add_script_paths()
+    _worker['max_models'] = max_models
+    # Every model's module is imported before the first request arrives.
+    for spec in MODELS.values():
+        resolve_target(spec['build'])
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    with _Server(socket_path, _Handler) as server:
+        logger.info(f"Simulation worker {os.getpid()} listening on {socket_path}.")
+        try:
+            server.serve_forever()
+        finally:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+def connect(socket_path, timeout=None):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    sock.connect(socket_path)
+    return sock
+
+
+def request_simulation(socket_path, model, duration, params=None, recording=None, seed=None, sock=None,
+                       timeout=None):
+    # Returns (summary, info). duration is a Quantity or seconds; pass an open `sock`
+    # from connect() to send many requests over one connection.
+    request = {
+        'model': model,
+        'duration': float(np.asarray(duration)),
+        'params': encode_value(params or {}),
+        'recording': encode_value(recording),
+        'seed': seed,
+    }
+    own = sock is None
+    sock = connect(socket_path, timeout) if own else sock
+    try:
+        send_message(sock, json.dumps(request).encode('utf-8'))
+        message = recv_message(sock)
+    finally:
+        if own:
+            sock.close()
+    if message is None:
+        raise ConnectionError(f"Worker at {socket_path} closed the connection.")
+    summary, info = results_from_bytes(message)
+    if 'error' in info:
+        raise RuntimeError(f"Worker at {socket_path}: {info['error']}")
+    return summary, info
+
+
+def worker_sockets(socket_dir, n_workers):
+    return [os.path.join(socket_dir, f'worker-{slot}.sock') for slot in range(n_workers)]
+
+
+def start_workers(n_workers, socket_dir=DEFAULT_SOCKET_DIR, backend='numpy', cache_dir=None,
+                  max_models=DEFAULT_MAX_MODELS):
+    # Launches scripts/simulation_worker.py once per slot and waits for every socket.
+    from src.backend import DEFAULT_CACHE_DIR
+    os.makedirs(socket_dir, exist_ok=True)
+    workers = []
+    for slot, path in enumerate(worker_sockets(socket_dir, n_workers)):
+        if os.path.exists(path):
+            os.remove(path)
+        command = [sys.executable, os.path.join(SCRIPTS_DIR, 'simulation_worker.py'), '--socket', path,
+                   '--backend', backend, '--max-models', str(max_models),
+                   # Per-slot build directories, as for sweep workers.
+                   '--cache-dir', os.path.join(cache_dir or DEFAULT_CACHE_DIR, f'worker-{slot}')]
+        workers.append({'socket': path, 'process': subprocess.Popen(command)})
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    for worker in workers:
+        while not os.path.exists(worker['socket']):
+            if worker['process'].poll() is not None or time.monotonic() > deadline:
+                stop_workers(workers)
+                raise RuntimeError(f"Worker for {worker['socket']} did not start.")
+            time.sleep(0.05)
+    logger.info(f"Started {n_workers} simulation workers in {socket_dir}.")
+    return workers
+
+
+def stop_workers(workers):
+    for worker in workers:
+        worker['process'].terminate()
+    for worker in workers:
+        worker['process'].wait()
+
+
+def pick_worker(sockets, model, params):
+    # Requests for the same built model always go to the same worker, where it is warm.
+    return sockets[int(model_key(model, params), 16) % len(sockets)]
+
+
+def simulate_many(sockets, requests, n_threads=None):
+    # requests: dicts of request_simulation keyword arguments. Yields (index, summary,
+    # info) as they finish; each worker runs one request at a time.
+    def run(request):
+        params = {**(request.get('params') or {}), 'duration': float(np.asarray(request['duration']))}
+        return request_simulation(pick_worker(sockets, request['model'], params), **request)
+
+    with ThreadPoolExecutor(max_workers=n_threads or len(sockets)) as pool:
+        futures = {pool.submit(run, request): index for index, request in enumerate(requests)}
+        for future in as_completed(futures):
+            summary, info = future.result()
+            yield futures[future], summary, info
@@ -0,0 +1,117 @@
+import json
+import os
+import numpy as np
+import pytest
+
+from src.allen_cache import (extract_probe, load_probe_cache, find_cached_probe, get_cached_probe_data,
+                             cache_fingerprint, session_fingerprint)
+from src.lfp import iter_lfp_chunks, read_lfp, open_nwb_lfp
+from src.results_io import load_results, read_metadata
+from src.synthetic_data import make_synthetic_session
+
+PROBE_ID = 1000
+
+
+def small_session(seed=0):
+    return make_synthetic_session(n_units=12, n_channels=6, duration=4.0, seed=seed)
+
+
+def stored_fingerprint(path):
+    return read_metadata(path)['metadata']['fingerprint']
+
+
+def test_cache_round_trip(tmp_path):
+    session = small_session()
+    path = extract_probe(session, PROBE_ID, str(tmp_path))
+    probe_data = load_probe_cache(path)
+
+    kept = [u for u in session.units.index if len(session.spike_times[u]) > 1]
+    assert list(probe_data['spike_times']) == kept
+    for unit_id in kept:
+        np.testing.assert_array_equal(probe_data['spike_times'][unit_id], np.sort(session.spike_times[unit_id]))
+    lfp = session.get_lfp(PROBE_ID)
+    np.testing.assert_array_equal(probe_data['lfp_source']['data'], lfp.values)
+    np.testing.assert_allclose(load_results(path)['lfp']['channel_rms'],
+                               np.sqrt(np.mean(lfp.values.astype(np.float64) ** 2, axis=0)))
+
+    assert stored_fingerprint(path) == cache_fingerprint(path) == session_fingerprint(session, PROBE_ID)
+    assert find_cached_probe(str(tmp_path)) == path
+
+
+def test_cache_with_wrong_fingerprint_is_rebuilt(tmp_path):
+    session = small_session()
+    path = extract_probe(session, PROBE_ID, str(tmp_path))
+    meta_path = os.path.join(path, 'meta.json')
+    with open(meta_path) as f:
+        meta = json.load(f)
+    meta['metadata']['fingerprint'] = '0' * 16
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+    assert find_cached_probe(str(tmp_path)) is None
+    probe_data = get_cached_probe_data(str(tmp_path), session=session)
+    assert probe_data['fingerprint'] == session_fingerprint(session, PROBE_ID)
+    assert find_cached_probe(str(tmp_path)) == path
+
+
+def test_cache_from_other_data_is_rebuilt(tmp_path):
+    extract_probe(small_session(seed=0), PROBE_ID, str(tmp_path))
+    session = small_session(seed=1)
+    expected = session_fingerprint(session, PROBE_ID)
+    assert find_cached_probe(str(tmp_path), expected=expected) is None
+
+    # Same unit and channel ids, so only the opt-in data check tells them apart.
+    assert get_cached_probe_data(str(tmp_path), session=session)['fingerprint'] != expected
+    probe_data = get_cached_probe_data(str(tmp_path), session=session, verify_data=True)
+    assert probe_data['fingerprint'] == expected
+    counts = [len(train) for train in probe_data['spike_times'].values()]
+    assert counts == [len(session.spike_times[u]) for u in session.units.index if len(session.spike_times[u]) > 1]
+
+
+def test_nwb_lfp_streams_and_maps_electrode_rows(tmp_path):
+    h5py = pytest.importorskip('h5py')
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((500, 3)).astype(np.float32)
+    nwb_path = str(tmp_path / 'probe_7_lfp.nwb')
+    with h5py.File(nwb_path, 'w') as f:
+        electrodes = f.create_group('general/extracellular_ephys/electrodes')
+        electrodes['id'] = np.array([500, 501, 502])
+        electrodes['probe_vertical_position'] = np.array([0.0, 20.0, 40.0])
+        series = f.create_group('acquisition/probe_7_lfp/probe_7_lfp_data')
+        series['data'] = data
+        series['timestamps'] = np.arange(500) / 1250.0
+        # Rows of the electrodes table, not channel ids.
+        series['electrodes'] = np.array([2, 0, 1])
+
+    chunks = list(iter_lfp_chunks(nwb_path, chunk_size=128))
+    assert max(block.shape[1] for _, block in chunks) == 128
+    times, values = read_lfp(nwb_path, channels=[0, 2], probe_id=7)
+    np.testing.assert_array_equal(values, data[:, [0, 2]].T)
+    _, values = read_lfp(nwb_path, channels=[2, 0], probe_id=7)
+    np.testing.assert_array_equal(values, data[:, [2, 0]].T)
+    np.testing.assert_allclose(times, np.arange(500) / 1250.0)
+    assert len(h5py.h5f.get_obj_ids(types=h5py.h5f.OBJ_FILE)) == 0
+
+    with open_nwb_lfp(nwb_path) as source:
+        np.testing.assert_array_equal(source['channel_ids'], [502, 500, 501])
+        np.testing.assert_array_equal(source['depths'], [40.0, 0.0, 20.0])
+
+
+class NoSpikeReads(dict):
+    def __getitem__(self, key):
+        raise AssertionError("the cache check read a spike train")
+
+
+def test_cache_check_reads_only_session_tables(tmp_path):
+    session = small_session()
+    path = extract_probe(session, PROBE_ID, str(tmp_path))
+    spike_times = session.spike_times
+    session.spike_times = NoSpikeReads()
+    assert get_cached_probe_data(str(tmp_path), session=session)['fingerprint'] == stored_fingerprint(path)
+
+    # A session whose probe has other units is extracted again.
+    session.spike_times = spike_times
+    session.units = session.units.drop(session.units.index[0])
+    probe_data = get_cached_probe_data(str(tmp_path), session=session)
+    assert len(probe_data['spike_times']) == sum(len(session.spike_times[u]) > 1 for u in session.units.index)
+    assert probe_data['fingerprint'] == session_fingerprint(session, PROBE_ID)
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from brian2 import (Network, NeuronGroup, PoissonGroup, SpikeMonitor, Synapses, Hz, ms, second,
+                    defaultclock, seed)
+
+from src.backend import configure_backend
+from src.checkpoint import read_checkpoint_metadata, run_branches, run_with_checkpoints, warm_up
+
+
+@pytest.fixture(autouse=True)
+def numpy_backend():
+    configure_backend('numpy')
+    defaultclock.dt = 0.1 * ms
+
+
+def build_network(noise=True):
+    # Fixed names, since a checkpoint is restored by object name.
+    seed(1234)
+    equations = 'dv/dt = (drive - v) / (10*ms) + sigma * xi / sqrt(10*ms) : 1\ndrive : 1\nsigma : 1'
+    neurons = NeuronGroup(20, equations, threshold='v > 1', reset='v = 0', method='euler', name='neurons')
+    neurons.drive = np.linspace(0.8, 1.4, 20)
+    neurons.sigma = 0.3 if noise else 0.0
+    # Without noise the network is deterministic, so branches can be compared
+    # although they do not restore the random state.
+    inputs = PoissonGroup(20, (50 if noise else 0) * Hz, name='inputs')
+    synapses = Synapses(inputs, neurons, on_pre='v += 0.2', delay=2 * ms, name='synapses')
+    synapses.connect(p=0.3)
+    spikes = SpikeMonitor(neurons, name='spikes')
+    net = Network(neurons, inputs, synapses, spikes)
+    return net, neurons, spikes
+
+
+def spike_trains(monitor):
+    return np.asarray(monitor.i[:]), np.asarray(monitor.t[:] / second)
+
+
+def assert_same_spikes(a, b):
+    np.testing.assert_array_equal(a[0], b[0])
+    np.testing.assert_allclose(a[1], b[1])
+
+
+def test_resume_reproduces_uninterrupted_run(tmp_path):
+    net, _, spikes = build_network()
+    run_with_checkpoints(net, 60 * ms, str(tmp_path / 'full.pkl'), 20 * ms)
+    expected = spike_trains(spikes)
+    assert len(expected[0]) > 0
+
+    # The interrupted run stops after its first checkpoint.
+    path = str(tmp_path / 'run.pkl')
+    net, _, spikes = build_network()
+    run_with_checkpoints(net, 20 * ms, path, 20 * ms, key='model')
+    assert read_checkpoint_metadata(path)['fingerprint'] == 'model'
+
+    net, _, spikes = build_network()
+    run_with_checkpoints(net, 60 * ms, path, 20 * ms, resume=True, key='model')
+    assert float(net.t / ms) == pytest.approx(60)
+    assert_same_spikes(spike_trains(spikes), expected)
+
+    net, _, _ = build_network()
+    with pytest.raises(ValueError):
+        run_with_checkpoints(net, 60 * ms, path, 20 * ms, resume=True, key='other model')
+
+
+def test_branches_match_runs_from_a_stored_warm_up(tmp_path):
+    path = str(tmp_path / 'warmup.pkl')
+    variants = [1.1, 1.4]
+
+    def branch_spikes(use_path):
+        net, neurons, spikes = build_network(noise=False)
+        warm_up(net, 20 * ms, use_path)
+        # Monitors are off during the burn-in.
+        assert spikes.num_spikes == 0
+
+        def apply_variant(drive):
+            neurons.drive = drive
+        return [collected for _, _, collected in
+                run_branches(net, 30 * ms, variants, apply_variant, lambda: spike_trains(spikes), use_path)]
+
+    in_memory = branch_spikes(None)
+    stored = branch_spikes(path)
+    # The second call restores the stored burn-in instead of simulating it.
+    restored = branch_spikes(path)
+    assert read_checkpoint_metadata(path)['warmup'] == pytest.approx(0.02)
+
+    for index, drive in enumerate(variants):
+        net, neurons, spikes = build_network(noise=False)
+        net.run(20 * ms)
+        neurons.drive = drive
+        start = spikes.num_spikes
+        net.run(30 * ms)
+        expected = spike_trains(spikes)
+        expected = expected[0][start:], expected[1][start:]
+        assert len(expected[0]) > 0
+        for branches in (in_memory, stored, restored):
+            assert_same_spikes(branches[index], expected)
+        assert np.all(in_memory[index][1] >= 0.02)
+
+    net, _, _ = build_network(noise=False)
+    with pytest.raises(ValueError):
+        warm_up(net, 10 * ms, path)
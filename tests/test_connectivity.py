@@ -0,0 +1,54 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import numpy as np
+
+from benchmarks.bench_connectivity import legacy_ring
+from src.connectivity import ring_local_distant, fixed_indegree
+
+
+def split_edges(n, i, j, radius=10):
+    # Per-source out-degrees of the local [i - radius, i + radius) and distant |i - j| > radius edges.
+    i, j = np.asarray(i, dtype=np.int64), np.asarray(j, dtype=np.int64)
+    local = (j >= i - radius) & (j < i + radius) & (j != i)
+    distant = np.abs(i - j) > radius
+    assert np.all(local | distant), "edge outside both rules"
+    return np.bincount(i[local], minlength=n), np.bincount(i[distant], minlength=n)
+
+
+def test_ring_matches_legacy_degrees():
+    n = 150
+    np.random.seed(0)
+    legacy = np.array(legacy_ring(n))
+    i, j = ring_local_distant(n, rng=np.random.default_rng(0))
+    assert len(np.unique(i.astype(np.int64) * n + j)) == len(i)
+    for new, old in zip(split_edges(n, i, j), split_edges(n, legacy[:, 0], legacy[:, 1])):
+        np.testing.assert_array_equal(new, old)
+
+
+def test_ring_edge_probabilities():
+    # Every candidate target is drawn with the legacy probability count / candidates.
+    n, trials = 40, 400
+    rng = np.random.default_rng(1)
+    frequency = np.zeros((n, n))
+    for _ in range(trials):
+        i, j = ring_local_distant(n, p_distant=0.2, rng=rng)
+        frequency[i, j] += 1
+    frequency /= trials
+    sources = np.arange(n)[:, None]
+    targets = np.arange(n)[None, :]
+    local = (targets >= sources - 10) & (targets < sources + 10) & (targets != sources)
+    distant = np.abs(sources - targets) > 10
+    n_local = local.sum(axis=1, keepdims=True)
+    n_distant = distant.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = np.where(local, (n_local * 0.3).astype(int) / n_local, 0.0)
+        expected += np.where(distant, (n_distant * 0.2).astype(int) / n_distant, 0.0)
+    assert np.all(frequency[~(local | distant)] == 0)
+    np.testing.assert_allclose(frequency, expected, atol=0.1)
+
+
+def test_fixed_indegree_counts():
+    i, j = fixed_indegree(50, 30, 7, allow_autapses=False, rng=np.random.default_rng(2))
+    np.testing.assert_array_equal(np.bincount(j, minlength=30), 7)
+    assert len(np.unique(i.astype(np.int64) * 30 + j)) == len(i)
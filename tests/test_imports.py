@@ -0,0 +1,14 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import pytest
+
+from benchmarks.run_benchmarks import IMPORT_BUDGET_S, IMPORT_MODULES, measure_import
+
+
+# Each entry point is imported in a fresh interpreter, as a run would start it.
+@pytest.mark.parametrize('module', IMPORT_MODULES)
+def test_entry_point_imports_light(module):
+    result = measure_import(module, repeat=2)
+    assert result['heavy_modules'] == []
+    assert result['import_s'] <= IMPORT_BUDGET_S
@@ -0,0 +1,40 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import numpy as np
+import pytest
+
+from src.lfp import read_lfp, iter_lfp_chunks, select_lfp_channels
+
+
+@pytest.fixture
+def source():
+    data = np.random.default_rng(0).standard_normal((300, 6)).astype(np.float32)
+    return {'data': data, 'times': np.arange(300) / 1000.0, 'channel_ids': np.arange(6) + 100,
+            'depths': np.arange(6) * 20.0, 'fs': 1000.0}
+
+
+def test_channels_keep_requested_order(source):
+    for channels in ([4, 1, 5], [2, 3, 4], [5, 4, 3], [0]):
+        _, values = read_lfp(source, channels=channels, chunk_size=64)
+        np.testing.assert_array_equal(values, source['data'][:, channels].T)
+
+
+def test_depth_range_filters_in_order(source):
+    np.testing.assert_array_equal(select_lfp_channels(source, [5, 0, 2, 3], depth_range=(30, 100)), [5, 2, 3])
+    np.testing.assert_array_equal(select_lfp_channels(source, depth_range=(20, 40)), [1, 2])
+
+
+def test_window_and_chunks(source):
+    chunks = list(iter_lfp_chunks(source, channels=[3, 1], window=(0.05, 0.2), chunk_size=40))
+    assert max(block.shape[1] for _, block in chunks) == 40
+    times = np.concatenate([t for t, _ in chunks])
+    values = np.concatenate([block for _, block in chunks], axis=1)
+    np.testing.assert_allclose(times, np.arange(50, 200) / 1000.0)
+    np.testing.assert_array_equal(values, source['data'][50:200][:, [3, 1]].T)
+
+
+@pytest.mark.parametrize('channels', [[1, 1], [6], [-1]])
+def test_invalid_channels(source, channels):
+    with pytest.raises(ValueError):
+        select_lfp_channels(source, channels)
@@ -0,0 +1,30 @@
+import numpy as np
+
+from src.plotting import raster_image
+
+
+def test_every_spike_lands_in_the_default_window():
+    rng = np.random.default_rng(0)
+    times = np.sort(rng.uniform(0, 2.0, 5000))
+    indices = rng.integers(0, 300, len(times))
+    image, (t_start, t_stop) = raster_image(times, indices, 300, time_bins=100, unit_bins=30)
+    assert image.sum() == len(times)
+    assert t_stop > times.max()
+    # The latest spike goes into the last time bin, in its unit's row.
+    assert image[indices[-1] * 30 // 300, -1] >= 1
+
+
+def test_window_counts_spikes_up_to_the_run_duration():
+    dt = 1e-4
+    times = np.array([0.0, 0.05, 0.2 - dt, 0.2, -dt])
+    indices = np.array([0, 1, 2, 3, 4])
+    image, _ = raster_image(times, indices, 5, 0.0, 0.2, time_bins=50, unit_bins=5)
+    # A spike in the last step counts; one at t_stop or before t_start does not.
+    np.testing.assert_array_equal(image.sum(axis=1), [1, 1, 1, 0, 0])
+    assert image[2, -1] == 1
+
+
+def test_empty_raster():
+    image, window = raster_image([], [], 10, time_bins=20, unit_bins=5)
+    assert image.shape == (5, 20) and image.sum() == 0
+    assert window[1] > window[0]
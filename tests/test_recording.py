@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from src.recording import select_indices
+
+
+def stratum_counts(indices, strata):
+    return np.bincount(np.asarray(strata)[indices], minlength=max(strata) + 1)
+
+
+def test_stratified_counts_follow_stratum_sizes():
+    strata = np.repeat([0, 1, 2, 3], [50, 30, 15, 5])
+    indices = select_indices(len(strata), {'n': 10, 'select': 'stratified', 'strata': strata, 'seed': 0})
+    assert len(np.unique(indices)) == 10
+    np.testing.assert_array_equal(stratum_counts(indices, strata), [5, 3, 1, 1])
+
+
+def test_stratified_small_strata_do_not_crowd_out_the_last_labels():
+    # Rounding 1.8 up for each large stratum used to overshoot k, and truncating
+    # the sorted sample then dropped the last labels.
+    strata = np.repeat([0, 1, 2, 3, 4, 5], [10, 10, 10, 1, 1, 1])
+    indices = select_indices(len(strata), {'n': 6, 'select': 'stratified', 'strata': strata, 'seed': 0})
+    np.testing.assert_array_equal(stratum_counts(indices, strata), [1, 1, 1, 1, 1, 1])
+    indices = select_indices(len(strata), {'n': 9, 'select': 'stratified', 'strata': strata, 'seed': 0})
+    np.testing.assert_array_equal(stratum_counts(indices, strata), [2, 2, 2, 1, 1, 1])
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_stratified_quotas_add_up(seed):
+    rng = np.random.default_rng(seed)
+    strata = rng.integers(0, rng.integers(1, 12), rng.integers(1, 200))
+    n = len(strata)
+    sizes = np.bincount(strata)
+    k = int(rng.integers(0, n + 5))
+    indices = select_indices(n, {'n': k, 'select': 'stratified', 'strata': strata, 'seed': seed})
+    counts = stratum_counts(indices, strata)
+    assert len(np.unique(indices)) == len(indices) == min(k, n)
+    assert np.all(counts <= sizes)
+    present = sizes > 0
+    if min(k, n) >= present.sum():
+        assert np.all(counts[present] >= 1)
+        ideal = min(k, n) * sizes / n
+        if np.all(ideal[present] >= 1):
+            # No stratum needs its minimum of one, so each count is its share rounded.
+            assert np.all(np.abs(counts - ideal) < 1)
+    else:
+        assert np.all(counts <= 1)
+
+
+def test_stratified_without_labels_spreads_over_the_index_range():
+    indices = select_indices(100, {'fraction': 0.1, 'select': 'stratified', 'seed': 3})
+    np.testing.assert_array_equal(indices // 10, np.arange(10))
+
+
+def test_unranked_strata_are_dropped_at_random():
+    # With fewer picks than strata, every label gets chosen for some seed.
+    strata = np.repeat(np.arange(5), 4)
+    chosen = np.zeros(5)
+    for seed in range(40):
+        chosen += stratum_counts(select_indices(20, {'n': 2, 'select': 'stratified', 'strata': strata, 'seed': seed}),
+                                 strata)
+    assert np.all(chosen > 0)
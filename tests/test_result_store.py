@@ -0,0 +1,103 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from src import result_store
+from src.result_store import (cached_result, code_version, latest_result, list_store, lookup_result, prune_store,
+                              result_key, result_path, store_result)
+from src.results_io import save_results
+from scripts.results import analyze_and_combine_results
+
+REPO_DIR = os.path.join(os.path.dirname(__file__), '..')
+
+
+def test_result_keys_are_stable():
+    config = {'rate': 5.0, 'layers': ['exc', 'inh']}
+    key = result_key('run', config, seed=1, data_fingerprint='abc')
+    assert result_key('run', dict(reversed(list(config.items()))), seed=1, data_fingerprint='abc') == key
+    # Other processes (with their own hash seeds) derive the same key.
+    script = ("from src.result_store import result_key; "
+              "print(result_key('run', {'rate': 5.0, 'layers': ['exc', 'inh']}, seed=1, data_fingerprint='abc'))")
+    output = subprocess.run([sys.executable, '-c', script], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == key
+    for other in (result_key('run', config, seed=2, data_fingerprint='abc'),
+                  result_key('run', {**config, 'rate': 6.0}, seed=1, data_fingerprint='abc'),
+                  result_key('run', config, seed=1, data_fingerprint='abd'),
+                  result_key('other', config, seed=1, data_fingerprint='abc')):
+        assert other != key
+
+
+def test_code_change_gives_new_keys(monkeypatch):
+    key = result_key('run', {}, seed=0)
+    monkeypatch.setattr(result_store, 'code_version', lambda: 'edited')
+    assert result_key('run', {}, seed=0) != key
+
+
+def test_cached_result_reuses_stored_runs(tmp_path):
+    store = str(tmp_path)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'rates': np.arange(len(calls) + 2.0), 'count': len(calls)}
+    results, found = cached_result(store, 'run', 'k1', compute, seed=1)
+    assert not found and results['count'] == 1
+    results, found = cached_result(store, 'run', 'k1', compute, seed=1)
+    assert found and results['count'] == 1 and len(calls) == 1
+    np.testing.assert_array_equal(results['rates'], [0.0, 1.0, 2.0])
+    # reuse=False (--rerun) simulates again and replaces the entry.
+    cached_result(store, 'run', 'k1', compute, reuse=False, seed=1)
+    assert lookup_result(store, 'run', 'k1')['count'] == 2
+    assert lookup_result(store, 'run', 'missing') is None
+
+
+def test_unseeded_runs_are_never_reused_and_only_the_latest_kept(tmp_path):
+    store = str(tmp_path)
+    cached_result(store, 'run', 'seeded', lambda: {'n': 0}, seed=1)
+    for index in range(3):
+        results, found = cached_result(store, 'run', f'unseeded{index}', lambda: {'n': index + 1},
+                                       reproducible=False, created=100.0 + index)
+        assert not found
+    _, found = cached_result(store, 'run', 'unseeded2', lambda: {'n': 9}, reproducible=False, created=200.0)
+    assert not found
+    cached_result(store, 'other', 'unseeded', lambda: {'n': 5}, reproducible=False)
+    kept = sorted((meta['name'], meta['key']) for meta in list_store(store))
+    assert kept == [('other', 'unseeded'), ('run', 'seeded'), ('run', 'unseeded2')]
+    assert lookup_result(store, 'run', 'unseeded2')['n'] == 9
+
+
+def test_entries_of_another_format_or_key_are_ignored(tmp_path):
+    store = str(tmp_path)
+    save_results(result_path(store, 'run', 'k1'), {'n': 1}, metadata={'format': 'something-else', 'key': 'k1'})
+    assert lookup_result(store, 'run', 'k1') is None
+    assert list_store(store) == []
+    results, found = cached_result(store, 'run', 'k1', lambda: {'n': 2})
+    assert not found and lookup_result(store, 'run', 'k1')['n'] == 2
+
+    # An entry copied under the wrong name is not returned for that key.
+    save_results(result_path(store, 'run', 'k2'), {'n': 3},
+                 metadata={'format': result_store.STORE_FORMAT, 'key': 'k3'})
+    assert lookup_result(store, 'run', 'k2') is None
+
+
+def test_latest_result_and_results_script_use_current_code(tmp_path):
+    store = str(tmp_path)
+    store_result(store, 'run_simulation', 'current', {'summary': {'sim_mean_rate': 1.0}}, created=100.0)
+    store_result(store, 'run_simulation', 'old', {'summary': {'sim_mean_rate': 2.0}}, created=200.0,
+                 code_version='old code')
+    store_result(store, 'adex_simulation_demo', 'old', {'voltage': np.zeros(3)}, created=300.0,
+                 code_version='old code')
+    assert latest_result(store, 'run_simulation')['summary']['sim_mean_rate'] == 2.0
+    assert latest_result(store, 'run_simulation', current_code=True)['summary']['sim_mean_rate'] == 1.0
+    assert latest_result(store, 'adex_simulation_demo', current_code=True) is None
+
+    combined = analyze_and_combine_results(store)
+    assert set(combined) == {'run_simulation_summary'}
+    assert combined['run_simulation_summary']['sim_mean_rate'] == 1.0
+
+    removed = prune_store(store, current_code=True)
+    assert len(removed) == 2
+    assert [meta['code_version'] for meta in list_store(store)] == [code_version()]
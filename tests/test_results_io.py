@@ -0,0 +1,80 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import numpy as np
+import pytest
+
+from src.results_io import save_results, load_results, results_to_bytes, results_from_bytes, is_results_dir
+
+
+def sample_results():
+    return {
+        'spikes': np.arange(100, dtype=np.int32),
+        'trace': np.linspace(0, 1, 50).reshape(5, 10),
+        'rate': 4.5,
+        'label': 'run',
+        'short': [1, 2, 3],
+        'nested': {'inner': {'values': np.ones(20), 'count': 3}, 'flag': True},
+    }
+
+
+def check_sample(loaded):
+    np.testing.assert_array_equal(loaded['spikes'], np.arange(100))
+    assert loaded['spikes'].dtype == np.int32
+    np.testing.assert_array_equal(loaded['trace'], np.linspace(0, 1, 50).reshape(5, 10))
+    assert loaded['rate'] == 4.5 and loaded['label'] == 'run' and loaded['short'] == [1, 2, 3]
+    np.testing.assert_array_equal(loaded['nested']['inner']['values'], np.ones(20))
+    assert loaded['nested']['inner']['count'] == 3 and loaded['nested']['flag'] is True
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_round_trip(tmp_path, compress):
+    path = save_results(str(tmp_path / 'run'), sample_results(), compress=compress, metadata={'seed': 1})
+    check_sample(load_results(path))
+    check_sample(load_results(path, mmap=False))
+
+
+def test_round_trip_bytes():
+    results, metadata = results_from_bytes(results_to_bytes(sample_results(), metadata={'seed': 1}))
+    check_sample(results)
+    assert metadata == {'seed': 1}
+
+
+def test_quantities(tmp_path):
+    from brian2 import ms, mV, Quantity
+    path = save_results(str(tmp_path / 'run'), {'dt': 0.1 * ms, 'v': np.linspace(-70, -50, 30) * mV, 'n': 3})
+    plain = load_results(path)
+    assert plain['dt'] == pytest.approx(1e-4) and not isinstance(plain['dt'], Quantity)
+    np.testing.assert_allclose(plain['v'], np.linspace(-0.07, -0.05, 30))
+    loaded = load_results(path, units=True)
+    assert isinstance(loaded['dt'], Quantity) and loaded['dt'].dim == ms.dim
+    assert abs(float((loaded['dt'] - 0.1 * ms) / ms)) < 1e-12
+    assert loaded['v'].dim == mV.dim
+    np.testing.assert_allclose(np.asarray(loaded['v'] / mV), np.linspace(-70, -50, 30))
+    assert loaded['n'] == 3
+
+
+def test_keys_round_trip(tmp_path):
+    results = {'a/b': {'c%2F': np.arange(20), 'x': 1}, 'levels': {0.5: np.zeros(20), 1: 'one', False: 2.0}}
+    for loaded in (load_results(save_results(str(tmp_path / 'run'), results)),
+                   results_from_bytes(results_to_bytes(results))[0]):
+        assert set(loaded) == {'a/b', 'levels'}
+        np.testing.assert_array_equal(loaded['a/b']['c%2F'], np.arange(20))
+        assert loaded['a/b']['x'] == 1
+        assert set(loaded['levels']) == {0.5, 1, False} and all(type(k) is not str for k in loaded['levels'])
+        assert loaded['levels'][1] == 'one' and loaded['levels'][False] == 2.0
+
+
+def test_rejected_keys(tmp_path):
+    with pytest.raises(TypeError):
+        save_results(str(tmp_path / 'run'), {(1, 2): 3})
+    with pytest.raises(ValueError):
+        save_results(str(tmp_path / 'run'), {1: 'a', '1': 'b'})
+
+
+def test_overwrite_replaces(tmp_path):
+    path = str(tmp_path / 'run')
+    save_results(path, {'value': 1})
+    save_results(path, {'value': 2})
+    assert load_results(path) == {'value': 2}
+    assert sorted(os.listdir(tmp_path)) == ['run'] and is_results_dir(path)
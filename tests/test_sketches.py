@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from src.sketches import (LogHistogram, compare_sketches, ks_distance, ks_test, merge_sketches, wasserstein_distance)
+
+
+@pytest.fixture
+def samples():
+    rng = np.random.default_rng(0)
+    return rng.lognormal(np.log(0.05), 1.0, 4000), rng.lognormal(np.log(0.06), 0.8, 3000)
+
+
+def sketch(values, **layout):
+    return LogHistogram(**layout).update(values)
+
+
+def test_merged_chunks_equal_one_sketch(samples):
+    values = np.concatenate([samples[0], [0.0, np.nan, np.inf, 5e3]])
+    whole = sketch(values)
+    merged = merge_sketches([sketch(chunk) for chunk in np.array_split(values, 7)])
+    np.testing.assert_array_equal(merged.counts, whole.counts)
+    assert merged.n == len(samples[0]) + 2
+    assert merged.mean() == pytest.approx(whole.mean())
+    assert merged.std() == pytest.approx(whole.std())
+    assert (merged.min, merged.max) == (0.0, 5e3)
+    with pytest.raises(ValueError):
+        whole.merge(LogHistogram(bins_per_decade=50))
+
+
+def test_dict_round_trip(samples):
+    original = sketch(samples[0], lo=1e-3, hi=10.0, bins_per_decade=20)
+    restored = LogHistogram.from_dict(original.to_dict())
+    assert restored.layout() == original.layout()
+    np.testing.assert_array_equal(restored.counts, original.counts)
+    assert (restored.total, restored.total_sq, restored.min, restored.max) == \
+        (original.total, original.total_sq, original.min, original.max)
+    data = original.to_dict()
+    data['counts'] = data['counts'][:-1]
+    with pytest.raises(ValueError):
+        LogHistogram.from_dict(data)
+
+
+def test_quantiles_within_one_bin(samples):
+    values = samples[0]
+    s = sketch(values)
+    q = np.array([0.01, 0.1, 0.5, 0.9, 0.99])
+    width = 10.0 ** (1 / s.bins_per_decade)
+    ratio = s.quantile(q) / np.quantile(values, q)
+    assert np.all((ratio > 1 / width) & (ratio < width))
+    assert s.quantile(0.0) == values.min() and s.quantile(1.0) == values.max()
+    assert np.isnan(LogHistogram().quantile(0.5))
+
+
+def test_distances_match_scipy(samples):
+    stats = pytest.importorskip('scipy.stats')
+    a, b = sketch(samples[0]), sketch(samples[1])
+    expected = stats.ks_2samp(samples[0], samples[1], method='asymp')
+    # Evaluated at bin edges, the statistic is low by at most one bin's mass.
+    bin_mass = max(np.max(a.counts) / a.n, np.max(b.counts) / b.n)
+    assert expected.statistic - bin_mass <= ks_distance(a, b) <= expected.statistic + 1e-12
+    wasserstein = stats.wasserstein_distance(samples[0], samples[1])
+    assert wasserstein_distance(a, b) == pytest.approx(wasserstein, rel=1e-3)
+
+
+@pytest.mark.parametrize('sizes', [(30, 40), (500, 800), (4000, 3000)])
+def test_ks_test_matches_scipy(sizes):
+    stats = pytest.importorskip('scipy.stats')
+    rng = np.random.default_rng(sizes[0])
+    # Values at bin centres, where the binned statistic is exact.
+    centres = LogHistogram().support()[1:-1]
+    x = centres[np.clip(rng.normal(400, 60, sizes[0]).astype(int), 0, len(centres) - 1)]
+    y = centres[np.clip(rng.normal(420, 60, sizes[1]).astype(int), 0, len(centres) - 1)]
+    statistic, p_value = ks_test(sketch(x), sketch(y))
+    expected = stats.ks_2samp(x, y, method='asymp')
+    assert statistic == pytest.approx(expected.statistic)
+    assert p_value == pytest.approx(expected.pvalue)
+
+
+def test_empty_sketches_compare_as_none(samples):
+    summary = compare_sketches(sketch(samples[0]), LogHistogram(), n_boot=10)
+    assert summary['ks_statistic'] is None and summary['p_value'] is None and summary['ks_ci'] is None
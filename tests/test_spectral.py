@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from src.spectral import FREQUENCY_BANDS, FilterBank, band_coherence, coherence_matrix, cross_spectral_matrix
+
+
+@pytest.fixture
+def signals():
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((7, 5000))
+    x[3] += x[1]
+    return x
+
+
+def test_coherence_blocks_match_scipy(signals):
+    scipy_signal = pytest.importorskip('scipy.signal')
+    _, expected = scipy_signal.coherence(signals[1], signals[3], 1000, nperseg=256)
+    freqs, coherence = coherence_matrix(signals, 1000, nperseg=256, pair_chunk=3)
+    np.testing.assert_allclose(coherence[1, 3], expected)
+    _, block = coherence_matrix(signals, 1000, nperseg=256, rows=[5, 1], cols=[3, 0], pair_chunk=1)
+    np.testing.assert_allclose(block[1, 0], expected)
+
+    _, cross = scipy_signal.csd(signals[1], signals[3], 1000, nperseg=256)
+    _, csd, _, _ = cross_spectral_matrix(signals, 1000, nperseg=256, pair_chunk=4)
+    np.testing.assert_allclose(csd[1, 3], cross)
+
+
+def test_band_coherence_reduced_per_block(signals):
+    freqs, coherence = coherence_matrix(signals, 1000, nperseg=256)
+    _, bands = coherence_matrix(signals, 1000, nperseg=256, pair_chunk=2, bands=FREQUENCY_BANDS)
+    for band_name, values in band_coherence(freqs, coherence).items():
+        np.testing.assert_allclose(bands[band_name], values)
+
+
+def test_chunked_envelopes_match_whole_signal():
+    pytest.importorskip('scipy.signal')
+    fs, n = 500.0, 15000
+    t = np.arange(n) / fs
+    rng = np.random.default_rng(1)
+    x = (np.sin(2 * np.pi * 2.5 * t) * (1 + 0.5 * np.sin(2 * np.pi * 0.2 * t))
+         + 0.5 * np.sin(2 * np.pi * 6 * t) + 0.3 * np.sin(2 * np.pi * 40 * t) + rng.standard_normal(n))
+    bank = FilterBank(fs, bands={name: FREQUENCY_BANDS[name] for name in ('delta', 'theta', 'gamma')})
+    whole = bank.envelopes(x)
+    chunk_size = 3000
+    chunked = bank.envelopes(x, chunk_size=chunk_size)
+    # The first and last chunk, where the block has no neighbouring data on one side.
+    edges = np.r_[0:chunk_size, n - chunk_size:n]
+    for name in bank.bands:
+        amplitude, phase = whole[name]
+        chunked_amplitude, chunked_phase = chunked[name]
+        np.testing.assert_array_less(np.abs(amplitude - chunked_amplitude)[edges], 0.02 * amplitude.std())
+        # Phase is only defined where there is some amplitude.
+        defined = edges[amplitude[edges] > 0.2 * np.median(amplitude)]
+        phase_error = np.abs(np.angle(np.exp(1j * (phase[defined] - chunked_phase[defined]))))
+        assert phase_error.max() < 0.02
@@ -0,0 +1,76 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import numpy as np
+import pytest
+
+from src.spike_trains import SpikeTrains
+
+
+@pytest.fixture
+def trains():
+    # Includes empty and single-spike units, as Allen probes have.
+    rng = np.random.default_rng(0)
+    counts = [50, 0, 1, 120, 7, 0, 33]
+    return {100 + k: np.sort(rng.uniform(0, 10, n)) for k, n in enumerate(counts)}
+
+
+def test_from_dict_matches_units(trains):
+    spikes = SpikeTrains.from_dict(trains, t_start=0.0, t_stop=10.0)
+    assert list(spikes) == list(trains) and len(spikes) == len(trains)
+    for unit_id, train in trains.items():
+        np.testing.assert_array_equal(spikes[unit_id], train)
+    np.testing.assert_array_equal(spikes.counts, [len(t) for t in trains.values()])
+    np.testing.assert_array_equal(spikes.unit_index(), np.repeat(np.arange(len(trains)), spikes.counts))
+
+
+def test_from_arrays_sorts_by_unit_then_time(trains):
+    times = np.concatenate(list(trains.values()))
+    indices = np.repeat(np.arange(len(trains)), [len(t) for t in trains.values()])
+    shuffle = np.random.default_rng(1).permutation(len(times))
+    spikes = SpikeTrains.from_arrays(times[shuffle], indices[shuffle], n_units=len(trains))
+    for k, train in enumerate(trains.values()):
+        np.testing.assert_array_equal(spikes[k], train)
+
+
+def test_isis_match_per_unit_diff(trains):
+    spikes = SpikeTrains.from_dict(trains)
+    reference = [np.diff(train) for train in trains.values()]
+    np.testing.assert_array_equal(spikes.isis(), np.concatenate(reference))
+    isis, units = spikes.isis(max_isi=0.2, return_units=True)
+    expected_units = np.concatenate([np.full(len(r), k) for k, r in enumerate(reference)])
+    keep = np.concatenate(reference) < 0.2
+    np.testing.assert_array_equal(isis, np.concatenate(reference)[keep])
+    np.testing.assert_array_equal(units, expected_units[keep])
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 50, 51, 64, 10_000])
+def test_iter_isis_chunk_boundaries(trains, chunk_size):
+    # Small chunk sizes put boundaries inside units and on unit edges.
+    spikes = SpikeTrains.from_dict(trains)
+    reference = np.concatenate([np.diff(train) for train in trains.values()])
+    np.testing.assert_array_equal(np.concatenate(list(spikes.iter_isis(chunk_size=chunk_size))), reference)
+    chunked = np.concatenate(list(spikes.iter_isis(max_isi=0.1, chunk_size=chunk_size)))
+    np.testing.assert_array_equal(chunked, reference[reference < 0.1])
+
+
+def test_rates_and_cv(trains):
+    spikes = SpikeTrains.from_dict(trains, t_start=0.0, t_stop=10.0)
+    np.testing.assert_allclose(spikes.rates(), [len(t) / 10.0 for t in trains.values()])
+    # Without a duration, each unit's own first-to-last span; NaN below two spikes.
+    spikes = SpikeTrains.from_dict(trains)
+    expected = [len(t) / (t[-1] - t[0]) if len(t) > 1 else np.nan for t in trains.values()]
+    np.testing.assert_allclose(spikes.rates(), expected)
+    expected_cv = [np.std(np.diff(t)) / np.mean(np.diff(t)) if len(t) > 2 else np.nan for t in trains.values()]
+    np.testing.assert_allclose(spikes.cv(), expected_cv)
+
+
+def test_binned_counts_and_select(trains):
+    spikes = SpikeTrains.from_dict(trains, t_start=0.0, t_stop=10.0)
+    counts = spikes.binned_counts(0.5)
+    for k, train in enumerate(trains.values()):
+        np.testing.assert_array_equal(counts[k], np.histogram(train, bins=np.arange(0, 10.5, 0.5))[0])
+    subset = spikes.select([3, 0])
+    assert list(subset) == [103, 100]
+    np.testing.assert_array_equal(subset[103], trains[103])
+    np.testing.assert_array_equal(subset[100], trains[100])
@@ -0,0 +1,58 @@
+import argparse
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+import pytest
+
+from src.quantities import parse_quantity
+from src.sweep import BLAS_THREAD_VARIABLES, collect_sweep, expand_grid, point_seed
+
+
+def test_expand_grid_order():
+    points = expand_grid({'a': [1, 2], 'b': ['x', 'y', 'z']})
+    assert len(points) == 6
+    assert points[0] == {'a': 1, 'b': 'x'}
+    assert points[1] == {'a': 1, 'b': 'y'}
+    assert points[-1] == {'a': 2, 'b': 'z'}
+    assert expand_grid({}) == [{}]
+
+
+def test_point_seeds_stable_and_distinct():
+    seeds = [point_seed(7, index) for index in range(100)]
+    assert seeds == [point_seed(7, index) for index in range(100)]
+    assert len(set(seeds)) == 100
+    assert point_seed(8, 0) != point_seed(7, 0)
+
+
+def test_parse_quantity():
+    from brian2 import ms, mV, Hz
+    assert parse_quantity('3') == 3 and isinstance(parse_quantity('3'), int)
+    assert parse_quantity('0.5') == 0.5
+    assert parse_quantity('1e-3') == 0.001
+    assert parse_quantity('200*ms') == 200 * ms
+    assert parse_quantity('-65 mV') == -65 * mV
+    assert parse_quantity('10Hz') == 10 * Hz
+    for text in ('1+2', '__import__("os")', '().__class__', '5*minute', 'ms', ''):
+        with pytest.raises(ValueError):
+            parse_quantity(text)
+
+
+def test_parse_grid_argument():
+    from brian2 import ms
+    from run_sweep import parse_grid_argument
+    assert parse_grid_argument('duration=200*ms,500*ms') == ('duration', [200 * ms, 500 * ms])
+    assert parse_grid_argument('dopamine=0,0.5') == ('dopamine', [0, 0.5])
+    for text in ('dopamine', 'rate=1+1'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_grid_argument(text)
+
+
+def test_sweep_runs_points_and_restores_environment(monkeypatch):
+    for var in BLAS_THREAD_VARIABLES:
+        monkeypatch.delenv(var, raising=False)
+    monkeypatch.setenv('OMP_NUM_THREADS', '4')
+    results = collect_sweep('src.sweep:point_seed', {'base_seed': [1], 'index': [0, 1]}, n_workers=1)
+    assert [output for _, output in results] == [point_seed(1, 0), point_seed(1, 1)]
+    assert os.environ['OMP_NUM_THREADS'] == '4'
+    assert 'OPENBLAS_NUM_THREADS' not in os.environ
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from brian2 import NeuronGroup, Synapses, mV, ms, second
+
+from src.topology import (connect_from_edges, edge_population, get_topology, load_topology, node_population,
+                          save_topology, set_node_params, topology_key, uniform_delay)
+
+
+def random_topology(seed=0):
+    rng = np.random.default_rng(seed)
+    nodes = {'pre': node_population(30, 'lif', v_rest=rng.uniform(-0.07, -0.06, 30)),
+             'post': node_population(20, 'lif')}
+    n = 200
+    source, target = rng.integers(0, 30, n), rng.integers(0, 20, n)
+    edges = {
+        'varied': edge_population('pre', 'post', source, target, weight=rng.uniform(0, 1e-3, n),
+                                  delay=rng.uniform(1e-3, 5e-3, n), weight_unit='volt'),
+        'uniform': edge_population('pre', 'post', target, source % 20, weight=2e-4, delay=1.5e-3,
+                                   weight_unit='volt'),
+        'empty': edge_population('post', 'pre', [], []),
+    }
+    return nodes, edges
+
+
+def build_synapses(topology):
+    pre = NeuronGroup(30, 'v_rest : volt', threshold='False')
+    post = NeuronGroup(20, 'v : volt', threshold='False')
+    set_node_params(pre, topology['nodes']['pre'])
+    synapses = {}
+    for name in ('varied', 'uniform'):
+        edges = topology['edges'][name]
+        delay = uniform_delay(edges)
+        synapses[name] = Synapses(pre, post, 'w : volt', on_pre='v_post += w',
+                                  delay=None if delay is None else delay * second)
+        connect_from_edges(synapses[name], edges, weight='w')
+    empty = Synapses(post, pre, on_pre='v_rest_post += 0*mV')
+    assert connect_from_edges(empty, topology['edges']['empty']) == 0
+    return pre, synapses
+
+
+def test_saved_topology_connects_the_same_synapses(tmp_path):
+    nodes, edges = random_topology()
+    key = topology_key('test', 0)
+    path = save_topology(str(tmp_path / 'topology'), nodes, edges, key=key)
+    topology = load_topology(path, key)
+    assert topology['fingerprint'] == key
+    assert isinstance(topology['edges']['varied']['source'], np.memmap)
+    with pytest.raises(ValueError):
+        load_topology(path, topology_key('test', 1))
+
+    pre, synapses = build_synapses(topology)
+    np.testing.assert_allclose(pre.v_rest[:] / mV, nodes['pre']['params']['v_rest'] * 1e3)
+    for name, syn in synapses.items():
+        np.testing.assert_array_equal(syn.i[:], edges[name]['source'])
+        np.testing.assert_array_equal(syn.j[:], edges[name]['target'])
+        np.testing.assert_allclose(syn.w[:] / mV, edges[name]['weight'] * 1e3)
+        np.testing.assert_allclose(syn.delay[:] / ms, edges[name]['delay'] * 1e3)
+    assert uniform_delay(topology['edges']['varied']) is None
+    assert uniform_delay(topology['edges']['uniform']) == pytest.approx(1.5e-3)
+
+
+def test_get_topology_generates_once(tmp_path):
+    calls = []
+
+    def generate():
+        calls.append(1)
+        return random_topology()
+    key = topology_key('cached', 0)
+    first = get_topology(str(tmp_path), 'cached', key, generate)
+    second_load = get_topology(str(tmp_path), 'cached', key, generate)
+    assert len(calls) == 1
+    np.testing.assert_array_equal(first['edges']['varied']['target'], second_load['edges']['varied']['target'])
+
+
+def test_edges_must_fit_their_populations(tmp_path):
+    nodes, edges = random_topology()
+    edges['bad'] = edge_population('pre', 'post', [0], [20])
+    with pytest.raises(ValueError):
+        save_topology(str(tmp_path / 'bad'), nodes, edges)
+    edges['bad'] = edge_population('pre', 'missing', [0], [0])
+    with pytest.raises(ValueError):
+        save_topology(str(tmp_path / 'bad'), nodes, edges)
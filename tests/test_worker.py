@@ -0,0 +1,65 @@
+import json
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+from brian2 import Network, NeuronGroup, Quantity, Hz, mV, ms, nA, have_same_dimensions
+
+from src import worker
+from src.backend import configure_backend
+
+
+def test_values_round_trip_through_json():
+    value = {'weight': 1.5 * mV, 'rates': np.array([1.0, 2.5]) * Hz, 'current': [0.2 * nA, 3],
+             'times': (np.arange(3) * ms), 'seed': np.int64(7), 'array': np.eye(2), 'name': 'x', 'none': None}
+    decoded = worker.decode_value(json.loads(json.dumps(worker.encode_value(value))))
+    for name in ('weight', 'rates', 'times'):
+        assert isinstance(decoded[name], Quantity)
+        assert have_same_dimensions(decoded[name], value[name])
+        np.testing.assert_array_equal(np.asarray(decoded[name]), np.asarray(value[name]))
+    assert decoded['current'][0] == 0.2 * nA and decoded['current'][1] == 3
+    assert decoded['seed'] == 7 and decoded['array'] == [[1.0, 0.0], [0.0, 1.0]]
+    assert decoded['name'] == 'x' and decoded['none'] is None
+
+
+def test_model_key_ignores_branchable_values():
+    params = {'duration': 200 * ms, 'dopamine': 0.0, 'input_weight': 25 * mV}
+    key = worker.model_key('neuromodulation', params)
+    assert worker.model_key('neuromodulation', {**params, 'dopamine': 0.8, 'input_weight': 30 * mV}) == key
+    # Structural parameters, and the shape of branchable ones, select another model.
+    assert worker.model_key('neuromodulation', {**params, 'duration': 300 * ms}) != key
+    assert worker.model_key('neuromodulation', {**params, 'dopamine': [0.0, 0.5]}) != key
+    assert worker.model_key('one_back', params) != key
+
+
+def build_toy(size=1):
+    group = NeuronGroup(size, 'dv/dt = 1/second : 1', method='euler')
+    return {'network': Network(group), 'outputs': [], 'group': group}
+
+
+@pytest.fixture
+def toy_worker(monkeypatch):
+    configure_backend('numpy')
+    monkeypatch.setitem(worker.MODELS, 'toy', {'build': f'{__name__}:build_toy'})
+    monkeypatch.setitem(worker._worker, 'models', OrderedDict())
+    monkeypatch.setitem(worker._worker, 'max_models', 2)
+    return worker._worker['models']
+
+
+def test_get_model_restores_and_evicts_least_recent(toy_worker):
+    first, reused = worker._get_model('toy', {'size': 1}, 'a')
+    assert not reused
+    first['network'].run(1 * ms)
+    assert first['group'].v[0] > 0
+    again, reused = worker._get_model('toy', {'size': 1}, 'a')
+    # The same network, back at the state it was built with.
+    assert reused and again is first
+    assert first['group'].v[0] == 0 and float(first['network'].t) == 0
+
+    worker._get_model('toy', {'size': 2}, 'b')
+    # Using 'a' makes 'b' the least recently used, so 'c' evicts it.
+    worker._get_model('toy', {'size': 1}, 'a')
+    worker._get_model('toy', {'size': 3}, 'c')
+    assert list(toy_worker) == ['a', 'c']
+    _, reused = worker._get_model('toy', {'size': 2}, 'b')
+    assert not reused and list(toy_worker) == ['c', 'b']